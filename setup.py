@@ -60,10 +60,12 @@ class Setup:
             json.dump(hosts, f)
         print('Successfully built src/lib/hosts.json!')
 
-    def build_test_data_sample(self):
-        """ Populate the src/lib/random_docs with randomized JSON documents """
+    def build_test_data_sample(self, num_docs=5000, processes=None):
+        """ Populate the src/lib/random_docs_corpus packed corpus with randomized JSON documents;
+        generation is split across processes (default: one per CPU core), each writing its own shard """
         gen = RandomDocumentGenerator(verbose=False)
-        gen.generate_random_docs(num_docs=5000, doc_size=50, key_size=30, value_size=30)
+        gen.generate_random_docs(num_docs=num_docs, doc_size=50, key_size=30, value_size=30, packed=True,
+            processes=processes or os.cpu_count())
 
 if __name__ == "__main__":
     setup = Setup()
@@ -2,13 +2,42 @@
 (e.g. with AWS EC2) and simply provide their addresses to the driver as --host <IP1> --host <IP2> ... --host <IPN>"""
 
 import argparse
+import json
 import logging
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from lib.Analyzer import Analyzer
 from lib.ClusterManager import ClusterManager
+from lib.ConnectionRegistry import ConnectionRegistry
 from lib.DataManager import DataManager
+from lib.ExperimentMatrix import COST_BUCKET, COST_CLUSTER, ExperimentJournal, ExperimentMatrix, get_cell_id
+from lib.FakeCouchbase import FakeBackend
+from lib.HealthProbe import HealthProbe, PROBE_MODES, PROBE_OFF, PROBE_WARN
+from lib.HostPool import CellQueue, partition_hosts, plan_partitions
+from lib.LiveLoad import LiveLoad
+from lib.Operations import COMPRESSION_MODES, PAYLOAD_MODES, PAYLOAD_MODE_ENCODE, SAMPLING_MODES, SAMPLING_RESERVOIR
+from lib.PhraseVocabulary import PhraseVocabulary
+from lib.ServiceLayout import DEFAULT_MAX_LAYOUTS
 from pathlib import Path
 
+# 100 KB to 5 MB opaque binary values
+DEFAULT_BINARY_VALUE_SIZES = [100 * 1024, 250 * 1024, 500 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2]
+# 0 (documents at their natural size), then 256 B to 1 MB document sizes, log-spaced
+DEFAULT_DOC_SIZES = [0] + [256 * 4 ** i for i in range(7)]
+# bucket label -> Driver attribute holding its number of documents
+HOMOGENEOUS_BUCKETS = {
+    'small-bucket': 'small_data_sample_size',
+    'medium-bucket': 'medium_data_sample_size',
+    'large-bucket': 'large_data_sample_size',
+}
+HETEROGENEOUS_BUCKET_NAME = 'multidim-scaling-test-bucket'
+YCSB_BUCKET_NAME = 'ycsb_test_bucket'
+# YCSB cluster: 4 followers + 1 (leader)
+YCSB_CLUSTER_SIZE = 5
+# services started on a cluster leader
+LEADER_SERVICES = ['data', 'index', 'query', 'fts']
+
 class Driver:
     def __init__(self, username="", password="", verbose=False,
                  data_sample_size=1000,
@@ -17,13 +46,50 @@ class Driver:
                  large_data_sample_size=5000,
                  operation_sample_size=100,
                  default_scope="default_scope",
-                 default_collection="default_collection"):
-        self.cluster_manager = ClusterManager(username, password, verbose)
+                 default_collection="default_collection",
+                 document_seed=None,
+                 payload_mode=PAYLOAD_MODE_ENCODE,
+                 phrase_vocabulary=None,
+                 doc_sizes=None,
+                 document_schema=None,
+                 reuse_datasets=False,
+                 load_workers=8,
+                 load_batch_size=500,
+                 measured_insert_count=None,
+                 sampling_mode=SAMPLING_RESERVOIR,
+                 health_probe_mode=PROBE_WARN,
+                 probe_attempts=10,
+                 fake_backend=None,
+                 hosts=None):
+        # constructor arguments, to build one Driver per host partition (see run_partitioned)
+        self.options = {name: value for name, value in locals().items() if name != 'self'}
+        # in-process stand-in for the cluster (see FakeCouchbase): SDK and management calls go to it
+        self.fake_backend = fake_backend
+        # one registry of SDK connections shared by both managers: each endpoint is bootstrapped once
+        self.connection_registry = ConnectionRegistry(username, password, verbose, backend=fake_backend)
+        self.cluster_manager = ClusterManager(username, password, verbose,
+            connection_registry=self.connection_registry, hosts=hosts,
+            admin_client=fake_backend.get_admin_client(username=username, password=password, verbose=verbose)
+            if fake_backend else None)
+        leader_address = self.cluster_manager.get_public_address(self.cluster_manager.get_leader())
+        if fake_backend:
+            # the hosts are not reachable over TCP, so there is no network to probe
+            health_probe_mode = PROBE_OFF
         # Tell the data manager what the public address of the cluster leader is
         self.data_manager = DataManager(username=username, password=password, verbose=verbose,
-            leader_address=self.cluster_manager.get_public_address(self.cluster_manager.get_leader()))
+            leader_address=leader_address,
+            document_seed=document_seed, payload_mode=payload_mode, phrase_vocabulary=phrase_vocabulary,
+            document_schema=document_schema,
+            load_workers=load_workers, load_batch_size=load_batch_size, sampling_mode=sampling_mode,
+            connection_registry=self.connection_registry,
+            admin_client=fake_backend.get_admin_client(address=leader_address, username=username,
+                password=password, verbose=verbose) if fake_backend else None)
+        # checks reachability, service health and network RTT before each sweep cell
+        self.health_probe = HealthProbe(cluster_manager=self.cluster_manager, attempts=probe_attempts,
+            mode=health_probe_mode, verbose=verbose)
         self.admin_username = username
         self.admin_password = password
+        self.verbose = verbose
         self.data_sample_size = data_sample_size
         self.operation_sample_size = operation_sample_size
         self.small_data_sample_size = small_data_sample_size
@@ -31,6 +97,16 @@ class Driver:
         self.large_data_sample_size = large_data_sample_size
         self.default_scope = default_scope
         self.default_collection = default_collection
+        # target document sizes (bytes) to sweep in the homogeneous test framework; None = single default corpus
+        self.doc_sizes = doc_sizes if doc_sizes is not None else DEFAULT_DOC_SIZES
+        # keep loaded buckets between sweep cells and skip reloading when their dataset fingerprint matches
+        self.reuse_datasets = reuse_datasets
+        # number of recorded inserts run against a bucket already bulk loaded to its target size
+        self.measured_insert_count = measured_insert_count or operation_sample_size
+        # ExperimentMatrix being run by run_experiment, which setup times are reported to
+        self.experiment_matrix = None
+        # number of partitions the last partitioned run ran concurrently (see run_partitioned), if any
+        self.partitions = None
         self.setup_logging(verbose)
 
     def get_cluster_manager(self):
@@ -39,6 +115,9 @@ class Driver:
     def get_data_manager(self):
         return self.data_manager
 
+    def get_connection_registry(self):
+        return self.connection_registry
+
     def setup_logging(self, verbose):
         """ set up self.logger for Driver logging """
         self.logger = logging.getLogger('driver')
@@ -46,6 +125,9 @@ class Driver:
         handler = logging.StreamHandler()
         handler.setFormatter(formatter)
         self.prefix = {'prefix': 'DRIVER'}
+        # one Driver per host partition may share this logger; keep a single handler
+        for h in list(self.logger.handlers):
+            self.logger.removeHandler(h)
         self.logger.addHandler(handler)
         self.logger = logging.LoggerAdapter(self.logger, self.prefix)
         if verbose:
@@ -72,8 +154,10 @@ class Driver:
         scanproportion=0,
         insertproportion=0,
         requestdistribution='zipfian',
-        measurementtype='raw'
+        measurementtype='raw',
+        load=True
         ):
+        """ Run YCSB against the bucket; load the records first unless load=False (bucket already loaded) """
 
         if use_workload_template:
             # YCSB driven by config file
@@ -91,10 +175,11 @@ class Driver:
                 f'{properties}'
             )
 
-            process = subprocess.Popen(load_data_cmd.split())
-            output, error = process.communicate()
-            if error:
-                self.error(f'Error: {error}')
+            if load:
+                process = subprocess.Popen(load_data_cmd.split())
+                output, error = process.communicate()
+                if error:
+                    self.error(f'Error: {error}')
             run_workload_cmd = (
                 f'ycsb/bin/ycsb run couchbase2 -s -P ycsb/workloads/workload{workload} '
                 f'{properties}'
@@ -121,10 +206,11 @@ class Driver:
                 f' -p measurementtype={measurementtype} '
             )
             load_data_cmd =  f'ycsb/bin/ycsb load couchbase2 -s {properties}'
-            process = subprocess.Popen(load_data_cmd.split())
-            output, error = process.communicate()
-            if error:
-                self.error(f'Error: {error}')
+            if load:
+                process = subprocess.Popen(load_data_cmd.split())
+                output, error = process.communicate()
+                if error:
+                    self.error(f'Error: {error}')
             run_workload_cmd = f'ycsb/bin/ycsb run couchbase2 -s {properties}'
         process = subprocess.Popen(run_workload_cmd.split(), stdout=subprocess.PIPE)
         output, error = process.communicate()
@@ -132,268 +218,661 @@ class Driver:
             self.error(f'Error: {error}')
         return output.decode()
 
-    def run_ycsb(self):
+    def run_ycsb(self, resume=False):
         """ Use YCSB to analyze performance of various cluster configurations """
-        NUM_FOLLOWERS = 4
-        CLUSTER_SIZE = NUM_FOLLOWERS + 1 # (leader)
-        BUCKET_NAME = 'ycsb_test_bucket'
-        self.cluster_manager.setup_cluster_colocated_services( cluster_size=CLUSTER_SIZE )
-        self.cluster_manager.fix_leader_address() # switch leader from private IP to public DNS; YCSB won't work otherwise
-        self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
+        return self.run_experiment(self.get_ycsb_matrix(), resume=resume)
+
+    def get_ycsb_matrix(self):
+        # insert-only runs go last: they add records past recordcount, so the loaded dataset can be
+        # reused by the update and read runs before it and is dropped after it
+        return ExperimentMatrix(experiment='ycsb', dimensions={
+            'recordcount': [3000],
+            'fieldcount': [10],
+            'fieldlength': [10, 100],  # num bytes for each field
+            'requestdistribution': ['uniform'],  # 'zipfian', 'hotspot' after finding that RD has small effect
+            'operation': ['update', 'read', 'insert'],
+        }, costs={'recordcount': COST_BUCKET, 'fieldcount': COST_BUCKET, 'fieldlength': COST_BUCKET},
+            verbose=self.verbose)
+
+    def prepare_ycsb(self, matrix=None):
+        # switch leader from private IP to public DNS; YCSB won't work otherwise. Done before the followers are
+        # added so a lone leader can simply be renamed instead of removed and re-added (two rebalances)
+        self.cluster_manager.fix_leader_address()
+        self.cluster_manager.setup_cluster_colocated_services(cluster_size=YCSB_CLUSTER_SIZE)
+        self.data_manager.drop_bucket(bucket_name=YCSB_BUCKET_NAME)
+        return self.run_ycsb_cell, None
+
+    def run_ycsb_cell(self, recordcount=3000, fieldcount=10, fieldlength=100, requestdistribution='uniform',
+            operation='update'):
+        """ One YCSB run with operation ('read', 'update', 'scan' or 'insert') as its only operation type """
+        BUCKET_NAME = YCSB_BUCKET_NAME
+        op_pro = {operation: 1}
+        fieldlength_bytes = fieldlength
+        self.data_manager.create_bucket(bucket_name=BUCKET_NAME, bucket_ram_quota_mb=1024, bucket_replicas=0)
+        self.cluster_manager.create_user_for_bucket(username=BUCKET_NAME, password=BUCKET_NAME, bucket_name=BUCKET_NAME)
+        self.data_manager.create_primary_index(bucket_name=BUCKET_NAME, using_ycsb=True)
+        self.data_manager.create_scope(scope_name=self.default_scope, bucket_name=BUCKET_NAME)
+        self.data_manager.create_collection(bucket_name=BUCKET_NAME, scope_name=self.default_scope, collection_name=self.default_collection)
+        # YCSB loads the _default collection; records depend only on these properties
+        ycsb_fingerprint = {
+            'ycsb_recordcount': recordcount,
+            'ycsb_fieldcount': fieldcount,
+            'ycsb_fieldlength': fieldlength_bytes,
+        }
+        already_loaded = self.reuse_datasets and self.data_manager.dataset_matches(
+            bucket_name=BUCKET_NAME, fingerprint=ycsb_fingerprint,
+            scope_name='_default', collection_name='_default')
+        if already_loaded:
+            self.info(f'{BUCKET_NAME} already holds the YCSB records {ycsb_fingerprint}; skipping load')
+        output = self._ycsb(
+            use_workload_template=False,
+            host=self.cluster_manager.get_leader_address(),
+            bucket=BUCKET_NAME,
+            password=BUCKET_NAME,
+            persistTo=0,
+            replicateTo=0,
+            fieldcount=fieldcount,
+            fieldlength=fieldlength_bytes,
+            recordcount=recordcount,
+            operationcount=recordcount,
+            readproportion=op_pro.get('read',0),
+            updateproportion=op_pro.get('update',0),
+            scanproportion=op_pro.get('scan',0),
+            insertproportion=op_pro.get('insert',0),
+            requestdistribution=requestdistribution,
+            measurementtype="raw",
+            load=not already_loaded
+        )
 
-        operation_proportions = [
-            {
-                'insert': 1,
-            },
-            {
-                'update': 1,
-            },
-            {
-                'read': 1
-            }
-        ]
-
-        for recordcount in [3000]: #[1000, 10000]:
-            for fieldcount in [10]: # , 500]:
-                for fieldlength_bytes in [10 , 100]: # num bytes for each field
-                    for requestdistribution in ['uniform']: #'zipfian', 'hotspot']: after finding that RD has small effect
-                        for op_pro in operation_proportions:
-                            self.data_manager.create_bucket(bucket_name=BUCKET_NAME, bucket_ram_quota_mb=1024, bucket_replicas=0)
-                            self.cluster_manager.create_user_for_bucket(username=BUCKET_NAME, password=BUCKET_NAME, bucket_name=BUCKET_NAME)
-                            self.data_manager.create_primary_index(bucket_name=BUCKET_NAME, using_ycsb=True)
-                            self.data_manager.create_scope(scope_name=self.default_scope, bucket_name=BUCKET_NAME)
-                            self.data_manager.create_collection(bucket_name=BUCKET_NAME, scope_name=self.default_scope, collection_name=self.default_collection)
-                            output = self._ycsb(
-                                use_workload_template=False,
-                                host=self.cluster_manager.get_leader_address(),
-                                bucket=BUCKET_NAME,
-                                password=BUCKET_NAME,
-                                persistTo=0,
-                                replicateTo=0,
-                                fieldcount=fieldcount,
-                                fieldlength=fieldlength_bytes,
-                                recordcount=recordcount,
-                                operationcount=recordcount,
-                                readproportion=op_pro.get('read',0),
-                                updateproportion=op_pro.get('update',0),
-                                scanproportion=op_pro.get('scan',0),
-                                insertproportion=op_pro.get('insert',0),
-                                requestdistribution=requestdistribution,
-                                measurementtype="raw"
-                            )
-
-                            ycsb_output_filename = (
-                                f'csz{CLUSTER_SIZE + 1}'
-                                f'-rc{recordcount}'
-                                f'-fc{fieldcount}'
-                                f'-fl{fieldlength_bytes}'
-                                f'-rd{requestdistribution}'
-                                f'-r{op_pro.get("read",0)}'
-                                f'-u{op_pro.get("update",0)}'
-                                f'-s{op_pro.get("scan",0)}'
-                                f'-i{op_pro.get("insert",0)}.data'
-                            )
-
-                            ycsb_log_folder = 'lib/data/ycsb-results'
-                            Path(ycsb_log_folder).mkdir(parents=True, exist_ok=True)
-                            with open(f'{ycsb_log_folder}/{ycsb_output_filename}', 'w') as f:
-                                f.write(output)
-                            self.info(output)
-                            # Flush bucket at the end, otherwise you get duplicate document error
-                            self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
-
-    def run_test_framework_heterogeneous_service_layouts(self):
+        ycsb_output_filename = (
+            f'csz{YCSB_CLUSTER_SIZE + 1}'
+            f'-rc{recordcount}'
+            f'-fc{fieldcount}'
+            f'-fl{fieldlength_bytes}'
+            f'-rd{requestdistribution}'
+            f'-r{op_pro.get("read",0)}'
+            f'-u{op_pro.get("update",0)}'
+            f'-s{op_pro.get("scan",0)}'
+            f'-i{op_pro.get("insert",0)}.data'
+        )
+
+        ycsb_log_folder = 'lib/data/ycsb-results'
+        Path(ycsb_log_folder).mkdir(parents=True, exist_ok=True)
+        with open(f'{ycsb_log_folder}/{ycsb_output_filename}', 'w') as f:
+            f.write(output)
+        self.info(output)
+        if self.reuse_datasets and not op_pro.get('insert', 0):
+            # updates and reads leave the record set unchanged; keep it for the next run
+            self.data_manager.write_dataset_fingerprint(
+                bucket_name=BUCKET_NAME, fingerprint=ycsb_fingerprint,
+                scope_name='_default', collection_name='_default')
+        else:
+            # Flush bucket at the end, otherwise you get duplicate document error
+            self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
+
+    def run_test_framework_heterogeneous_service_layouts(self, layout_edition=None, max_layouts=DEFAULT_MAX_LAYOUTS,
+            resume=False):
         """ Analyze the impact of increasingly tuning durability within Couchbase cluster on operation latency;
-        Higher durability should cause longer latencies. """
+        Higher durability should cause longer latencies. With layout_edition, sweep every valid layout
+        of that edition (at most max_layouts, see ClusterManager.get_service_layouts) instead of the fixed
+        scaling families. """
+        return self.run_experiment(self.get_heterogeneous_matrix(layout_edition, max_layouts=max_layouts),
+                                   resume=resume)
+
+    def get_heterogeneous_matrix(self, layout_edition=None, max_layouts=DEFAULT_MAX_LAYOUTS):
         # https://docs.couchbase.com/python-sdk/current/howtos/kv-operations.html#durability
         # (majority, majorityAndPersistToActive, persistToMajority)
+        # service layouts are resolved when the experiment starts ('all' = every layout of get_service_layouts)
+        return ExperimentMatrix(experiment='heterogeneous', dimensions={
+            'service_layout': 'all',
+            'durability_level': ['medium'],
+            'num_docs': [200],
+        }, settings={'layout_edition': layout_edition, 'max_layouts': max_layouts},
+            costs={'service_layout': COST_CLUSTER}, verbose=self.verbose)
+
+    def prepare_heterogeneous(self, matrix=None):
+        # no clear_cluster: each layout is reached from the previous one by changing only the nodes that differ
+        self.service_layouts = {slayout.get_simple_name(): slayout for slayout in
+            self.cluster_manager.get_service_layouts(edition=matrix.settings.get('layout_edition'),
+                max_layouts=matrix.settings.get('max_layouts', DEFAULT_MAX_LAYOUTS))}
+        if matrix.dimensions.get('service_layout', 'all') == 'all':
+            matrix.dimensions['service_layout'] = list(self.service_layouts)
+        # Drop bucket at the end
+        return self.run_heterogeneous_cell, lambda: self.data_manager.drop_bucket(bucket_name=HETEROGENEOUS_BUCKET_NAME)
+
+    def run_heterogeneous_cell(self, service_layout="", durability_level='medium', num_docs=200):
+        """ One service layout (by simple name) of the heterogeneous sweep, on a cluster of all available hosts """
         # set cluster size to use all available hosts
         CLUSTER_SIZE = self.cluster_manager.get_max_cluster_size()
-        DURABILITY_LEVEL = 'medium'
-        BUCKET_NAME = 'multidim-scaling-test-bucket'
-        BUCKET_NUM_DOCS = 200
-        self.cluster_manager.clear_cluster()
-        service_layouts = self.cluster_manager.get_service_layouts()
-        for slayout in service_layouts:
+        DURABILITY_LEVEL = durability_level
+        BUCKET_NAME = HETEROGENEOUS_BUCKET_NAME
+        BUCKET_NUM_DOCS = num_docs
+        slayout = self.service_layouts[service_layout]
+        self.info(
+            f'\n'
+            f'#####################################################################\n'
+            f'################# DURABILITY_LVL={DURABILITY_LEVEL} #################\n'
+            f'################# CLUSTER_SIZE={CLUSTER_SIZE} #######################\n'
+            f'#### BUCKET_SIZE={BUCKET_NAME} (docs={BUCKET_NUM_DOCS}) #############\n'
+            f'################# SVC_LAYOUT={slayout} ##############################\n'
+            f'#####################################################################\n'
+            f'\n'
+        )
+        start = time.time()
+        self.cluster_manager.setup_cluster_with_service_layout(slayout)
+        self.record_setup(COST_CLUSTER, time.time() - start)
+        self.health_probe.run(layout=slayout.get_simple_name(), cluster_size=CLUSTER_SIZE)
+        self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
+        self.data_manager.create_bucket(
+            bucket_name=BUCKET_NAME,
+            bucket_ram_quota_mb=1024,
+            bucket_replicas=0)
+        self.data_manager.create_scope(
+            scope_name=self.default_scope,
+            bucket_name=BUCKET_NAME)
+        self.data_manager.create_primary_index(bucket_name=BUCKET_NAME)
+
+        self.data_manager.create_collection(
+            bucket_name=BUCKET_NAME,
+            scope_name=self.default_scope,
+            collection_name=self.default_collection)
+
+        # Insert (DATA_SAMPLE_SIZE times)
+        self.data_manager.run_inserts(
+            cluster_size=CLUSTER_SIZE,
+            bucket_name=BUCKET_NAME,
+            num_docs=BUCKET_NUM_DOCS,
+            operations_to_record=self.operation_sample_size,
+            durability_level=DURABILITY_LEVEL,
+            service_layout=slayout
+            )
+
+        # N1QL Query (OPERATION_SAMPLE_SIZE times)
+        self.data_manager.run_n1ql_selects(
+            cluster_size=CLUSTER_SIZE,
+            bucket_name=BUCKET_NAME,
+            operations_to_record=self.operation_sample_size,
+            durability_level=DURABILITY_LEVEL,
+            service_layout=slayout
+        )
+
+        # Full Text Search (.search()) (OPERATION_SAMPLE_SIZE times)
+        self.data_manager.run_full_text_searches(
+            cluster_size=CLUSTER_SIZE,
+            bucket_name=BUCKET_NAME,
+            operations_to_record=self.operation_sample_size,
+            durability_level=DURABILITY_LEVEL,
+            service_layout=slayout
+        )
+
+        # Update (OPERATION_SAMPLE_SIZE times)
+        self.data_manager.run_updates(
+            cluster_size=CLUSTER_SIZE,
+            bucket_name=BUCKET_NAME,
+            operations_to_record=self.operation_sample_size,
+            durability_level=DURABILITY_LEVEL,
+            service_layout=slayout
+        )
+
+        # Delete (OPERATION_SAMPLE_SIZE times)
+        self.data_manager.delete_docs_in_bucket(
+            cluster_size=CLUSTER_SIZE,
+            bucket_name=BUCKET_NAME,
+            operations_to_record=self.operation_sample_size,
+            durability_level=DURABILITY_LEVEL,
+            service_layout=slayout
+        )
+
+    def run_payload_encoding_comparison(self, cluster_size=0, durability_level='low'):
+        """ Measure insert and update latency with encode-on-call payloads (SDK JSON-encodes a dict inside the
+        timed call) against pre-encoded payloads (JSON bytes through the raw JSON transcoder) on the same cluster,
+        to show how much client-side serialization counts toward reported latency. """
+        BUCKET_NAME = 'payload-encoding-test-bucket'
+        original_payload_mode = self.data_manager.payload_mode
+        self.cluster_manager.setup_cluster_colocated_services(cluster_size=cluster_size)
+        for payload_mode in PAYLOAD_MODES:
             self.info(
                 f'\n'
                 f'#####################################################################\n'
-                f'################# DURABILITY_LVL={DURABILITY_LEVEL} #################\n'
-                f'################# CLUSTER_SIZE={CLUSTER_SIZE} #######################\n'
-                f'#### BUCKET_SIZE={BUCKET_NAME} (docs={BUCKET_NUM_DOCS}) #############\n'
-                f'################# SVC_LAYOUT={slayout} ##############################\n'
+                f'################# PAYLOAD_MODE={payload_mode},CLUSTER_SIZE={cluster_size+1} ############\n'
                 f'#####################################################################\n'
                 f'\n'
             )
-            self.cluster_manager.setup_cluster_with_service_layout(slayout)
+            self.data_manager.set_payload_mode(payload_mode)
             self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
-            self.data_manager.create_bucket(
-                bucket_name=BUCKET_NAME,
-                bucket_ram_quota_mb=1024,
-                bucket_replicas=0)
-            self.data_manager.create_scope(
-                scope_name=self.default_scope,
-                bucket_name=BUCKET_NAME)
-            self.data_manager.create_primary_index(bucket_name=BUCKET_NAME)
-
+            self.data_manager.create_bucket(bucket_name=BUCKET_NAME, bucket_ram_quota_mb=1024, bucket_replicas=0)
+            self.data_manager.create_scope(scope_name=self.default_scope, bucket_name=BUCKET_NAME)
             self.data_manager.create_collection(
                 bucket_name=BUCKET_NAME,
                 scope_name=self.default_scope,
                 collection_name=self.default_collection)
-
-            # Insert (DATA_SAMPLE_SIZE times)
             self.data_manager.run_inserts(
-                cluster_size=CLUSTER_SIZE,
+                cluster_size=cluster_size,
                 bucket_name=BUCKET_NAME,
-                num_docs=BUCKET_NUM_DOCS,
+                num_docs=self.small_data_sample_size,
                 operations_to_record=self.operation_sample_size,
-                durability_level=DURABILITY_LEVEL,
-                service_layout=slayout
-                )
-
-            # N1QL Query (OPERATION_SAMPLE_SIZE times)
-            self.data_manager.run_n1ql_selects(
-                cluster_size=CLUSTER_SIZE,
+                durability_level=durability_level)
+            self.data_manager.run_updates(
+                cluster_size=cluster_size,
                 bucket_name=BUCKET_NAME,
                 operations_to_record=self.operation_sample_size,
-                durability_level=DURABILITY_LEVEL,
-                service_layout=slayout
-            )
+                durability_level=durability_level)
+        self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
+        self.data_manager.set_payload_mode(original_payload_mode)
 
-            # Full Text Search (.search()) (OPERATION_SAMPLE_SIZE times)
-            self.data_manager.run_full_text_searches(
-                cluster_size=CLUSTER_SIZE,
-                bucket_name=BUCKET_NAME,
-                operations_to_record=self.operation_sample_size,
-                durability_level=DURABILITY_LEVEL,
-                service_layout=slayout
-            )
+    def run_binary_value_sweep(self, cluster_size=0, durability_level='low', value_sizes=None, compressibility=0.5):
+        """ Measure binary insert/update/get latency and bytes on the wire for opaque values of each size,
+        uncompressed and zlib-compressed on the client, on a cluster of colocated services. """
+        BUCKET_NAME = 'binary-value-test-bucket'
+        self.cluster_manager.setup_cluster_colocated_services(cluster_size=cluster_size)
+        self.data_manager.set_bucket_replica_number(new_replica_number=1 if cluster_size >= 1 else 0)
+        self.data_manager.create_bucket(bucket_name=BUCKET_NAME, bucket_replicas=1 if cluster_size >= 1 else 0)
+        self.data_manager.create_scope(scope_name=self.default_scope, bucket_name=BUCKET_NAME)
+        self.data_manager.create_collection(
+            bucket_name=BUCKET_NAME,
+            scope_name=self.default_scope,
+            collection_name=self.default_collection)
+        for compression in COMPRESSION_MODES:
+            for value_size in value_sizes or DEFAULT_BINARY_VALUE_SIZES:
+                self.info(
+                    f'\n'
+                    f'#####################################################################\n'
+                    f'######## COMPRESSION={compression},VALUE_SIZE={value_size},CLUSTER_SIZE={cluster_size+1} ########\n'
+                    f'#####################################################################\n'
+                    f'\n'
+                )
+                self.data_manager.run_binary_operations(
+                    cluster_size=cluster_size,
+                    bucket_name=BUCKET_NAME,
+                    value_size=value_size,
+                    compressibility=compressibility,
+                    compression=compression,
+                    operations_to_record=self.operation_sample_size,
+                    durability_level=durability_level)
+        self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
 
-            # Update (OPERATION_SAMPLE_SIZE times)
-            self.data_manager.run_updates(
-                cluster_size=CLUSTER_SIZE,
-                bucket_name=BUCKET_NAME,
-                operations_to_record=self.operation_sample_size,
-                durability_level=DURABILITY_LEVEL,
-                service_layout=slayout
-            )
+    def run_rebalance_sweep(self, replica_counts=None):
+        """ Measure how long a scale-out rebalance takes, and how many documents it moves, per (bucket size,
+        cluster size, replica count): starting from the leader alone with one loaded bucket, grow the cluster
+        one node at a time. Durations and progress time series go to the 'rebalance' and
+        'rebalance_progress' metrics, labelled with sweep='rebalance' """
+        BUCKET_NAME = 'rebalance-test-bucket'
+        for replicas in replica_counts or [0, 1, 2]:
+            for bucket_size_label, bucket_size_value in {
+                'small-bucket': self.small_data_sample_size,
+                'medium-bucket': self.medium_data_sample_size,
+                'large-bucket': self.large_data_sample_size
+            }.items():
+                self.info(
+                    f'\n'
+                    f'#####################################################################\n'
+                    f'######## REBALANCE: BUCKET_SIZE={bucket_size_label} (docs={bucket_size_value}),REPLICAS={replicas} ########\n'
+                    f'#####################################################################\n'
+                    f'\n'
+                )
+                # start every series from the leader alone
+                self.cluster_manager.setup_cluster_colocated_services(cluster_size=0)
+                self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
+                self.data_manager.set_bucket_replica_number(new_replica_number=replicas)
+                self.data_manager.create_bucket(bucket_name=BUCKET_NAME, bucket_replicas=replicas)
+                self.data_manager.create_scope(scope_name=self.default_scope, bucket_name=BUCKET_NAME)
+                self.data_manager.create_collection(
+                    bucket_name=BUCKET_NAME,
+                    scope_name=self.default_scope,
+                    collection_name=self.default_collection)
+                self.data_manager.load_dataset(bucket_name=BUCKET_NAME, num_docs=bucket_size_value)
+                for cluster_size in range(1, self.cluster_manager.get_max_cluster_size()):
+                    self.cluster_manager.setup_cluster_colocated_services(
+                        cluster_size=cluster_size,
+                        sweep='rebalance',
+                        bucket=bucket_size_label,
+                        num_docs=bucket_size_value,
+                        replicas=replicas)
+        self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
 
-            # Delete (OPERATION_SAMPLE_SIZE times)
-            self.data_manager.delete_docs_in_bucket(
-                cluster_size=CLUSTER_SIZE,
-                bucket_name=BUCKET_NAME,
-                operations_to_record=self.operation_sample_size,
-                durability_level=DURABILITY_LEVEL,
-                service_layout=slayout
-            )
-        # Drop bucket at the end
-        self.data_manager.drop_bucket(
-            bucket_name=BUCKET_NAME
+    def run_failover_recovery(self, cluster_size=None, baseline_seconds=30, settle_seconds=30, window_seconds=0.5):
+        """ Measure what clients feel during node maintenance: with steady background KV and N1QL load on a
+        full cluster of colocated services, gracefully fail over a follower and bring it back with delta
+        recovery, then hard fail it over, rebalance it out and rebalance it back in. Latency and errors are
+        written per time window with a marker at the start and end of each event to
+        lib/data/failover/cluster-size-N/ """
+        BUCKET_NAME = 'failover-test-bucket'
+        cluster_size = cluster_size or self.cluster_manager.get_max_cluster_size() - 1
+        services = "data,query,index,fts"
+        self.cluster_manager.setup_cluster_colocated_services(cluster_size=cluster_size)
+        # one replica so every failover keeps all data available
+        self.data_manager.set_bucket_replica_number(new_replica_number=1)
+        self.data_manager.create_bucket(bucket_name=BUCKET_NAME, bucket_replicas=1)
+        self.data_manager.create_scope(scope_name=self.default_scope, bucket_name=BUCKET_NAME)
+        self.data_manager.create_collection(
+            bucket_name=BUCKET_NAME,
+            scope_name=self.default_scope,
+            collection_name=self.default_collection)
+        self.data_manager.create_primary_index(bucket_name=BUCKET_NAME)
+        self.data_manager.load_dataset(bucket_name=BUCKET_NAME, num_docs=self.small_data_sample_size)
+        self.health_probe.run(scenario='failover', cluster_size=cluster_size + 1)
+        # never the leader: the client and admin client bootstrap through it
+        target = self.cluster_manager.get_dns_name(self.cluster_manager.get_followers()[cluster_size - 1])
+        live_load = LiveLoad(
+            data_manager=self.data_manager,
+            bucket_name=BUCKET_NAME,
+            num_docs=self.small_data_sample_size,
+            window_seconds=window_seconds,
+            verbose=self.verbose)
+
+        def event(name, action):
+            live_load.mark(f'{name}_start')
+            action()
+            live_load.mark(f'{name}_end')
+            time.sleep(settle_seconds)
+
+        live_load.start()
+        try:
+            time.sleep(baseline_seconds)
+            event('graceful_failover', lambda: self.cluster_manager.graceful_failover_node(node_dns_name=target))
+            event('delta_recovery', lambda: self.cluster_manager.recover_node(
+                node_dns_name=target, recovery_type='delta', scenario='failover'))
+            event('hard_failover', lambda: self.cluster_manager.hard_failover_node(node_dns_name=target))
+            event('rebalance_out', lambda: self.cluster_manager.remove_node_from_cluster(node_dns_name=target))
+            event('rebalance_in', lambda: self.cluster_manager.change_topology(
+                node_services={target: services}, scenario='failover'))
+        finally:
+            live_load.stop()
+            live_load.write(f'lib/data/failover/cluster-size-{cluster_size + 1}')
+        self.data_manager.drop_bucket(bucket_name=BUCKET_NAME)
+
+    def run_homogeneous_bucket_operations(self, cluster_size=0, bucket_size_label="", bucket_size_value=0,
+            durability_level="low"):
+        """ Create (or reuse) bucket_size_label on the current cluster, bulk load it to bucket_size_value documents
+        (unrecorded), then record insert, N1QL, FTS, update and delete latencies against the full bucket; flush
+        the bucket afterward. Measured inserts go past the end of the dataset and the deletes remove exactly
+        those. With reuse_datasets the load is skipped if the bucket already holds the dataset, and the bucket
+        is kept for the next cell instead of being flushed """
+        # if there's more than just the leader in the cluster, use data replication
+        num_replicas = 0
+        if cluster_size >= 1:
+            num_replicas = 1
+        self.data_manager.set_bucket_replica_number(
+            new_replica_number=num_replicas)
+        bucket = self.data_manager.create_bucket(
+            bucket_name=bucket_size_label,
+            bucket_replicas=num_replicas)
+        # create a scope, then a collection
+        scope = self.data_manager.create_scope(
+            scope_name=self.default_scope,
+            bucket_name=bucket_size_label)
+
+        # Create index on scope
+        self.data_manager.create_primary_index(
+            bucket_name=bucket_size_label)
+
+        collection = self.data_manager.create_collection(
+            bucket_name=bucket_size_label,
+            scope_name=self.default_scope,
+            collection_name=self.default_collection)
+
+        # Bulk load (DATA_SAMPLE_SIZE documents, not recorded)
+        start = time.time()
+        if self.data_manager.load_dataset(
+                bucket_name=bucket_size_label,
+                num_docs=bucket_size_value):
+            self.record_setup(COST_BUCKET, time.time() - start)
+
+        # Insert (MEASURED_INSERT_COUNT times, past the end of the dataset)
+        self.data_manager.run_inserts(
+            cluster_size=cluster_size,
+            bucket_name=bucket_size_label,
+            num_docs=self.measured_insert_count,
+            operations_to_record=self.measured_insert_count,
+            durability_level=durability_level,
+            key_offset=bucket_size_value)
+
+        # N1QL Query (OPERATION_SAMPLE_SIZE times)
+        self.data_manager.run_n1ql_selects(
+            cluster_size=cluster_size,
+            bucket_name=bucket_size_label,
+            operations_to_record=self.operation_sample_size,
+            durability_level=durability_level
+        )
+
+        # Full Text Search (.search()) (OPERATION_SAMPLE_SIZE times)
+        self.data_manager.run_full_text_searches(
+            cluster_size=cluster_size,
+            bucket_name=bucket_size_label,
+            operations_to_record=self.operation_sample_size,
+            durability_level=durability_level
+        )
+
+        # Update (OPERATION_SAMPLE_SIZE times)
+        self.data_manager.run_updates(
+            cluster_size=cluster_size,
+            bucket_name=bucket_size_label,
+            operations_to_record=self.operation_sample_size,
+            durability_level=durability_level
+        )
+
+        # Delete (the MEASURED_INSERT_COUNT inserted documents)
+        self.data_manager.delete_docs_in_bucket(
+            cluster_size=cluster_size,
+            bucket_name=bucket_size_label,
+            operations_to_record=self.measured_insert_count,
+            durability_level=durability_level,
+            key_offset=bucket_size_value
         )
+        if not self.reuse_datasets:
+            # Flush bucket at the end
+            self.data_manager.flush_bucket(
+                bucket_name=bucket_size_label)
 
-    def run_test_framework_homogeneous_service_layout(self):
+    def run_test_framework_homogeneous_service_layout(self, resume=False, partitioned=False):
         """ Analyze the impact of increasingly tuning durability within Couchbase cluster on operation latency;
         Higher durability should cause longer latencies. """
+        return self.run_experiment(self.get_homogeneous_matrix(), resume=resume, partitioned=partitioned)
+
+    def get_homogeneous_matrix(self):
         # https://docs.couchbase.com/python-sdk/current/howtos/kv-operations.html#durability
         # (majority, majorityAndPersistToActive, persistToMajority)
-        for durability_level in ['low', 'medium', 'high']:
+        # cluster size = 0 means just leader; 1 means leader + 1 node, 2=> leader + 2 nodes, 3 => leader + 3 nodes, etc.
+        # Durability is only a per-operation option, so the scheduler runs every durability level on a loaded
+        # bucket before moving on. Without reuse_datasets every cell flushes and reloads its bucket anyway, so
+        # only cluster resizes can be saved
+        costs = {'cluster_size': COST_CLUSTER}
+        if self.reuse_datasets:
+            costs.update({'bucket': COST_BUCKET, 'doc_size': COST_BUCKET})
+        return ExperimentMatrix(experiment='homogeneous', dimensions={
+            'durability_level': ['low', 'medium', 'high'],
+            'cluster_size': list(range(self.cluster_manager.get_max_cluster_size())),
+            'bucket': list(HOMOGENEOUS_BUCKETS),
+            # document size as an extra sweep dimension (schema-driven documents padded to doc_size bytes;
+            # None keeps the documents at their natural size)
+            'doc_size': [doc_size or None for doc_size in self.doc_sizes] or [None],
+        }, costs=costs, verbose=self.verbose)
+
+    def prepare_homogeneous(self, matrix=None):
+        return self.run_homogeneous_cell, None
+
+    def run_homogeneous_cell(self, durability_level='low', cluster_size=0, bucket='small-bucket', doc_size=None):
+        """ One bucket of the homogeneous sweep; the cluster is only set up again (and probed) when the cluster
+        size differs from the previous cell's """
+        if self.cell_topology != cluster_size:
             self.info(
                 f'\n'
                 f'#####################################################################\n'
-                f'################     DURABILITY={durability_level}      #######################\n'
+                f'################# DURABILITY={durability_level},CLUSTER_SIZE={cluster_size+1} ############\n'
                 f'#####################################################################\n'
                 f'\n'
             )
-            for cluster_size in range(self.cluster_manager.get_max_cluster_size()):
-                # cluster size = 0 means just leader; 1 means leader + 1 node, 2=> leader + 2 nodes, 3 => leader + 3 nodes, etc.
-                self.info(
-                    f'\n'
-                    f'#####################################################################\n'
-                    f'################# DURABILITY={durability_level},CLUSTER_SIZE={cluster_size+1} ############\n'
-                    f'#####################################################################\n'
-                    f'\n'
-                )
-                self.cluster_manager.setup_cluster_colocated_services(
-                    cluster_size=cluster_size)
-                for bucket_size_label, bucket_size_value in {
-                    'small-bucket': self.small_data_sample_size,
-                    'medium-bucket': self.medium_data_sample_size,
-                    'large-bucket': self.large_data_sample_size
-                }.items():
-                    self.info(
-                        f'\n'
-                        f'#####################################################################\n'
-                        f'############### DURABILITY={durability_level},CLUSTER_SIZE={cluster_size+1} ###############\n'
-                        f'############### BUCKET_SIZE={bucket_size_label} (docs={bucket_size_value}) ###############\n'
-                        f'#####################################################################\n'
-                        f'\n'
-                    )
-                    # if there's more than just the leader in the cluster, use data replication
-                    num_replicas = 0
-                    if cluster_size >= 1:
-                        num_replicas = 1
-                    self.data_manager.set_bucket_replica_number(
-                        new_replica_number=num_replicas)
-                    bucket = self.data_manager.create_bucket(
-                        bucket_name=bucket_size_label)
-                    self.data_manager.flush_bucket(
-                        bucket_name=bucket_size_label)
-                    # create a scope, then a collection
-                    scope = self.data_manager.create_scope(
-                        scope_name=self.default_scope,
-                        bucket_name=bucket_size_label)
-
-                    # Create index on scope
-                    self.data_manager.create_primary_index(
-                        bucket_name=bucket_size_label)
-
-                    collection = self.data_manager.create_collection(
-                        bucket_name=bucket_size_label,
-                        scope_name=self.default_scope,
-                        collection_name=self.default_collection)
-
-                    # Insert (DATA_SAMPLE_SIZE times)
-                    self.data_manager.run_inserts(
-                        cluster_size=cluster_size,
-                        bucket_name=bucket_size_label,
-                        num_docs=bucket_size_value,
-                        operations_to_record=self.operation_sample_size,
-                        durability_level=durability_level)
+            start = time.time()
+            self.cluster_manager.setup_cluster_colocated_services(
+                cluster_size=cluster_size)
+            self.record_setup(COST_CLUSTER, time.time() - start)
+            self.health_probe.run(durability=durability_level, cluster_size=cluster_size + 1)
+            self.cell_topology = cluster_size
+        bucket_size_value = getattr(self, HOMOGENEOUS_BUCKETS[bucket])
+        self.info(
+            f'\n'
+            f'#####################################################################\n'
+            f'############### DURABILITY={durability_level},CLUSTER_SIZE={cluster_size+1} ###############\n'
+            f'############### BUCKET_SIZE={bucket} (docs={bucket_size_value}) ###############\n'
+            f'#####################################################################\n'
+            f'\n'
+        )
+        if doc_size != self.data_manager.target_doc_size:
+            self.data_manager.set_target_doc_size(doc_size)
+        self.run_homogeneous_bucket_operations(
+            cluster_size=cluster_size,
+            bucket_size_label=bucket,
+            bucket_size_value=bucket_size_value,
+            durability_level=durability_level)
 
-                    # N1QL Query (OPERATION_SAMPLE_SIZE times)
-                    self.data_manager.run_n1ql_selects(
-                        cluster_size=cluster_size,
-                        bucket_name=bucket_size_label,
-                        operations_to_record=self.operation_sample_size,
-                        durability_level=durability_level
-                    )
+    def record_setup(self, level=COST_CLUSTER, seconds=0.0):
+        """ Report the wall time of a cluster resize or bucket load to the running experiment, if any """
+        if self.experiment_matrix:
+            self.experiment_matrix.record_setup(level, seconds)
 
-                    # Full Text Search (.search()) (OPERATION_SAMPLE_SIZE times)
-                    self.data_manager.run_full_text_searches(
-                        cluster_size=cluster_size,
-                        bucket_name=bucket_size_label,
-                        operations_to_record=self.operation_sample_size,
-                        durability_level=durability_level
-                    )
+    def run_experiment(self, matrix, resume=False, partitioned=False):
+        """ Run every cell of an ExperimentMatrix, journaling each one to disk. With resume, cells the journal
+        already records as done are skipped and the latency lines of an interrupted cell are truncated before it
+        runs again; without it, the journal starts over. With partitioned, cells run concurrently on independent
+        clusters carved out of the host pool (see run_partitioned). Return (cells run, cells skipped) """
+        journal = ExperimentJournal(matrix.get_journal_file(), resume=resume)
+        if partitioned and matrix.experiment != 'homogeneous':
+            self.info(f'{matrix.experiment} cells need the whole host pool; running them one at a time')
+            partitioned = False
+        run_cell, teardown = self.start_experiment(matrix, journal)
+        try:
+            if partitioned:
+                ran, skipped = self.run_partitioned(matrix, journal, run_cell)
+            else:
+                ran, skipped = matrix.run(run_cell, journal, on_cell_start=self.on_cell_start)
+        finally:
+            self.stop_experiment()
+        if teardown:
+            teardown()
+        self.info(f'Experiment {matrix.name}: ran {ran} cells, skipped {skipped} already done ({journal.journal_file})')
+        return ran, skipped
 
-                    # Update (OPERATION_SAMPLE_SIZE times)
-                    self.data_manager.run_updates(
-                        cluster_size=cluster_size,
-                        bucket_name=bucket_size_label,
-                        operations_to_record=self.operation_sample_size,
-                        durability_level=durability_level
-                    )
+    def start_experiment(self, matrix, journal):
+        """ Prepare this Driver to run the cells of matrix, its latency file appends journaled under the running
+        cell's id (see on_cell_start); return (run_cell, teardown) """
+        prepare = {
+            'homogeneous': Driver.prepare_homogeneous,
+            'heterogeneous': Driver.prepare_heterogeneous,
+            'ycsb': Driver.prepare_ycsb,
+        }[matrix.experiment]
+        # cluster size the cluster is currently set up for; unknown at the start
+        self.cell_topology = None
+        self.current_cell_id = None
+        run_cell, teardown = prepare(self, matrix)
+        self.experiment_matrix = matrix
+        self.data_manager.database_operation_commander.on_append = (
+            lambda file_name, offset: journal.record_append(self.current_cell_id, file_name, offset))
+        return run_cell, teardown
 
-                    # Delete (OPERATION_SAMPLE_SIZE times)
-                    self.data_manager.delete_docs_in_bucket(
-                        cluster_size=cluster_size,
-                        bucket_name=bucket_size_label,
-                        operations_to_record=self.operation_sample_size,
-                        durability_level=durability_level
-                    )
-                    # Flush bucket at the end
-                    self.data_manager.flush_bucket(
-                        bucket_name=bucket_size_label)
+    def on_cell_start(self, cell_id=""):
+        self.current_cell_id = cell_id
+
+    def stop_experiment(self):
+        self.data_manager.database_operation_commander.on_append = None
+        self.experiment_matrix = None
+
+    def get_partition_driver(self, hosts=None, index=0, partitions=1):
+        """ A Driver of its own (ClusterManager, DataManager, connections) with this Driver's settings, for one
+        partition of the host pool. Partition 0 keeps this Driver's leader; the others initialize theirs. Its
+        latencies are filed under partitions-<partitions> (see DataManager.init_data_file) """
+        fake_backend = self.fake_backend.new_cluster() if self.fake_backend and index else self.fake_backend
+        driver = Driver(**dict(self.options, hosts=hosts, fake_backend=fake_backend))
+        driver.prefix['prefix'] = f'DRIVER p{index}'
+        driver.data_manager.set_partitions(partitions)
+        if index:
+            driver.cluster_manager.init_cluster(services=LEADER_SERVICES)
+        return driver
+
+    def merge_partitions(self, drivers):
+        """ Make the host pool one cluster again after run_partitioned: every partition drops its buckets and
+        releases its followers, then the leaders of partitions 1.. (single-node clusters of their own until now)
+        join this Driver's cluster and are ejected with the other followers, which resets them. Raise if a host
+        cannot be brought back """
+        for index, driver in enumerate(drivers):
+            driver.connection_registry.close()
+            driver.cluster_manager.clear_cluster()
+            if not index:
+                # partition 0 is this Driver's cluster; its buckets are kept like after any other run
+                continue
+            admin_client = driver.cluster_manager.get_admin_client()
+            for bucket_name in admin_client.get_buckets():
+                admin_client.delete_bucket(bucket_name=bucket_name)
+        admin_client = self.cluster_manager.get_admin_client()
+        for driver in drivers[1:]:
+            admin_client.add_node(hostname=self.cluster_manager.get_dns_name(driver.cluster_manager.get_leader()),
+                services=['data'])
+        admin_client.rebalance()
+        self.cluster_manager.clear_cluster()
+        if self.cluster_manager.get_member_followers():
+            raise Exception(f'Could not release hosts {self.cluster_manager.get_member_followers()} after the '
+                            f'partitioned run')
+
+    def run_partitioned(self, matrix, journal, run_cell):
+        """ Split the host pool into equal partitions, each an independent cluster driven by its own Driver, and
+        run the cells on them concurrently, handed out by a CellQueue packed by the hosts each cell needs (see
+        HostPool). Cells needing more hosts than a partition run first, one at a time on the whole pool, whose
+        followers are then released to the partitions. Return (cells run, cells skipped) """
+        cells = matrix.get_run_cells()
+        pending = [cell for cell in cells if not journal.is_done(get_cell_id(matrix.experiment, cell))]
+        hosts = self.cluster_manager.hosts
+        # cluster size = 0 means just leader
+        get_nodes = lambda cell: cell['cluster_size'] + 1
+        partition_size, num_partitions, slots = plan_partitions(len(hosts), [get_nodes(cell) for cell in pending])
+        if num_partitions < 2:
+            if pending:
+                self.info(f'No cell fits twice in {len(hosts)} hosts; running the cells one at a time')
+            return matrix.run(run_cell, journal, on_cell_start=self.on_cell_start)
+        wide = [cell for cell in pending if get_nodes(cell) > partition_size]
+        self.partitions = num_partitions
+        self.info(f'Partitioning {len(hosts)} hosts into {num_partitions} clusters of {partition_size}: '
+                  f'{len(pending)} cells in ~{slots} cell slots instead of {len(pending)} '
+                  f'({len(wide)} of them on the whole pool)')
+        start = time.time()
+        cell_seconds = []
+        for index, cell in enumerate(wide):
+            cell_seconds.append(matrix.execute_cell(cell, run_cell, journal, self.on_cell_start,
+                position=f'{index + 1}/{len(wide)} on the whole pool'))
+        # release the followers so they can join the partition clusters
+        self.cluster_manager.clear_cluster()
+        queue = CellQueue([cell for cell in pending if get_nodes(cell) <= partition_size], get_nodes)
+        drivers = [self.get_partition_driver(partition, index, num_partitions) for index, partition in
+                   enumerate(partition_hosts(hosts, partition_size, num_partitions))]
+
+        def run_partition(index, driver):
+            partition_run_cell, _ = driver.start_experiment(matrix, journal)
+            seconds, nodes = [], None
+            try:
+                cell = queue.next_cell(nodes)
+                while cell is not None:
+                    nodes = get_nodes(cell)
+                    seconds.append(matrix.execute_cell(cell, partition_run_cell, journal, driver.on_cell_start,
+                        position=f'on partition {index} ({len(queue)} left)'))
+                    cell = queue.next_cell(nodes)
+            except BaseException:
+                # the other partitions finish their running cell and stop; a resumed run retries the rest
+                queue.close()
+                raise
+            finally:
+                driver.stop_experiment()
+            return seconds
+
+        try:
+            with ThreadPoolExecutor(max_workers=num_partitions) as pool:
+                futures = [pool.submit(run_partition, index, driver) for index, driver in enumerate(drivers)]
+            for future in futures:
+                cell_seconds.extend(future.result())
+        finally:
+            self.merge_partitions(drivers)
+        wall_seconds = time.time() - start
+        ran = [seconds for seconds in cell_seconds if seconds is not None]
+        self.info(f'Ran {len(ran)} cells on {num_partitions} partitions in {wall_seconds:.1f}s of wall time for '
+                  f'{sum(ran):.1f}s of cell time ({sum(ran) / wall_seconds if wall_seconds else 0:.1f}x)')
+        return len(ran), len(cells) - len(pending)
 
     def debug(self, msg):
         self.logger.debug(msg, extra=self.prefix)
@@ -405,6 +884,11 @@ class Driver:
         self.logger.error(msg, extra=self.prefix)
 
 
+def load_json_file(path):
+    with open(path) as f:
+        return json.load(f)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description='pass arguments to run various tests against a prebuilt cluster of nodes on which couchbase is already installed'
@@ -420,6 +904,63 @@ if __name__ == "__main__":
     parser.add_argument('-o', '--operation-sample-size',
                         help='How many operations should be executed to determine an average latency for that type of operation? default=50',
                         default=100, type=int)
+    parser.add_argument('-s', '--document-seed', type=int, default=None,
+                        help=('generate documents on the fly from (seed, key) instead of reading the pre-generated '
+                              'corpus; same seed => same documents on every machine'))
+    parser.add_argument('-pm', '--payload-mode', choices=PAYLOAD_MODES, default=PAYLOAD_MODE_ENCODE,
+                        help=('encode: SDK JSON-encodes each insert/update document inside the timed call; '
+                              'preencoded: documents are sent as JSON bytes through the raw JSON transcoder'))
+    parser.add_argument('-tpayload', '--test_payload_encoding', action='store_true',
+                        help='compare insert/update latency with encode-on-call vs pre-encoded payloads')
+    parser.add_argument('-pv', '--phrase-vocabulary', type=str, default=None,
+                        help=('JSON file configuring the searchable phrase vocabulary (distribution, zipf_exponent, '
+                              'rare_terms with guaranteed match counts), e.g. lib/phrase_vocabulary_zipfian.json'))
+    parser.add_argument('-ds', '--doc-sizes', type=int, nargs='+', default=None,
+                        help=('document sizes in bytes to sweep in the homogeneous test framework, filled with '
+                              'schema-driven nested documents; 0 keeps documents at their natural size. '
+                              'Default: 0 and 256 B to 1 MB, log-spaced'))
+    parser.add_argument('-schema', '--document-schema', type=str, default=None,
+                        help='JSON file with a document schema ({field: spec}) for schema-driven documents')
+    parser.add_argument('-tbinary', '--test_binary_values', action='store_true',
+                        help=('measure binary insert/update/get latency and bytes on the wire against value size, '
+                              'with and without client-side zlib compression'))
+    parser.add_argument('-vs', '--value-sizes', type=int, nargs='+', default=None,
+                        help='binary value sizes in bytes for --test_binary_values (default 100 KB to 5 MB)')
+    parser.add_argument('-cr', '--compressibility', type=float, default=0.5,
+                        help='fraction of each binary value that is compressible (0 = random bytes). default=0.5')
+    parser.add_argument('-trebalance', '--test_rebalance', action='store_true',
+                        help=('measure scale-out rebalance duration and documents moved per bucket size, cluster '
+                              'size and replica count'))
+    parser.add_argument('-rc', '--replica-counts', type=int, nargs='+', default=None,
+                        help='bucket replica counts for --test_rebalance (default 0 1 2)')
+    parser.add_argument('-tfailover', '--test_failover', action='store_true',
+                        help=('run background KV + N1QL load through graceful failover, delta recovery, hard '
+                              'failover, rebalance out and rebalance in of a node, recording latency over time'))
+    parser.add_argument('-fw', '--failover-window', type=float, default=0.5,
+                        help='width in seconds of the time windows latency and errors are aggregated in. default=0.5')
+    parser.add_argument('-hp', '--health-probe', choices=PROBE_MODES, default=PROBE_WARN,
+                        help=('probe node reachability, service health and network RTT before each sweep cell; '
+                              'warn or abort when a node is degraded. default=warn'))
+    parser.add_argument('-pa', '--probe-attempts', type=int, default=10,
+                        help='TCP connects per node and service port in the health probe. default=10')
+    parser.add_argument('-snb', '--subtract-network-baseline', action='store_true',
+                        help='with --plot, subtract the probed network RTT of the serving port from latencies')
+    parser.add_argument('-reuse', '--reuse-datasets', action='store_true',
+                        help=('keep loaded buckets between sweep cells and skip reloading a bucket whose stored '
+                              'dataset fingerprint (corpus, count, seed) matches; only the measured phase runs'))
+    parser.add_argument('-lw', '--load-workers', type=int, default=8,
+                        help='concurrent workers used to bulk load buckets before measuring. default=8')
+    parser.add_argument('-lb', '--load-batch-size', type=int, default=500,
+                        help='documents per multi-document upsert during bulk load. default=500')
+    parser.add_argument('-mi', '--measured-inserts', type=int, default=None,
+                        help=('recorded inserts run against each bucket after it is loaded to its target size '
+                              '(default: --operation-sample-size)'))
+    parser.add_argument('-sm', '--sampling-mode', choices=SAMPLING_MODES, default=SAMPLING_RESERVOIR,
+                        help=('which operations of a phase get their latency recorded when it runs more operations '
+                              'than are recorded: first, a uniform reservoir sample, or every k-th. default=reservoir'))
+    parser.add_argument('-fake', '--fake-backend', nargs='?', const='', default=None, metavar='CONFIG',
+                        help=('run against an in-process fake cluster instead of the hosts in hosts.json; optionally '
+                              'pass a JSON file with its latency model and faults (see FakeBackend.from_config_file)'))
     parser.add_argument('-c', '--clear-cluster', action='store_true',
                         help='Clear all the nodes out from the current cluster')
     parser.add_argument('-f', '--flush-bucket', type=str,
@@ -431,7 +972,23 @@ if __name__ == "__main__":
                             'run the automated test framework with heterogeneous service layout '
                             '(reveals relationship between service layouts and latencies)')
                         )
+    parser.add_argument('-le', '--layout-edition', choices=['community', 'enterprise'], default=None,
+                        help=('with --test_heterogeneous, sweep every valid service layout of this edition '
+                              '(symmetric layouts removed, ordered to minimize node reconfigurations)'))
+    parser.add_argument('-ml', '--max-layouts', type=int, default=DEFAULT_MAX_LAYOUTS,
+                        help=('with --layout-edition, sweep a seeded sample of this many layouts when there are more; '
+                              f'0 sweeps every layout. default={DEFAULT_MAX_LAYOUTS}'))
 
+    parser.add_argument('-spec', '--experiment-spec', type=str, default=None,
+                        help=('run the experiment described by a JSON matrix spec (experiment, dimensions, '
+                              'settings; see lib/experiment_matrix_example.json)'))
+    parser.add_argument('-resume', '--resume', action='store_true',
+                        help=('resume a sweep from its journal (lib/data/journal): skip completed cells and roll '
+                              'back the partial latency lines of the cell that was interrupted'))
+    parser.add_argument('-partition', '--partition-hosts', action='store_true',
+                        help=('split the host pool into independent clusters and run homogeneous sweep cells on '
+                              'them concurrently, packed by cluster size; latencies go to partitions-<N> '
+                              'subfolders and the pool is merged back into one cluster afterward'))
     parser.add_argument('-ycsb', '--ycsb', action='store_true',
                         help='run the YCSB framework')
 
@@ -440,35 +997,88 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    if args.flush_bucket or args.clear_cluster or args.test_heterogeneous or args.test_homogeneous or args.ycsb:
+    if (args.flush_bucket or args.clear_cluster or args.test_heterogeneous or args.test_homogeneous or args.ycsb
+            or args.experiment_spec or args.test_payload_encoding or args.test_binary_values
+            or args.test_rebalance or args.test_failover):
 
+        fake_backend = None
+        if args.fake_backend is not None:
+            fake_backend = (FakeBackend.from_config_file(args.fake_backend, verbose=args.verbose) if args.fake_backend
+                            else FakeBackend(verbose=args.verbose))
         driver = Driver(args.username, args.password, args.verbose,
                         small_data_sample_size=args.data_sample_size,
                         medium_data_sample_size=args.data_sample_size * 3,
                         large_data_sample_size=args.data_sample_size * 5,
                         operation_sample_size=args.operation_sample_size,
                         default_scope="default_scope",
-                        default_collection="default_collection")
-        driver.get_cluster_manager().init_cluster(services=['data','index','query','fts'])
+                        default_collection="default_collection",
+                        document_seed=args.document_seed,
+                        payload_mode=args.payload_mode,
+                        phrase_vocabulary=(PhraseVocabulary.from_config_file(args.phrase_vocabulary)
+                                           if args.phrase_vocabulary else None),
+                        doc_sizes=args.doc_sizes,
+                        document_schema=load_json_file(args.document_schema) if args.document_schema else None,
+                        reuse_datasets=args.reuse_datasets,
+                        load_workers=args.load_workers,
+                        load_batch_size=args.load_batch_size,
+                        measured_insert_count=args.measured_inserts,
+                        sampling_mode=args.sampling_mode,
+                        health_probe_mode=args.health_probe,
+                        probe_attempts=args.probe_attempts,
+                        fake_backend=fake_backend)
+        driver.get_cluster_manager().init_cluster(services=LEADER_SERVICES)
 
     if args.flush_bucket:
         driver.get_data_manager().flush_bucket(args.flush_bucket)
     elif args.clear_cluster:
         driver.get_cluster_manager().clear_cluster()
     elif args.test_homogeneous:
-        driver.run_test_framework_homogeneous_service_layout()
+        driver.run_test_framework_homogeneous_service_layout(resume=args.resume, partitioned=args.partition_hosts)
     elif args.test_heterogeneous:
-        driver.run_test_framework_heterogeneous_service_layouts()
+        driver.run_test_framework_heterogeneous_service_layouts(layout_edition=args.layout_edition,
+            max_layouts=args.max_layouts, resume=args.resume)
     elif args.ycsb:
-        driver.run_ycsb()
+        driver.run_ycsb(resume=args.resume)
+    elif args.experiment_spec:
+        driver.run_experiment(ExperimentMatrix.from_config_file(args.experiment_spec, verbose=args.verbose),
+                              resume=args.resume, partitioned=args.partition_hosts)
+    elif args.test_payload_encoding:
+        driver.run_payload_encoding_comparison()
+    elif args.test_binary_values:
+        driver.run_binary_value_sweep(value_sizes=args.value_sizes, compressibility=args.compressibility)
+    elif args.test_rebalance:
+        driver.run_rebalance_sweep(replica_counts=args.replica_counts)
+    elif args.test_failover:
+        driver.run_failover_recovery(window_seconds=args.failover_window)
     if args.plot:
-        analyzer = Analyzer(verbose=args.verbose)
+        analyzer = Analyzer(verbose=args.verbose, subtract_network_baseline=args.subtract_network_baseline,
+                            partitions=driver.partitions if args.test_homogeneous else None)
+        analyzer.build_table_readiness_durations()
+        analyzer.build_table_load_throughput()
+        analyzer.build_table_cluster_setup_durations()
+        analyzer.build_table_bootstrap_durations()
+        analyzer.build_table_network_baselines()
         if args.test_homogeneous:
             analyzer.plot_homogeneous_tests()
+            analyzer.plot_result_size_v_latency(result_size_stats=analyzer.get_result_size_latency_stats())
+            analyzer.plot_doc_size_v_latency(doc_size_stats=analyzer.get_doc_size_latency_stats())
+            analyzer.plot_doc_size_v_load_throughput(
+                doc_size_load_throughput_stats=analyzer.get_doc_size_load_throughput_stats())
         if args.test_heterogeneous:
             service_layout_impact_stats = analyzer.get_service_layout_latencies()
             analyzer.plot_service_layout_impact_stats(
                 service_layout_impact_stats=service_layout_impact_stats)
+        if args.test_payload_encoding:
+            analyzer.plot_payload_mode_comparison(
+                payload_mode_stats=analyzer.get_payload_mode_comparison_stats())
+        if args.test_binary_values:
+            analyzer.plot_binary_value_sweep(binary_value_stats=analyzer.get_binary_value_stats())
+        if args.test_failover:
+            failover_stats = analyzer.get_failover_stats()
+            analyzer.build_table_failover_recovery(failover_stats=failover_stats)
+            analyzer.plot_failover_timeline(failover_stats=failover_stats)
+        if args.test_rebalance:
+            analyzer.plot_rebalance_sweep(rebalance_stats=analyzer.get_rebalance_stats())
         if args.ycsb:
             ycsb_stats = analyzer.collect_ycsb_stats_to_json()
             analyzer.plot_ycsb_stats(ycsb_stats=ycsb_stats)
\ No newline at end of file
@@ -0,0 +1,340 @@
+""" Client for the Couchbase management REST API (port 8091). Keeps one pooled keep-alive HTTP session
+per cluster instead of starting a couchbase-cli process for every administrative call, and raises
+AdminClientError with the status code and the server's error message when a call fails. """
+
+import logging
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Service names as used by the framework -> service names used by the REST API
+SERVICE_NAMES = {
+    'data': 'kv',
+    'query': 'n1ql',
+    'index': 'index',
+    'fts': 'fts',
+    'eventing': 'eventing',
+    'analytics': 'cbas',
+    'backup': 'backup',
+}
+# REST API service names -> framework service names
+FRAMEWORK_SERVICE_NAMES = {rest: name for name, rest in SERVICE_NAMES.items()}
+
+
+def poll_until(check=None, description="", timeout=120, initial_interval=0.1, max_interval=5, backoff=2):
+    """ Call check() until it returns True, sleeping initial_interval after the first failed attempt and
+    multiplying the sleep by backoff (up to max_interval) after each further one. Return
+    (seconds until ready, attempts); raise AdminClientError if not ready within timeout """
+    start = time.time()
+    interval = initial_interval
+    attempts = 0
+    while True:
+        attempts += 1
+        if check():
+            return time.time() - start, attempts
+        if time.time() - start > timeout:
+            raise AdminClientError(f'{description} was not ready within {timeout}s ({attempts} attempts)')
+        time.sleep(interval)
+        interval = min(interval * backoff, max_interval)
+
+
+class AdminClientError(Exception):
+    def __init__(self, message="", status_code=None, errors=None):
+        super().__init__(message if status_code is None else f'{message} (HTTP {status_code})')
+        self.status_code = status_code
+        # error message(s) returned by the server, e.g. {'name': 'Bucket with given name already exists'}
+        self.errors = errors
+
+    def already_exists(self):
+        return 'already exists' in str(self.errors or self).lower()
+
+
+class AdminClient:
+    def __init__(self, address="", username="", password="", verbose=False, port=8091, timeout=30,
+            pool_size=10, retries=3):
+        self.username = username
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self.set_address(address)
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        # retry only on connection errors; a management call that reached the server is never resent
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.5))
+        self.session.mount('http://', adapter)
+        self.setup_logging(verbose)
+
+    def setup_logging(self, verbose=False):
+        """ set up self.logger for AdminClient logging """
+        self.logger = logging.getLogger('AdminClient')
+        formatter = logging.Formatter('%(prefix)s - %(message)s')
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+        self.prefix = {'prefix': 'Admin Client'}
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+        self.logger = logging.LoggerAdapter(self.logger, self.prefix)
+        self.logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
+
+    def set_address(self, address=""):
+        """ Point the client at another node of the cluster (e.g. after the leader address changes) """
+        self.address = address
+        self.base_url = self.get_node_url(address)
+
+    def get_node_url(self, address=""):
+        return f'http://{address}:{self.port}'
+
+    def close(self):
+        self.session.close()
+
+    def request(self, method="GET", path="", node_address=None, expected_statuses=(200,), **kwargs):
+        """ Send a management request to the cluster (or to node_address for node-level settings) over the
+        pooled session; return the response, raising AdminClientError on connection failure or on any
+        status outside expected_statuses """
+        base_url = self.get_node_url(node_address) if node_address else self.base_url
+        url = f'{base_url}{path}'
+        self.debug(f'{method} {url} {kwargs.get("data", "")}')
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise AdminClientError(f'{method} {path} failed: {e}')
+        if response.status_code not in expected_statuses:
+            raise AdminClientError(f'{method} {path} failed', status_code=response.status_code,
+                errors=self.parse_errors(response))
+        return response
+
+    @staticmethod
+    def parse_errors(response):
+        """ Management endpoints report errors as JSON ({'errors': {...}}, a list, or a bare string) or text """
+        try:
+            body = response.json()
+        except ValueError:
+            return response.text.strip()
+        if isinstance(body, dict) and 'errors' in body:
+            return body['errors']
+        return body
+
+    @staticmethod
+    def get_service_names(services=None):
+        """ Map framework service names ('data', 'query', ...) to the comma separated REST service list """
+        if isinstance(services, str):
+            services = services.split(',')
+        return ','.join(SERVICE_NAMES.get(s.strip(), s.strip()) for s in services or ['data'])
+
+    # Cluster and node management
+
+    def init_cluster(self, services=None, hostname=None):
+        """ Initialize a single node cluster on the current address with the given services """
+        self.info(f'Initializing cluster at {self.address} with services {services}')
+        data = {
+            'services': self.get_service_names(services),
+            'username': self.username,
+            'password': self.password,
+            'port': 'SAME',
+        }
+        if hostname:
+            data['hostname'] = hostname
+        return self.request('POST', '/clusterInit', data=data)
+
+    def get_pool(self):
+        return self.request('GET', '/pools/default').json()
+
+    def get_nodes(self):
+        return self.get_pool()['nodes']
+
+    def get_node_services(self):
+        """ Return {node address: [framework service names]} for every node of the cluster """
+        return {node['hostname'].rsplit(':', 1)[0]: sorted(FRAMEWORK_SERVICE_NAMES.get(s, s) for s in node['services'])
+                for node in self.get_nodes()}
+
+    @staticmethod
+    def node_matches(node=None, address=""):
+        """ True if a /pools/default node entry is the node known by address (IP or DNS name) """
+        return node['hostname'].rsplit(':', 1)[0] == address or node['otpNode'].split('@', 1)[-1] == address
+
+    def get_otp_node(self, address=""):
+        """ Return the internal (otp) node name of the cluster node known by address """
+        for node in self.get_nodes():
+            if self.node_matches(node, address):
+                return node['otpNode']
+        raise AdminClientError(f'Node {address} is not part of the cluster at {self.address}')
+
+    def add_node(self, hostname="", services=None):
+        """ Add the node at hostname to the cluster (it joins on the next rebalance) """
+        self.info(f'Adding node {hostname} with services {services}')
+        return self.request('POST', '/controller/addNode', data={
+            'hostname': f'http://{hostname}:{self.port}',
+            'user': self.username,
+            'password': self.password,
+            'services': self.get_service_names(services),
+        })
+
+    def rebalance(self, eject_addresses=None, wait=True, poll_interval=1, timeout=3600, on_progress=None):
+        """ Rebalance the cluster, ejecting the nodes at eject_addresses; block until done if wait, calling
+        on_progress(task) with the rebalance task on every poll (see wait_for_rebalance) """
+        nodes = self.get_nodes()
+        ejected = [n['otpNode'] for n in nodes
+                   if any(self.node_matches(n, address) for address in eject_addresses or [])]
+        if len(ejected) != len(eject_addresses or []):
+            raise AdminClientError(f'Cannot eject {eject_addresses}: not all are part of the cluster')
+        self.info(f'Rebalancing cluster (ejecting {ejected})')
+        self.request('POST', '/controller/rebalance', data={
+            'knownNodes': ','.join(n['otpNode'] for n in nodes),
+            'ejectedNodes': ','.join(ejected),
+        })
+        if wait:
+            self.wait_for_rebalance(poll_interval=poll_interval, timeout=timeout, on_progress=on_progress)
+
+    def get_rebalance_task(self):
+        """ Return the rebalance entry of /pools/default/tasks: status ('running' / 'notRunning'), overall
+        progress (%), perNode progress and, while running, detailedProgress (bucket being moved and per
+        node ingoing/outgoing docsTotal/docsTransferred) """
+        for task in self.request('GET', '/pools/default/tasks').json():
+            if task.get('type') == 'rebalance':
+                return task
+        return {}
+
+    def wait_for_rebalance(self, poll_interval=1, timeout=3600, on_progress=None):
+        """ Poll the rebalance task until it is no longer running, passing every sample to on_progress;
+        raise if it failed or timed out """
+        deadline = time.time() + timeout
+        while True:
+            task = self.get_rebalance_task()
+            if on_progress:
+                on_progress(task)
+            if task.get('status') != 'running':
+                break
+            if time.time() > deadline:
+                raise AdminClientError(f'Rebalance did not finish within {timeout}s')
+            time.sleep(poll_interval)
+        if task.get('errorMessage'):
+            raise AdminClientError(f'Rebalance failed: {task["errorMessage"]}')
+
+    def get_buckets(self):
+        """ Return {bucket name: {'items': item count, 'replicas': replica number, 'ram_quota_mb': per node RAM
+        quota}} for every bucket """
+        return {b['name']: {'items': b.get('basicStats', {}).get('itemCount', 0), 'replicas': b.get('replicaNumber', 0),
+                            'ram_quota_mb': b.get('quota', {}).get('rawRAM', 0) // 1024 ** 2}
+                for b in self.request('GET', '/pools/default/buckets').json()}
+
+    def failover(self, address="", graceful=True, wait=False, on_progress=None):
+        """ Fail over the node at address; graceful failover moves active vBuckets off it first (running as
+        a rebalance task, which is waited for if wait) """
+        self.info(f'{"Graceful" if graceful else "Hard"} failover of node {address}')
+        path = '/controller/startGracefulFailover' if graceful else '/controller/failOver'
+        response = self.request('POST', path, data={'otpNode': self.get_otp_node(address)})
+        if graceful and wait:
+            self.wait_for_rebalance(on_progress=on_progress)
+        return response
+
+    def set_recovery_type(self, address="", recovery_type="delta"):
+        """ Mark the failed over node at address for 'delta' (keep its data, catch up) or 'full' recovery;
+        it rejoins on the next rebalance """
+        self.info(f'Setting {recovery_type} recovery for node {address}')
+        return self.request('POST', '/controller/setRecoveryType',
+            data={'otpNode': self.get_otp_node(address), 'recoveryType': recovery_type})
+
+    def rename_node(self, hostname=""):
+        """ Change the name the (single node) cluster knows its node by to hostname; only allowed while the
+        node is the only member of its cluster """
+        self.info(f'Renaming node {self.address} to {hostname}')
+        return self.request('POST', '/node/controller/rename', data={'hostname': hostname})
+
+    def set_alternate_address(self, node_address="", hostname=""):
+        """ Advertise hostname as the external (alternate) address of the node reachable at node_address """
+        self.info(f'Setting alternate address of {node_address} to {hostname}')
+        return self.request('PUT', '/node/controller/setupAlternateAddresses/external',
+            node_address=node_address, data={'hostname': hostname})
+
+    # Buckets, scopes and collections
+
+    def bucket_exists(self, bucket_name=""):
+        return self.request('GET', f'/pools/default/buckets/{bucket_name}', expected_statuses=(200, 404)
+            ).status_code == 200
+
+    def get_bucket_settings(self, ram_quota_mb=1024, replicas=0):
+        return {
+            'bucketType': 'couchbase',
+            'durabilityMinLevel': 'none',
+            'ramQuotaMB': ram_quota_mb,
+            'replicaNumber': replicas,
+            'flushEnabled': 1,
+        }
+
+    def create_bucket(self, bucket_name="", ram_quota_mb=1024, replicas=0, wait=True):
+        """ Create a flushable couchbase bucket; wait until it is ready on every node if wait """
+        data = self.get_bucket_settings(ram_quota_mb, replicas)
+        data.update({'name': bucket_name, 'conflictResolutionType': 'seqno'})
+        response = self.request('POST', '/pools/default/buckets', expected_statuses=(200, 202), data=data)
+        if wait:
+            self.wait_for_bucket_ready(bucket_name)
+        return response
+
+    def edit_bucket(self, bucket_name="", ram_quota_mb=1024, replicas=0, wait=True):
+        """ Apply RAM quota and replica settings to an existing bucket """
+        response = self.request('POST', f'/pools/default/buckets/{bucket_name}', expected_statuses=(200, 202),
+            data=self.get_bucket_settings(ram_quota_mb, replicas))
+        if wait:
+            self.wait_for_bucket_ready(bucket_name)
+        return response
+
+    def is_bucket_ready(self, bucket_name=""):
+        """ True once bucket_name exists and reports a healthy status on every node """
+        response = self.request('GET', f'/pools/default/buckets/{bucket_name}', expected_statuses=(200, 404))
+        if response.status_code != 200:
+            return False
+        nodes = response.json().get('nodes', [])
+        return bool(nodes) and all(n.get('status') == 'healthy' for n in nodes)
+
+    def wait_for_bucket_ready(self, bucket_name="", timeout=120):
+        """ Wait (with backoff) until bucket_name is healthy on every node; return (seconds, attempts) """
+        return poll_until(lambda: self.is_bucket_ready(bucket_name), description=f'Bucket {bucket_name}',
+            timeout=timeout)
+
+    def collection_exists(self, bucket_name="", scope_name="", collection_name=""):
+        """ True once the bucket's collection manifest lists scope_name.collection_name """
+        response = self.request('GET', f'/pools/default/buckets/{bucket_name}/scopes', expected_statuses=(200, 404))
+        if response.status_code != 200:
+            return False
+        for scope in response.json().get('scopes', []):
+            if scope['name'] == scope_name:
+                return any(c['name'] == collection_name for c in scope.get('collections', []))
+        return False
+
+    def delete_bucket(self, bucket_name=""):
+        self.info(f'Deleting bucket {bucket_name}')
+        return self.request('DELETE', f'/pools/default/buckets/{bucket_name}')
+
+    def flush_bucket(self, bucket_name=""):
+        self.info(f'Flushing bucket {bucket_name}')
+        return self.request('POST', f'/pools/default/buckets/{bucket_name}/controller/doFlush')
+
+    def create_scope(self, bucket_name="", scope_name=""):
+        return self.request('POST', f'/pools/default/buckets/{bucket_name}/scopes', data={'name': scope_name})
+
+    def create_collection(self, bucket_name="", scope_name="", collection_name=""):
+        return self.request('POST', f'/pools/default/buckets/{bucket_name}/scopes/{scope_name}/collections',
+            data={'name': collection_name})
+
+    # Users
+
+    def upsert_user(self, username="", password="", roles=None, display_name=None):
+        """ Create or update a local user; roles as REST role strings, e.g. ['admin'] or
+        ['bucket_full_access[my-bucket]'] """
+        self.info(f'Upserting user {username} with roles {roles}')
+        return self.request('PUT', f'/settings/rbac/users/local/{username}', data={
+            'password': password,
+            'name': display_name or username,
+            'roles': ','.join(roles or []),
+        })
@@ -12,17 +12,31 @@ from collections import OrderedDict
 from tabulate import tabulate
 import random
 
+# Service whose port serves each operation, for subtracting the network baseline
+OPERATION_SERVICES = {
+    'insert': 'data',
+    'update': 'data',
+    'delete': 'data',
+    'n1qlselect': 'query',
+    'fts': 'fts',
+}
+
 def avg(array):
     array = [el for el in array if isinstance(el, int) or isinstance(el, float)]
     return sum(array) / len(array)
 class Analyzer:
-    def __init__(self,verbose=False):
+    def __init__(self,verbose=False, subtract_network_baseline=False, partitions=None):
         self.data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'data')
         self.durability_levels = ['durability-low', 'durability-medium', 'durability-high']
         self.operations = ['delete','update','fts','n1qlselect','insert']
         self.bucket_sizes = ['small-bucket', 'medium-bucket', 'large-bucket']
         self.cluster_sizes = [f'cluster-size-{i}' for i in range(1, 6)]
         self.verbose = verbose
+        # subtract the probed client-to-node RTT from latencies so what remains is server side
+        self.subtract_network_baseline = subtract_network_baseline
+        self.network_baselines = None
+        # read homogeneous latencies measured with this many partitions running concurrently (partitions-<N>)
+        self.partitions = partitions
         self.setup_logging(verbose=verbose)
 
     def setup_logging(self, verbose):
@@ -32,7 +46,8 @@ class Analyzer:
         handler = logging.StreamHandler()
         handler.setFormatter(formatter)
         self.prefix = {'prefix': 'Analyzer'}
-        self.logger.addHandler(handler)
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
         self.logger = logging.LoggerAdapter(self.logger, self.prefix )
         if verbose:
             self.logger.setLevel(logging.DEBUG)
@@ -103,12 +118,18 @@ class Analyzer:
 
 
     def get_operation_stats(self, durability_level='durability-low', cluster_size='cluster-size-1', bucket_size='small-bucket', operation=''):
-        file = os.path.join(
-            os.path.dirname(
-                os.path.abspath(__file__)),'data', durability_level, cluster_size, bucket_size, operation, 'latencies.txt')
+        file = os.path.join(self.data_dir, durability_level, cluster_size, bucket_size, operation, 'latencies.txt')
+        if self.partitions:
+            partitioned_file = os.path.join(os.path.dirname(file), f'partitions-{self.partitions}', 'latencies.txt')
+            # cells too wide for a partition ran alone on the whole pool and are in the usual file
+            if os.path.exists(partitioned_file):
+                file = partitioned_file
         latencies = []
         with open(file) as f:
             latencies = [float(l) for l in f.readlines()]
+        if self.subtract_network_baseline:
+            latencies = self.remove_network_baseline(latencies, cluster_size=cluster_size,
+                service=OPERATION_SERVICES.get(operation, 'data'))
         return {
             'records': latencies,
             'count': len(latencies),
@@ -461,6 +482,67 @@ class Analyzer:
         with open(os.path.join(plot_folder, f'operation_type.txt'), 'w') as f:
             f.write(table)
 
+    def build_table_metric_durations(self, metric="", label="", header=""):
+        """ Build a table of min/avg/max of a duration metric (data/metrics/<metric>.jsonl) grouped by the
+        value of one of its labels; written to plots/tables/<metric>.txt """
+        metric_file = os.path.join(self.data_dir, 'metrics', f'{metric}.jsonl')
+        if not os.path.exists(metric_file):
+            return
+        durations = OrderedDict()
+        with open(metric_file) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    durations.setdefault(record[label], []).append(record['value'])
+        rows = [[header, 'count', 'min (s)', 'avg (s)', 'max (s)']]
+        for key, values in durations.items():
+            rows.append([key, len(values), min(values), avg(values), max(values)])
+        table = tabulate(rows)
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','tables')
+        self.init_plot_folder(plot_folder)
+        with open(os.path.join(plot_folder, f'{metric}.txt'), 'w') as f:
+            f.write(table)
+
+    def build_table_readiness_durations(self):
+        """ Build a table of how long each kind of resource (bucket, bucket-flush, collection, primary-index)
+        took to become ready after it was requested, from data/metrics/readiness.jsonl """
+        self.build_table_metric_durations(metric='readiness', label='resource', header='Resource')
+
+    def build_table_cluster_setup_durations(self):
+        """ Build a table of wall time per cluster setup phase (add_nodes, rebalance, alternate_addresses,
+        rename_leader, readd_leader), from data/metrics/cluster_setup.jsonl """
+        self.build_table_metric_durations(metric='cluster_setup', label='phase', header='Phase')
+
+    def build_table_bootstrap_durations(self):
+        """ Build a table of SDK connection bootstrap time per cluster endpoint, from
+        data/metrics/bootstrap.jsonl """
+        self.build_table_metric_durations(metric='bootstrap', label='endpoint', header='Endpoint')
+
+    def build_table_load_throughput(self):
+        """ Build a table of bulk load throughput (docs/s) per bucket and dataset size, from
+        data/metrics/load_throughput.jsonl; loads run next to other partitions are listed apart """
+        load_file = os.path.join(self.data_dir, 'metrics', 'load_throughput.jsonl')
+        if not os.path.exists(load_file):
+            return
+        throughputs = OrderedDict()
+        with open(load_file) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    key = (record['bucket'], record['num_docs'], record.get('doc_size') or '-', record['workers'],
+                           record['batch_size'], record.get('partitions') or 1)
+                    throughputs.setdefault(key, []).append(record['value'])
+        rows = [['Bucket', 'docs', 'doc size', 'workers', 'batch size', 'partitions', 'loads', 'avg (docs/s)',
+                 'max (docs/s)']]
+        for (bucket, num_docs, doc_size, workers, batch_size, partitions), values in throughputs.items():
+            rows.append([bucket, num_docs, doc_size, workers, batch_size, partitions, len(values), avg(values),
+                         max(values)])
+        table = tabulate(rows)
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','tables')
+        self.init_plot_folder(plot_folder)
+        with open(os.path.join(plot_folder, 'load_throughput.txt'), 'w') as f:
+            f.write(table)
+
     def plot_homogeneous_tests(self):
         stats = self.get_overall_stats()
         self.info("Generating plots...")
@@ -1056,6 +1138,457 @@ class Analyzer:
                     self.error(e)
                     self.error(f'Skipping operation/svc combo: {operation}/{svc}')
 
+    def get_result_size_latency_stats(self):
+        """ Pair every recorded N1QL/FTS latency with the number of documents its query was expected to match
+        (expected_matches.txt, line-aligned with latencies.txt). Returns
+        {operation: {bucket_size: {'expected_matches': [...], 'latencies': [...]}}} across durability levels
+        and cluster sizes, so result-set size and bucket size can be told apart. """
+        stats = {}
+        for operation in ['n1qlselect', 'fts']:
+            stats[operation] = {}
+            for bucket_size in self.bucket_sizes:
+                stats[operation][bucket_size] = {'expected_matches': [], 'latencies': []}
+                for durability_level in self.durability_levels:
+                    for cluster_size in self.cluster_sizes:
+                        folder = os.path.join(self.data_dir, durability_level, cluster_size, bucket_size, operation)
+                        expected_matches_file = os.path.join(folder, 'expected_matches.txt')
+                        if not os.path.exists(expected_matches_file):
+                            continue
+                        with open(os.path.join(folder, 'latencies.txt')) as f:
+                            latencies = [float(l) for l in f.readlines()]
+                        with open(expected_matches_file) as f:
+                            expected_matches = [int(l) for l in f.readlines()]
+                        # only the trailing latencies were recorded alongside expected match counts
+                        latencies = latencies[-len(expected_matches):]
+                        stats[operation][bucket_size]['expected_matches'].extend(expected_matches)
+                        stats[operation][bucket_size]['latencies'].extend(latencies)
+        return stats
+
+    def plot_result_size_v_latency(self, result_size_stats={}):
+        """ Scatter query latency against expected result-set size, one series per bucket size """
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','result-size')
+        self.init_plot_folder(plot_folder)
+        for operation, bucket_stats in result_size_stats.items():
+            if not any(data['latencies'] for data in bucket_stats.values()):
+                continue
+            fig, ax = plt.subplots()
+            for bucket_size, data in bucket_stats.items():
+                if data['latencies']:
+                    ax.scatter(data['expected_matches'], [l * (10**6) for l in data['latencies']],
+                        label=bucket_size, alpha=0.5, s=10)
+            ax.set_xscale('symlog')
+            ax.set_title(f'Expected result size vs. {operation} latency')
+            ax.set_xlabel('Expected matching documents')
+            ax.set_ylabel(u'Latency (\u03bcs)')
+            plt.legend(framealpha=0.3)
+            plt.tight_layout()
+            plt.savefig(os.path.join(plot_folder, f'result-size-v-{operation}.png'))
+            plt.close()
+
+    def get_payload_mode_comparison_stats(self, bucket_name='payload-encoding-test-bucket',
+            durability_level='durability-low', cluster_size='cluster-size-1'):
+        """ Collect insert/update latencies written by Driver.run_payload_encoding_comparison. Encode-on-call
+        latencies live in the usual <operation>/latencies.txt; pre-encoded ones in <operation>/payload-preencoded/.
+        Returns {operation: {payload_mode: {'records', 'avg', 50, 90, 99}}} """
+        stats = {}
+        for operation in ['insert', 'update']:
+            stats[operation] = {}
+            for payload_mode, subfolder in [('encode', ''), ('preencoded', 'payload-preencoded')]:
+                latencies_data_file = os.path.join(
+                    self.data_dir, durability_level, cluster_size, bucket_name, operation, subfolder, 'latencies.txt')
+                try:
+                    with open(latencies_data_file) as f:
+                        latencies = [float(l) for l in f.readlines()]
+                    stats[operation][payload_mode] = {
+                        'records': latencies,
+                        'avg': sum(latencies) / len(latencies),
+                        50: np.percentile(latencies, 50),
+                        90: np.percentile(latencies, 90),
+                        99: np.percentile(latencies, 99),
+                    }
+                except Exception as e:
+                    self.error(e)
+                    self.error(f'Skipping operation/payload mode combo: {operation}/{payload_mode}')
+        return stats
+
+    def plot_payload_mode_comparison(self, payload_mode_stats={}):
+        """ Grouped bar chart per operation: avg/p50/p90/p99 latency with encode-on-call vs pre-encoded payloads.
+        The gap between the bars is client-side JSON encoding time counted in reported latency. """
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','payload-encoding')
+        self.init_plot_folder(plot_folder)
+        measures = ['avg', 50, 90, 99]
+        for operation, mode_stats in payload_mode_stats.items():
+            if not mode_stats:
+                continue
+            fig, ax = plt.subplots()
+            x = np.arange(len(measures))
+            width = 0.8 / len(mode_stats)
+            for i, (payload_mode, data) in enumerate(mode_stats.items()):
+                ax.bar(x + i * width, [data[m] * (10**6) for m in measures], width, label=payload_mode)
+            ax.set_xticks(x + width * (len(mode_stats) - 1) / 2)
+            ax.set_xticklabels(['avg', 'p50', 'p90', 'p99'])
+            ax.set_title(f'{operation.capitalize()} latency: encode-on-call vs pre-encoded payload')
+            ax.set_ylabel(u'Latency (\u03bcs)')
+            plt.legend(framealpha=0.3)
+            plt.tight_layout()
+            plt.savefig(os.path.join(plot_folder, f'{operation}-payload-mode.png'))
+            plt.close()
+
+    def get_doc_size_latency_stats(self, bucket_size='small-bucket', cluster_size='cluster-size-1'):
+        """ Collect latencies the homogeneous sweep wrote under <operation>/doc-size-<bytes>/ (--doc-sizes),
+        <bytes> being the measured mean document size. Returns {operation: {durability_level: {doc_size: {'records', 'avg', 50, 99}}}} """
+        stats = {}
+        for operation in self.operations:
+            stats[operation] = {}
+            for durability_level in self.durability_levels:
+                operation_folder = os.path.join(self.data_dir, durability_level, cluster_size, bucket_size, operation)
+                if not os.path.isdir(operation_folder):
+                    continue
+                stats[operation][durability_level] = {}
+                for subfolder in os.listdir(operation_folder):
+                    if not subfolder.startswith('doc-size-'):
+                        continue
+                    doc_size = int(subfolder[len('doc-size-'):])
+                    file = os.path.join(operation_folder, subfolder, 'latencies.txt')
+                    if self.partitions:
+                        partitioned_file = os.path.join(operation_folder, subfolder, f'partitions-{self.partitions}',
+                                                        'latencies.txt')
+                        if os.path.exists(partitioned_file):
+                            file = partitioned_file
+                    try:
+                        with open(file) as f:
+                            latencies = [float(l) for l in f.readlines()]
+                        stats[operation][durability_level][doc_size] = {
+                            'records': latencies,
+                            'avg': sum(latencies) / len(latencies),
+                            50: np.percentile(latencies, 50),
+                            99: np.percentile(latencies, 99),
+                        }
+                    except Exception as e:
+                        self.error(e)
+                        self.error(f'Skipping operation/durability/doc size combo: '
+                                   f'{operation}/{durability_level}/{doc_size}')
+        return stats
+
+    def plot_doc_size_v_latency(self, doc_size_stats={}):
+        """ Per operation, plot p50/p99 latency against document size on a log axis, one series per
+        durability level """
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','doc-size')
+        self.init_plot_folder(plot_folder)
+        for operation, durability_stats in doc_size_stats.items():
+            if not any(durability_stats.values()):
+                continue
+            fig, ax = plt.subplots()
+            for durability_level, size_stats in durability_stats.items():
+                sizes = sorted(size_stats.keys())
+                for measure, linestyle in [(50, '-'), (99, '--')]:
+                    ax.plot(sizes, [size_stats[s][measure] * (10**6) for s in sizes], linestyle=linestyle,
+                        marker='o', label=f'{durability_level} p{measure}')
+            ax.set_xscale('log', base=2)
+            ax.set_yscale('log')
+            ax.set_title(f'Document size vs. {operation} latency')
+            ax.set_xlabel('Document size (bytes)')
+            ax.set_ylabel(u'Latency (\u03bcs)')
+            plt.legend(framealpha=0.3)
+            plt.tight_layout()
+            plt.savefig(os.path.join(plot_folder, f'doc-size-v-{operation}-latency.png'))
+            plt.close()
+
+    def get_doc_size_load_throughput_stats(self):
+        """ Collect the bulk load throughputs (docs/s) recorded at a target document size, from
+        data/metrics/load_throughput.jsonl. Returns {bucket: {doc_size: [docs/s]}} """
+        load_file = os.path.join(self.data_dir, 'metrics', 'load_throughput.jsonl')
+        stats = {}
+        if not os.path.exists(load_file):
+            return stats
+        with open(load_file) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record.get('doc_size'):
+                        stats.setdefault(record['bucket'], {}).setdefault(record['doc_size'], []).append(
+                            record['value'])
+        return stats
+
+    def plot_doc_size_v_load_throughput(self, doc_size_load_throughput_stats={}):
+        """ Plot mean bulk load throughput against document size on a log axis, one series per bucket,
+        in docs/s and in MB/s (docs/s * document size) """
+        if not doc_size_load_throughput_stats:
+            return
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','doc-size')
+        self.init_plot_folder(plot_folder)
+        fig, (docs_ax, mb_ax) = plt.subplots(2, 1, sharex=True)
+        for bucket, size_stats in doc_size_load_throughput_stats.items():
+            sizes = sorted(size_stats.keys())
+            docs_per_sec = [avg(size_stats[s]) for s in sizes]
+            docs_ax.plot(sizes, docs_per_sec, marker='o', label=bucket)
+            mb_ax.plot(sizes, [d * s / 1024 ** 2 for d, s in zip(docs_per_sec, sizes)], marker='o', label=bucket)
+        docs_ax.set_title('Document size vs. bulk load throughput')
+        docs_ax.set_ylabel('docs/s')
+        mb_ax.set_ylabel('MB/s')
+        mb_ax.set_xscale('log', base=2)
+        mb_ax.set_xlabel('Document size (bytes)')
+        docs_ax.legend(framealpha=0.3)
+        plt.tight_layout()
+        plt.savefig(os.path.join(plot_folder, 'doc-size-v-load-throughput.png'))
+        plt.close()
+
+    def get_binary_value_stats(self, bucket_name='binary-value-test-bucket', durability_level='durability-low',
+            cluster_size='cluster-size-1'):
+        """ Collect latencies and payload/wire byte counts written by Driver.run_binary_value_sweep under
+        <operation>/value-size-<bytes>[/compression-zlib]/. Wire throughput is wire bytes / total latency.
+        Returns {operation: {compression: {value_size: {'avg', 50, 99, 'wire_ratio', 'wire_mb_per_sec'}}}} """
+        stats = {}
+        for operation in ['binary-insert', 'binary-update', 'binary-get']:
+            stats[operation] = {}
+            operation_folder = os.path.join(self.data_dir, durability_level, cluster_size, bucket_name, operation)
+            if not os.path.isdir(operation_folder):
+                continue
+            for subfolder in os.listdir(operation_folder):
+                if not subfolder.startswith('value-size-'):
+                    continue
+                value_size = int(subfolder[len('value-size-'):])
+                for compression, compression_folder in [('none', ''), ('zlib', 'compression-zlib')]:
+                    folder = os.path.join(operation_folder, subfolder, compression_folder)
+                    if not os.path.exists(os.path.join(folder, 'payload_bytes.txt')):
+                        continue
+                    with open(os.path.join(folder, 'latencies.txt')) as f:
+                        latencies = [float(l) for l in f.readlines()]
+                    with open(os.path.join(folder, 'payload_bytes.txt')) as f:
+                        payload_bytes = [[int(b) for b in l.split()] for l in f.readlines()]
+                    wire_bytes = sum(b[1] for b in payload_bytes)
+                    stats[operation].setdefault(compression, {})[value_size] = {
+                        'avg': sum(latencies) / len(latencies),
+                        50: np.percentile(latencies, 50),
+                        99: np.percentile(latencies, 99),
+                        'wire_ratio': wire_bytes / sum(b[0] for b in payload_bytes),
+                        'wire_mb_per_sec': wire_bytes / sum(latencies) / 10**6,
+                    }
+        return stats
+
+    def plot_binary_value_sweep(self, binary_value_stats={}):
+        """ Per binary operation, plot p50/p99 latency and wire throughput against value size, one series per
+        compression mode """
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','binary-values')
+        self.init_plot_folder(plot_folder)
+        for operation, compression_stats in binary_value_stats.items():
+            if not compression_stats:
+                continue
+            fig, ax = plt.subplots()
+            for compression, size_stats in compression_stats.items():
+                sizes = sorted(size_stats.keys())
+                for measure, linestyle in [(50, '-'), (99, '--')]:
+                    ax.plot([s / 1024 for s in sizes], [size_stats[s][measure] * (10**6) for s in sizes],
+                        linestyle=linestyle, marker='o', label=f'compression={compression} p{measure}')
+            ax.set_xscale('log')
+            ax.set_title(f'Value size vs. {operation} latency')
+            ax.set_xlabel('Value size (KB)')
+            ax.set_ylabel(u'Latency (\u03bcs)')
+            plt.legend(framealpha=0.3)
+            plt.tight_layout()
+            plt.savefig(os.path.join(plot_folder, f'value-size-v-{operation}-latency.png'))
+            plt.close()
+
+            fig, ax = plt.subplots()
+            for compression, size_stats in compression_stats.items():
+                sizes = sorted(size_stats.keys())
+                ax.plot([s / 1024 for s in sizes], [size_stats[s]['wire_mb_per_sec'] for s in sizes],
+                    marker='o', label=f'compression={compression}')
+            ax.set_xscale('log')
+            ax.set_title(f'Value size vs. {operation} bytes on the wire')
+            ax.set_xlabel('Value size (KB)')
+            ax.set_ylabel('Wire throughput (MB/sec)')
+            plt.legend(framealpha=0.3)
+            plt.tight_layout()
+            plt.savefig(os.path.join(plot_folder, f'value-size-v-{operation}-wire-throughput.png'))
+            plt.close()
+
+    def read_metric(self, metric="", **labels):
+        """ Return the records of data/metrics/<metric>.jsonl whose labels match all given labels """
+        metric_file = os.path.join(self.data_dir, 'metrics', f'{metric}.jsonl')
+        if not os.path.exists(metric_file):
+            return []
+        with open(metric_file) as f:
+            records = [json.loads(l) for l in f if l.strip()]
+        return [r for r in records if all(r.get(k) == v for k, v in labels.items())]
+
+    def get_network_baselines(self):
+        """ Median TCP connect RTT (seconds) per (cluster size folder, service) over every health probe
+        sample recorded by the HealthProbe (data/metrics/health_probe.jsonl) """
+        if self.network_baselines is None:
+            rtts = {}
+            for record in self.read_metric('health_probe'):
+                if 'cluster_size' in record:
+                    rtts.setdefault((f'cluster-size-{record["cluster_size"]}', record['service']), []).extend(
+                        record['rtts'])
+            self.network_baselines = {key: float(np.median(values)) for key, values in rtts.items() if values}
+        return self.network_baselines
+
+    def remove_network_baseline(self, latencies=None, cluster_size='cluster-size-1', service='data'):
+        """ Subtract the network baseline of service at cluster_size from each latency (never below 0);
+        latencies are returned unchanged if no probe covered that cell """
+        baseline = self.get_network_baselines().get((cluster_size, service))
+        if baseline is None:
+            self.debug(f'No network baseline for {service} at {cluster_size}')
+            return latencies
+        return [max(0.0, latency - baseline) for latency in latencies]
+
+    def build_table_network_baselines(self):
+        """ Build a table of the median client-to-node RTT per cluster size and service """
+        rows = [['Cluster size', 'service', u'median RTT (\u03bcs)']]
+        for (cluster_size, service), baseline in sorted(self.get_network_baselines().items()):
+            rows.append([cluster_size, service, baseline * (10**6)])
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','tables')
+        self.init_plot_folder(plot_folder)
+        with open(os.path.join(plot_folder, 'network_baselines.txt'), 'w') as f:
+            f.write(tabulate(rows))
+
+    def get_failover_stats(self):
+        """ Collect the load timelines written by Driver.run_failover_recovery.
+        Returns {cluster size folder: {'windows': [window records], 'events': [(time, event)]}} """
+        failover_dir = os.path.join(self.data_dir, 'failover')
+        stats = {}
+        if not os.path.isdir(failover_dir):
+            return stats
+        for cluster_size in sorted(os.listdir(failover_dir)):
+            try:
+                with open(os.path.join(failover_dir, cluster_size, 'windows.jsonl')) as f:
+                    windows = [json.loads(l) for l in f if l.strip()]
+                with open(os.path.join(failover_dir, cluster_size, 'events.jsonl')) as f:
+                    events = [(e['time'], e['event']) for e in map(json.loads, f) if e]
+            except Exception as e:
+                self.error(e)
+                self.error(f'Skipping failover timeline {cluster_size}')
+                continue
+            stats[cluster_size] = {'windows': windows, 'events': events}
+        return stats
+
+    def get_failover_recovery(self, windows=None, events=None, operation='all', tolerance=0.5):
+        """ For each maintenance event (a <name>_start/<name>_end marker pair) report how long it ran, the
+        time to recover (from its start until the end of the last window, before the next event, whose p99
+        exceeds the pre-event baseline p99 by more than tolerance or that had errors), its worst-window p99
+        and its error count. The baseline is the median window p99 before the first event """
+        windows = sorted((w for w in windows or [] if w['operation'] == operation), key=lambda w: w['start'])
+        starts = [(t, name[:-len('_start')]) for t, name in events or [] if name.endswith('_start')
+                  and name != 'load_started']
+        ends = {name[:-len('_end')]: t for t, name in events or [] if name.endswith('_end')}
+        stopped = max([t for t, name in events or [] if name == 'load_stopped'] or [float('inf')])
+        if not windows or not starts:
+            return []
+        baseline_windows = [w['p99'] for w in windows if w['start'] + w['seconds'] <= starts[0][0]]
+        baseline_p99 = float(np.median(baseline_windows)) if baseline_windows else windows[0]['p99']
+        recovery = []
+        for i, (start, name) in enumerate(starts):
+            period_end = starts[i + 1][0] if i + 1 < len(starts) else stopped
+            period = [w for w in windows if start < w['start'] + w['seconds'] and w['start'] < period_end]
+            degraded = [w for w in period if w['p99'] > baseline_p99 * (1 + tolerance) or w['errors']]
+            recovery.append({
+                'event': name,
+                'duration': ends.get(name, start) - start,
+                'time_to_recover': max(0, degraded[-1]['start'] + degraded[-1]['seconds'] - start) if degraded else 0,
+                'worst_p99': max([w['p99'] for w in period] or [0]),
+                'baseline_p99': baseline_p99,
+                'errors': sum(w['errors'] for w in period),
+                'operations': sum(w['count'] for w in period),
+            })
+        return recovery
+
+    def build_table_failover_recovery(self, failover_stats={}):
+        """ Build a table per cluster size of duration, time to recover, worst-window p99 and errors of each
+        failover / recovery event """
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','tables')
+        self.init_plot_folder(plot_folder)
+        for cluster_size, timeline in failover_stats.items():
+            rows = [['Event', 'duration (s)', 'time to recover (s)', 'worst-window p99 (ms)',
+                     'baseline p99 (ms)', 'errors', 'operations']]
+            for r in self.get_failover_recovery(timeline['windows'], timeline['events']):
+                rows.append([r['event'], r['duration'], r['time_to_recover'], r['worst_p99'] * (10**3),
+                             r['baseline_p99'] * (10**3), r['errors'], r['operations']])
+            with open(os.path.join(plot_folder, f'failover-recovery-{cluster_size}.txt'), 'w') as f:
+                f.write(tabulate(rows))
+
+    def plot_failover_timeline(self, failover_stats={}):
+        """ Plot p99 latency per operation and the overall error rate per time window, with a vertical
+        marker at every event """
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','failover')
+        self.init_plot_folder(plot_folder)
+        for cluster_size, timeline in failover_stats.items():
+            fig, ax = plt.subplots(figsize=(12, 5))
+            operations = sorted({w['operation'] for w in timeline['windows']})
+            for operation in operations:
+                windows = [w for w in timeline['windows'] if w['operation'] == operation]
+                ax.plot([w['start'] for w in windows], [w['p99'] * (10**6) for w in windows],
+                    linewidth=2 if operation == 'all' else 1, label=f'{operation} p99')
+            ax.set_yscale('log')
+            ax.set_xlabel('Time (s)')
+            ax.set_ylabel(u'Latency (\u03bcs)')
+            error_ax = ax.twinx()
+            all_windows = [w for w in timeline['windows'] if w['operation'] == 'all']
+            error_ax.plot([w['start'] for w in all_windows], [w['error_rate'] * 100 for w in all_windows],
+                color='red', linestyle='--', label='error rate')
+            error_ax.set_ylabel('Error rate (%)')
+            for t, event in timeline['events']:
+                ax.axvline(t, color='gray', linestyle=':' if event.endswith('_end') else '-')
+                if not event.endswith('_end'):
+                    ax.text(t, ax.get_ylim()[1], event.replace('_start', ''), rotation=90, fontsize=7,
+                        verticalalignment='top')
+            ax.set_title(f'Latency and errors during failover and recovery ({cluster_size})')
+            ax.legend(framealpha=0.3, loc='upper left')
+            plt.tight_layout()
+            plt.savefig(os.path.join(plot_folder, f'failover-timeline-{cluster_size}.png'))
+            plt.close()
+
+    def get_rebalance_stats(self):
+        """ Collect the rebalances recorded by Driver.run_rebalance_sweep.
+        Returns {replicas: {bucket: {cluster_size: {'durations', 'docs_moved', 'progress'}}}} where progress
+        holds the (elapsed seconds, completion %) series of the latest rebalance of that cell """
+        progress = {}
+        for sample in self.read_metric('rebalance_progress'):
+            progress.setdefault(sample['rebalance_id'], []).append((sample['elapsed'], sample['value']))
+        stats = {}
+        for record in self.read_metric('rebalance', sweep='rebalance'):
+            cell = stats.setdefault(record['replicas'], {}).setdefault(record['bucket'], {}).setdefault(
+                record['cluster_size'], {'durations': [], 'docs_moved': [], 'progress': []})
+            cell['durations'].append(record['value'])
+            cell['docs_moved'].append(record['docs_moved'])
+            cell['progress'] = progress.get(record['rebalance_id'], [])
+        return stats
+
+    def plot_rebalance_sweep(self, rebalance_stats={}):
+        """ Plot average rebalance duration and documents moved against the resulting cluster size, one
+        series per bucket size and replica count, and the completion-over-time curve of every rebalance """
+        plot_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)),'plots','rebalance')
+        self.init_plot_folder(plot_folder)
+        for measure, ylabel, fname in [('durations', 'Rebalance duration (s)', 'cluster-size-v-rebalance-duration'),
+                                       ('docs_moved', 'Documents moved', 'cluster-size-v-docs-moved')]:
+            fig, ax = plt.subplots()
+            for replicas, bucket_stats in sorted(rebalance_stats.items()):
+                for bucket, size_stats in bucket_stats.items():
+                    sizes = sorted(size_stats.keys())
+                    ax.plot(sizes, [avg(size_stats[s][measure]) for s in sizes], marker='o',
+                        label=f'{bucket}, {replicas} replicas')
+            ax.set_title(f'Cluster size vs. {ylabel.lower()}')
+            ax.set_xlabel('Cluster size (nodes after rebalance)')
+            ax.set_ylabel(ylabel)
+            plt.legend(framealpha=0.3)
+            plt.tight_layout()
+            plt.savefig(os.path.join(plot_folder, f'{fname}.png'))
+            plt.close()
+        for replicas, bucket_stats in rebalance_stats.items():
+            for bucket, size_stats in bucket_stats.items():
+                fig, ax = plt.subplots()
+                for cluster_size in sorted(size_stats.keys()):
+                    series = size_stats[cluster_size]['progress']
+                    if series:
+                        ax.plot([t for t, _ in series], [p for _, p in series], label=f'to {cluster_size} nodes')
+                ax.set_title(f'Rebalance progress ({bucket}, {replicas} replicas)')
+                ax.set_xlabel('Elapsed (s)')
+                ax.set_ylabel('Completion (%)')
+                plt.legend(framealpha=0.3)
+                plt.tight_layout()
+                plt.savefig(os.path.join(plot_folder, f'rebalance-progress-{bucket}-replicas-{replicas}.png'))
+                plt.close()
+
 
 
 
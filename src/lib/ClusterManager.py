@@ -1,29 +1,41 @@
-""" Class responsible for managing a couchbase cluster. Primarily uses the subprocess library to execute
-couchbase-cli commands to interact with cluster configuration. You must have couchbase-cli installed on your system for this to work. """
+""" Class responsible for managing a couchbase cluster. Cluster configuration goes through the management
+REST API via a pooled AdminClient session (see AdminClient.py); users are managed with the Python SDK. """
 
 import logging
-import subprocess
 import json
 import os
 import random
-from couchbase.cluster import UserManager
-from couchbase.cluster import Cluster
-from couchbase.auth import PasswordAuthenticator
+import time
+from concurrent.futures import ThreadPoolExecutor
 from couchbase.management.users import User, Role
 
-from .ServiceLayout import ServiceLayout
+from .AdminClient import AdminClient, AdminClientError, FRAMEWORK_SERVICE_NAMES
+from .ConnectionRegistry import ConnectionRegistry
+from .MetricsRecorder import MetricsRecorder
+from .ServiceLayout import (
+    DEFAULT_MAX_LAYOUTS, ServiceLayout, generate_service_layouts, order_service_layouts, plan_topology_change,
+    sample_service_layouts
+)
 
 
 class ClusterManager:
-    def __init__(self, username, password, verbose):
+    def __init__(self, username, password, verbose, provisioning_workers=8, connection_registry=None, admin_client=None,
+            hosts=None):
         self.username = username
         self.password = password
-        self.hosts = self.get_hosts_from_json()
+        # concurrent admin calls when adding nodes / setting alternate addresses
+        self.provisioning_workers = provisioning_workers
+        self.metrics = MetricsRecorder()
+        # hosts = one partition of the pool (see HostPool); default is every host in hosts.json
+        self.hosts = hosts or self.get_hosts_from_json()
         self.randomly_assign_host_roles()  # assigns self.leader, self.followers randomly
-        # Use the public IP of leader for couchbase url endpoint
-        self.couchbase_url = f'couchbase://{self.get_public_address(self.leader)}'
         # Logging
         self.setup_logging(verbose)
+        self.admin_client = admin_client or AdminClient(username=username, password=password, verbose=verbose)
+        # SDK connections are bootstrapped once and shared with the other managers (see ConnectionRegistry)
+        self.connections = connection_registry or ConnectionRegistry(username, password, verbose)
+        # Use the public IP of leader for couchbase url endpoint
+        self.set_couchbase_address(self.get_public_address(self.leader))
 
         self.logger.info(
             f'Couchbase Endpoint URL (using leader public IP): {self.couchbase_url}')
@@ -31,6 +43,14 @@ class ClusterManager:
         self.logger.info(f'Leader: {self.leader}')
         self.logger.info(f'Followers: {self.followers}')
 
+    def set_couchbase_address(self, address=""):
+        """ Point the SDK endpoint and the admin client at address """
+        self.couchbase_url = f'couchbase://{address}'
+        self.admin_client.set_address(address)
+
+    def get_admin_client(self):
+        return self.admin_client
+
     def get_password(self):
         return self.password
 
@@ -52,7 +72,8 @@ class ClusterManager:
         handler = logging.StreamHandler()
         handler.setFormatter(formatter)
         self.prefix = {'prefix': 'Cluster Manager'}
-        self.logger.addHandler(handler)
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
         self.logger = logging.LoggerAdapter(self.logger, self.prefix)
         if verbose:
             self.logger.setLevel(logging.DEBUG)
@@ -72,49 +93,145 @@ class ClusterManager:
     def remove_node_from_cluster(self, node_private_address="", node_dns_name=""):
         """ Pass in an address of a cluster node to remove it """
         addr = node_private_address if node_private_address else node_dns_name
-        remove_node_cmd = (
-            f'couchbase-cli rebalance -c {self.couchbase_url} --username {self.username} '
-            f'--password {self.password} --server-remove {addr}'
-        )
-        process = subprocess.Popen(remove_node_cmd.split(
-        ), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        if error and error != "None":
-            self.error(error)
-        self.info(output)
-
-    def graceful_failover_node(self, node_private_address="", node_dns_name=""):
-        """ Perform a graceful failover of a node """
+        try:
+            self.admin_client.rebalance(eject_addresses=[addr])
+        except AdminClientError as e:
+            self.error(e)
+        self.connections.reconnect(addr)
+
+    def graceful_failover_node(self, node_private_address="", node_dns_name="", wait=True):
+        """ Perform a graceful failover of a node; block until its vBuckets have moved if wait """
         addr = node_private_address if node_private_address else node_dns_name
-        graceful_failover_cmd = (
-            f'couchbase-cli failover -c {self.couchbase_url} --username {self.username} '
-            f'--password {self.password} --server-failover {addr}'
-        )
-        process = subprocess.Popen(graceful_failover_cmd.split(
-        ), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        if error and error != "None":
-            self.error(error)
-        self.logger.info(output)
+        try:
+            self.admin_client.failover(address=addr, graceful=True, wait=wait)
+        except AdminClientError as e:
+            self.error(e)
+
+    def hard_failover_node(self, node_private_address="", node_dns_name=""):
+        """ Perform a hard failover of a node: its replicas are promoted immediately, nothing is moved """
+        addr = node_private_address if node_private_address else node_dns_name
+        try:
+            self.admin_client.failover(address=addr, graceful=False)
+        except AdminClientError as e:
+            self.error(e)
+
+    def recover_node(self, node_private_address="", node_dns_name="", recovery_type="delta", **labels):
+        """ Bring a failed over node back with 'delta' or 'full' recovery and rebalance it in """
+        addr = node_private_address if node_private_address else node_dns_name
+        try:
+            self.admin_client.set_recovery_type(address=addr, recovery_type=recovery_type)
+        except AdminClientError as e:
+            self.error(e)
+            return None
+        return self.rebalance_cluster(recovery=recovery_type, **labels)
+
+    def run_concurrently(self, func, items):
+        """ Call func on every item using up to provisioning_workers threads; return the results in order """
+        items = list(items)
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.provisioning_workers, len(items))) as pool:
+            return list(pool.map(func, items))
+
+    def timed_phase(self, phase="", func=None, **labels):
+        """ Run func(), log its wall time and record it as a 'cluster_setup' metric labelled with phase """
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        self.info(f'{phase} took {elapsed:.2f}s')
+        self.metrics.record('cluster_setup', elapsed, phase=phase, **labels)
+        return result
+
+    def get_member_followers(self):
+        """ Followers that are currently part of the cluster """
+        members = self.get_current_node_services()
+        return [f for f in self.get_followers() if self.get_dns_name(f) in members]
+
+    def get_current_node_services(self):
+        """ Return {follower DNS name: [services]} for the followers currently in the cluster, read from the
+        cluster's node list (nodes may be known by DNS name or private IP) """
+        try:
+            nodes = self.admin_client.get_nodes()
+        except AdminClientError as e:
+            self.error(e)
+            return {}
+        node_services = {}
+        for f in self.get_followers():
+            for n in nodes:
+                if any(self.admin_client.node_matches(n, a) for a in
+                       (self.get_dns_name(f), self.get_private_address(f), self.get_public_address(f))):
+                    node_services[self.get_dns_name(f)] = [self.normalize_service(s) for s in n['services']]
+        return node_services
+
+    def get_leader_services(self):
+        """ Return the services the leader runs, read from the cluster's node list """
+        try:
+            nodes = self.admin_client.get_nodes()
+        except AdminClientError as e:
+            self.error(e)
+            return []
+        for n in nodes:
+            if any(self.admin_client.node_matches(n, a) for a in (self.get_dns_name(self.leader),
+                   self.get_private_address(self.leader), self.get_public_address(self.leader))):
+                return [self.normalize_service(s) for s in n['services']]
+        return []
+
+    def apply_node_services(self, target_node_services=None, **labels):
+        """ Reach a cluster whose followers run target_node_services ({DNS name: services}) by applying only
+        the difference to the current cluster: followers already running a target service set stay, the
+        others are removed and spare hosts added with the missing sets, all in one rebalance (a second one
+        only if a removed host has to be re-added with other services) """
+        current = self.get_current_node_services()
+        target = {host: [s.strip() for s in (services.split(',') if isinstance(services, str) else services)]
+                  for host, services in (target_node_services or {}).items()}
+        # prefer the layout's own hosts when a spare host is needed, then any other follower
+        spare_hosts = list(dict.fromkeys(list(target) + [self.get_dns_name(f) for f in self.get_followers()]))
+        plan = plan_topology_change(current, target, spare_hosts=spare_hosts)
+        self.info(f'Topology change: keeping {len(plan["keep"])} nodes, removing {plan["remove"]}, '
+                  f'adding {plan["add"]}, re-adding {plan["readd"]}')
+        self.metrics.record('topology_change', len(plan['remove']) + len(plan['add']) + len(plan['readd']),
+            kept=len(plan['keep']), removed=len(plan['remove']), added=len(plan['add']),
+            readded=len(plan['readd']), **labels)
+        self.change_topology(node_services=plan['add'], remove_addresses=plan['remove'], **labels)
+        if plan['readd']:
+            # a host being ejected cannot be added back in the same rebalance
+            self.change_topology(node_services=plan['readd'], **labels)
+        return plan
+
+    @staticmethod
+    def normalize_service(service=""):
+        """ REST service name ('kv', 'n1ql', ...) -> framework service name ('data', 'query', ...) """
+        return FRAMEWORK_SERVICE_NAMES.get(service, service)
+
+    def change_topology(self, node_services=None, remove_addresses=None, **labels):
+        """ Apply one batch of topology changes: add every node in node_services ({address: services})
+        concurrently, then run a single rebalance that also ejects remove_addresses. Wall times of the add
+        and rebalance phases are recorded """
+        node_services = node_services or {}
+        if node_services:
+            self.timed_phase('add_nodes', lambda: self.run_concurrently(
+                lambda item: self.add_node_to_cluster(node_dns_name=item[0], services=item[1]),
+                node_services.items()), nodes=len(node_services), **labels)
+        if node_services or remove_addresses:
+            self.timed_phase('rebalance', lambda: self.rebalance_cluster(eject_addresses=remove_addresses, **labels),
+                added=len(node_services), removed=len(remove_addresses or []), **labels)
+        # connections bootstrapped through a node that left the cluster must bootstrap again
+        for address in remove_addresses or []:
+            self.connections.reconnect(address)
+
+    def reconnect_host(self, host=None):
+        """ Drop connections bootstrapped through host under any of its addresses (e.g. after it was renamed
+        or removed and re-added) """
+        for address in (self.get_dns_name(host), self.get_public_address(host), self.get_private_address(host)):
+            self.connections.reconnect(address)
 
     def _add_public_alt_addr(self, node):
         """ Add public IP address as alt address for a given node in cluster """
-        cmd = (
-            f'couchbase-cli setting-alternate-address '
-            f'--cluster {self.get_public_address(node)}:8091 '
-            f'--node {self.get_dns_name(node)} '
-            f'--username {self.username} '
-            f'--password {self.password} '
-            f'--set '
-            f'--hostname {self.get_dns_name(node)} '
-        )
-        process = subprocess.Popen(
-            cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        if error and error != "None":
-            self.error(error)
-        if output and output != "None":
-            self.info(output)
+        try:
+            self.admin_client.set_alternate_address(
+                node_address=self.get_public_address(node), hostname=self.get_dns_name(node))
+        except AdminClientError as e:
+            self.error(e)
 
     def add_alternate_couchbase_addresses(self):
         """ Add the public IP address as the alternate address for each node in the cluster.
@@ -122,37 +239,20 @@ class ClusterManager:
         """
         self.info(
             "Adding public address as alternate address for each cluster node")
-        # Leader first
-        self._add_public_alt_addr(self.leader)
-        # Now followers
-        for f in self.followers:
-            self._add_public_alt_addr(f)
+        # Leader and followers are independent node-level settings, so set them concurrently
+        self.timed_phase('alternate_addresses', lambda: self.run_concurrently(
+            self._add_public_alt_addr, [self.leader] + self.followers))
 
     def add_node_to_cluster(self, node_private_address="", node_dns_name="", services="data"):
         """ Given an address of a node within a VPC, add that node to a cluster by
         passing it to the leader of the cluster with the server-add command. Indicate what services it should run! Options: "data", "index", "query", "fts" (full text search), "eventing", "analytics" and "backup". Don't use analytics, eventing, or backup for this testing. """
 
-        if isinstance(services, list):
-            services = ','.join(services)
-
         addr = node_private_address if node_private_address else node_dns_name
         self.logger.info(f"Adding node (addr={addr}) to cluster")
-        add_node_cmd = (
-            f'couchbase-cli server-add '
-            f'--cluster {self.couchbase_url} '
-            f'--server-add http://{addr}:8091 '
-            f'--username {self.username} '
-            f'--password {self.password} '
-            f'--server-add-username {self.username} '
-            f'--server-add-password {self.password} '
-            f'--services {services}'
-        )
-        process = subprocess.Popen(add_node_cmd.split(
-        ), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        self.logger.info(output)
-        if error and error != "None":
-            self.error(error)
+        try:
+            self.admin_client.add_node(hostname=addr, services=services)
+        except AdminClientError as e:
+            self.error(e)
 
     def get_hosts_from_json(self):
         hosts_file = f'{os.path.dirname(os.path.abspath(__file__))}/hosts.json'
@@ -188,60 +288,91 @@ class ClusterManager:
         """
         When you initialize a cluster, even if you use the public DNS name
         of the leader, the node ends up using its private IP address. So,
-        remove the leader node and re-add it using its public DNS name. """
+        remove the leader node and re-add it using its public DNS name.
+        While the leader is the only node in its cluster it is simply renamed (no rebalance); call this before
+        adding followers to take that path. """
         self.info(
             "Configuring the leader to use its public DNS name as its node address")
+        if not self.get_member_followers():
+            try:
+                self.timed_phase('rename_leader',
+                    lambda: self.admin_client.rename_node(hostname=self.get_dns_name(self.leader)))
+                self.set_couchbase_address(self.get_dns_name(self.leader))
+                self.reconnect_host(self.leader)
+                return
+            except AdminClientError as e:
+                self.error(e)
         # ASSUMPTION: THERE IS MORE THAN ONE NODE AVAILABLE
+        start = time.time()
         self.leader = self.hosts[1]
-        self.couchbase_url = f'couchbase://{self.get_dns_name(self.leader)}'
-        # original leader currently stuck with its private IP so use that address to remove it
-        self.remove_node_from_cluster(
-            node_private_address=self.get_private_address(self.hosts[0]))  # remove original leader
-        self.rebalance_cluster()
-        self.add_node_to_cluster(node_dns_name=self.get_dns_name(
-            self.hosts[0]))  # re-add original leader
-        self.rebalance_cluster()
+        self.set_couchbase_address(self.get_dns_name(self.leader))
+        # original leader currently stuck with its private IP so use that address to remove it (ejecting it is
+        # itself a rebalance). Errors propagate: a cluster left without its leader must not be swept
+        original_leader_address = self.get_private_address(self.hosts[0])
+        self.admin_client.rebalance(eject_addresses=[original_leader_address])
+        self.connections.reconnect(original_leader_address)
+        # re-add original leader, then one rebalance to bring it in
+        self.admin_client.add_node(hostname=self.get_dns_name(self.hosts[0]), services="data")
+        self.admin_client.rebalance()
         # now re-set the couchbase endpoint to the original leader
         self.leader = self.hosts[0]
-        self.couchbase_url = f'couchbase://{self.get_dns_name(self.leader)}'
+        self.set_couchbase_address(self.get_dns_name(self.leader))
+        self.reconnect_host(self.leader)
+        self.metrics.record('cluster_setup', time.time() - start, phase='readd_leader')
 
     def init_cluster(self, services=['data']):
         """ Initialize a couchbase cluster (use the public IP of a host randomly selected to be leader);
         optionally pass in a list of services to start on the first node of the cluster; default is just data,
         but you may also run index, query, fts (we are ignoring eventing, analytics and backup) """
-        services = ",".join(services)
-        init_cluster_cmd = (
-            f'couchbase-cli cluster-init '
-            f'-c {self.couchbase_url} '
-            f'--cluster-username {self.username} '
-            f'--cluster-password {self.password} '
-            f'--services {services}'
-        )
-        process = subprocess.Popen(init_cluster_cmd.split(
-        ), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        self.info(output.decode())
-        if error and error != "None":
-            self.error(error)
-
-    def rebalance_cluster(self):
-        """ Rebalance a cluster (after adding a node; important) """
+        try:
+            self.admin_client.init_cluster(services=services)
+        except AdminClientError as e:
+            # also raised when the leader already belongs to an initialized cluster
+            self.error(e)
+
+    def rebalance_cluster(self, eject_addresses=None, **labels):
+        """ Rebalance a cluster (after adding a node; important), ejecting the nodes at eject_addresses.
+        Progress is polled through REST: every sample goes to the 'rebalance_progress' time series, and the
+        rebalance as a whole (duration, documents moved, buckets with their item and replica counts) to the
+        'rebalance' metric, labelled with labels (e.g. bucket, cluster_size, replicas). Return that record.
+        A failed rebalance raises AdminClientError and is not recorded """
         self.info("Rebalancing cluster")
-        rebalance_cmd = (
-            f'couchbase-cli rebalance '
-            f'-c {self.couchbase_url} '
-            f'--username {self.username} '
-            f'--password {self.password} '
-        )
-        process = subprocess.Popen(rebalance_cmd.split(
-        ), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        if error and error != "None":
-            self.error(error)
-        if output and output != "None":
-            self.info(output)
-
-    def get_service_layouts(self):
+        rebalance_id = f'{time.time():.6f}'
+        progress = {'docs_moved': {}, 'logged': -1}
+        buckets = self.admin_client.get_buckets()
+        progress['start'] = time.time()
+        self.admin_client.rebalance(eject_addresses=eject_addresses,
+            on_progress=lambda task: self.record_rebalance_progress(rebalance_id, progress, task))
+        duration = time.time() - progress['start']
+        docs_moved = sum(progress['docs_moved'].values())
+        self.info(f'Rebalance took {duration:.2f}s and moved {docs_moved} documents')
+        return self.metrics.record('rebalance', duration, rebalance_id=rebalance_id, docs_moved=docs_moved,
+            buckets=buckets, ejected=len(eject_addresses or []), **labels)
+
+    def record_rebalance_progress(self, rebalance_id="", progress=None, task=None):
+        """ Record one polled sample of a running rebalance: overall completion (%), per node progress and
+        documents transferred to incoming vBuckets of the bucket currently being moved """
+        running = task.get('status') == 'running'
+        percent = task.get('progress', 0) if running else 100
+        detailed = task.get('detailedProgress', {})
+        bucket = detailed.get('bucket')
+        docs_total = docs_transferred = 0
+        for node in detailed.get('perNode', {}).values():
+            docs_total += node.get('ingoing', {}).get('docsTotal', 0)
+            docs_transferred += node.get('ingoing', {}).get('docsTransferred', 0)
+        if bucket:
+            # buckets are moved one after the other; keep the most seen transferred for each
+            progress['docs_moved'][bucket] = max(progress['docs_moved'].get(bucket, 0), docs_transferred)
+        self.metrics.record('rebalance_progress', percent, rebalance_id=rebalance_id,
+            elapsed=time.time() - progress['start'], bucket=bucket, docs_total=docs_total,
+            docs_transferred=docs_transferred,
+            per_node={node: p.get('progress') for node, p in task.get('perNode', {}).items()})
+        if int(percent) // 10 > progress['logged']:
+            progress['logged'] = int(percent) // 10
+            self.info(f'Rebalance {percent:.0f}% complete' + (f' (moving {bucket}: '
+                      f'{docs_transferred}/{docs_total} documents)' if bucket else ''))
+
+    def get_service_layouts(self, edition=None, max_layouts=DEFAULT_MAX_LAYOUTS):
         """ Build an array of service layouts. Each layout is a map of what services
         run on what hosts for a given test round. NEED at least 5 hosts.
         Service options: "data", "index", "query", "fts".
@@ -249,7 +380,13 @@ class ClusterManager:
         'services': CSV service list, 'host': host object }.
         SKIP leader. Leader will always run data service only.
 
+        With edition ('community' or 'enterprise') every valid layout of the followers under that edition's
+        service combination rules is generated instead (a sample of max_layouts of them if there are more),
+        ordered so consecutive layouts reconfigure few nodes.
+
         Note: Query Service depends on the Index Service and on the Data Service. """
+        if edition:
+            return self.generate_service_layouts(edition, max_layouts=max_layouts)
         layouts = []
         self.info('Getting service layouts...')
         #for service in ['index', 'query', 'fts']:
@@ -297,6 +434,23 @@ class ClusterManager:
             )
         return layouts
 
+    def generate_service_layouts(self, edition='community', max_layouts=DEFAULT_MAX_LAYOUTS):
+        """ Every valid layout of the followers next to the services the leader runs (symmetric duplicates
+        removed), or a seeded sample of max_layouts of them if there are more (0 or None sweeps all), ordered
+        starting from the current cluster's layout to minimize the number of node reconfigurations """
+        followers = self.get_followers()
+        leader_services = self.get_leader_services()
+        layouts = generate_service_layouts(num_hosts=len(followers), edition=edition, leader_services=leader_services)
+        sampled = sample_service_layouts(layouts, max_layouts=max_layouts)
+        if len(sampled) < len(layouts):
+            self.info(f'Sampling {len(sampled)} of {len(layouts)} {edition} service layouts '
+                      f'(raise --max-layouts, or set it to 0, to sweep more)')
+        start = ServiceLayout(node_services=list(self.get_current_node_services().values()))
+        layouts, reconfigurations = order_service_layouts(sampled, start=start)
+        self.info(f'Generated {len(layouts)} {edition} service layouts for {len(followers)} followers next to a '
+                  f'leader running {leader_services}; sweep needs {reconfigurations} node reconfigurations')
+        return layouts
+
     def measure_impact_of_scaling_service(self, service="data"):
         """
         THIS DOES NOT WORK WELL WITH COMMUNITY EDITION DUE TO SERVICE LAYOUT CONSTRAINTS
@@ -325,59 +479,34 @@ class ClusterManager:
         return layouts
 
     def clear_cluster(self):
-        """ Remove all nodes from cluster aside from leader (only followers) """
+        """ Remove all nodes from cluster aside from leader (only followers), in a single rebalance """
         self.info("Clearing cluster...")
-        for follower in self.get_followers():
+        members = self.get_member_followers()
+        for follower in members:
             self.info(f"removing node {self.get_dns_name(follower)}")
-            self.remove_node_from_cluster(
-                node_dns_name=self.get_dns_name(follower))
+        if members:
+            self.change_topology(remove_addresses=[self.get_dns_name(f) for f in members], layout='clear')
 
 
     def setup_cluster_with_service_layout(self,service_layout:ServiceLayout, cluster_size=5):
-        """ Given a ServiceLayout and cluster size, set up heterogeneous cluster. Assume cluster already clear."""
+        """ Given a ServiceLayout and cluster size, set up heterogeneous cluster. Followers already running
+        a service set the layout needs are kept, so the cluster need not be cleared between layouts. """
         self.debug(f"Creating a cluster with service layout {service_layout}")
-        followers = self.get_followers().copy()
-        services_on_all_nodes = service_layout.services_on_all_hosts
-        # decrement counts as they are assigned to hosts
-        services_on_n_nodes = service_layout.service_counts.copy()
-        # Services on hosts NOT included in the N hosts
-        services_on_remaining_nodes = service_layout.services_on_remaining_hosts
-        for i in range(cluster_size - 1):
-            host = followers[i]
-            dns = self.get_dns_name(host)
-            host_services = services_on_all_nodes.copy()
-            current_is_one_of_the_N_hosts = False
-            for service, count in services_on_n_nodes.items():
-                self.debug(f'Remaining count for service {service} = {count}')
-                if count > 0:
-                    current_is_one_of_the_N_hosts = True
-                    self.debug(f'Assigning service {service} to host {dns}')
-                    host_services.append(service)
-                    services_on_n_nodes[service] = count - 1
-                    self.debug(f'Updated remaining count for service {service} to {services_on_n_nodes[service]}')
-            if not current_is_one_of_the_N_hosts:
-                # If this host is not one of the N hosts running a specific service,
-                # then it needs to run the 'remaining' services
-                host_services.extend(services_on_remaining_nodes)
-            self.debug(
-                f'Adding node {dns} to cluster with services {host_services}'
-            )
-            self.add_node_to_cluster(node_dns_name=dns, services=host_services)
-
-        # Rebalance after adding all nodes based on layout
-        self.rebalance_cluster()
+        if service_layout.node_services is not None:
+            cluster_size = len(service_layout.node_services) + 1
+        followers = self.get_followers()[:cluster_size - 1]
+        node_services = service_layout.get_node_services([self.get_dns_name(f) for f in followers])
+        for dns, host_services in node_services.items():
+            self.debug(f'Assigning services {host_services} to host {dns}')
+        # Apply only the difference to the current cluster, in one rebalance
+        self.apply_node_services(node_services, layout=str(service_layout), cluster_size=cluster_size)
 
     def create_admin_user(self, username, password):
         self.info(
             f"Creating user with username {username} and password {password} "
             f"with role admin using couchbase URL "
             f"{self.couchbase_url}")
-        cluster = Cluster(
-            self.couchbase_url,
-            authenticator=PasswordAuthenticator(
-                self.username,
-                self.password
-            ))
+        cluster = self.connections.get_cluster(self.couchbase_url)
         user_manager = cluster.users()
         self.debug(f"Cluster: {cluster}")
         self.debug(f"User Manager: {user_manager}")
@@ -399,12 +528,7 @@ class ClusterManager:
             f"Creating user with username {username} and password {password} "
             f"with role bucket_full_access on bucket=* using couchbase URL "
             f"{self.couchbase_url}")
-        cluster = Cluster(
-            self.couchbase_url,
-            authenticator=PasswordAuthenticator(
-                self.username,
-                self.password
-            ))
+        cluster = self.connections.get_cluster(self.couchbase_url)
         user_manager = cluster.users()
         self.debug(f"Cluster: {cluster}")
         self.debug(f"User Manager: {user_manager}")
@@ -422,17 +546,15 @@ class ClusterManager:
         self.info(response)
 
     # , using_ycsb=False):
-    def setup_cluster_colocated_services(self, cluster_size=0):
-        """ Create a cluster of size N with co-located services. """
+    def setup_cluster_colocated_services(self, cluster_size=0, **labels):
+        """ Create a cluster of size N with co-located services; labels are attached to the recorded
+        topology change and rebalance metrics """
         services = "data,query,index,fts"
         self.info(
             f"Creating cluster (co-located services) of size {cluster_size + 1} nodes")
-        for index, follower in enumerate(self.followers):
-            if index < cluster_size:
-                host_dns_name = self.get_dns_name(follower)
-                self.add_node_to_cluster(
-                    node_dns_name=host_dns_name, services=services)
-        # Rebalance after adding all nodes based on layout
-        self.rebalance_cluster()
+        # Apply only the difference to the current cluster (nodes added concurrently), in one rebalance
+        self.apply_node_services(
+            {self.get_dns_name(f): services for f in self.followers[:cluster_size]},
+            layout='colocated', cluster_size=cluster_size + 1, **labels)
         # Enable access via public IP; breaks for YCSB
         self.add_alternate_couchbase_addresses()
@@ -0,0 +1,105 @@
+""" Registry of long-lived SDK cluster connections shared by the Driver, ClusterManager and DataManager.
+Each cluster endpoint is bootstrapped once (cluster map fetch plus connection setup), waited on until it is
+ready and reused by every caller; bootstrap time is recorded as the 'bootstrap' metric. After a topology
+change that may remove the node a connection bootstrapped through, reconnect() drops the connections so
+the next caller bootstraps again. With a backend (see FakeCouchbase), connections go to it instead. """
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from couchbase.auth import PasswordAuthenticator
+from couchbase.cluster import Cluster
+
+from .MetricsRecorder import MetricsRecorder
+
+
+class ConnectionRegistry:
+    def __init__(self, username="", password="", verbose=False, bootstrap_timeout=30, metrics=None, backend=None):
+        self.username = username
+        self.password = password
+        # in-process stand-in for the cluster (FakeBackend); None connects to the real cluster
+        self.backend = backend
+        self.bootstrap_timeout = bootstrap_timeout
+        self.metrics = metrics or MetricsRecorder()
+        # (endpoint, owner) -> Cluster; owner None is the shared connection, anything else (e.g. a thread id)
+        # gets a connection of its own for work that must not contend with the shared one
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.setup_logging(verbose)
+
+    def setup_logging(self, verbose=False):
+        """ set up self.logger for ConnectionRegistry logging """
+        self.logger = logging.getLogger('ConnectionRegistry')
+        formatter = logging.Formatter('%(prefix)s - %(message)s')
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+        self.prefix = {'prefix': 'Connection Registry'}
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+        self.logger = logging.LoggerAdapter(self.logger, self.prefix)
+        self.logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
+
+    @staticmethod
+    def get_endpoint(address=""):
+        return address if address.startswith('couchbase://') else f'couchbase://{address}'
+
+    def get_cluster(self, address="", owner=None):
+        """ Return the connection to the cluster at address (host or couchbase:// URL), bootstrapping it on
+        first use; pass owner for a connection not shared with other callers """
+        key = (self.get_endpoint(address), owner)
+        with self.lock:
+            cluster = self.connections.get(key)
+        if cluster is None:
+            cluster = self.bootstrap(key[0], owner=owner)
+            with self.lock:
+                # another caller may have bootstrapped the same connection meanwhile; keep the first one
+                cluster = self.connections.setdefault(key, cluster)
+        return cluster
+
+    def bootstrap(self, endpoint="", owner=None):
+        """ Connect to endpoint and wait until the connection can serve requests; record how long it took """
+        start = time.time()
+        if self.backend:
+            cluster = self.backend.connect(endpoint)
+        else:
+            cluster = Cluster(endpoint, authenticator=PasswordAuthenticator(self.username, self.password))
+        # SDK versions without wait_until_ready connect synchronously in the constructor
+        if hasattr(cluster, 'wait_until_ready'):
+            cluster.wait_until_ready(timedelta(seconds=self.bootstrap_timeout))
+        elapsed = time.time() - start
+        self.debug(f'Bootstrapped {endpoint} in {elapsed:.3f}s')
+        self.metrics.record('bootstrap', elapsed, endpoint=endpoint, shared=owner is None)
+        return cluster
+
+    def reconnect(self, address=None):
+        """ Drop the connections to address (all connections if None); the next get_cluster bootstraps anew """
+        endpoint = self.get_endpoint(address) if address else None
+        with self.lock:
+            dropped = [key for key in self.connections if endpoint is None or key[0] == endpoint]
+            clusters = [self.connections.pop(key) for key in dropped]
+        if dropped:
+            self.info(f'Reconnecting {len(dropped)} connection(s) after topology change')
+        for cluster in clusters:
+            self.close_cluster(cluster)
+
+    def close_cluster(self, cluster=None):
+        # older SDK versions have no explicit close; their connections close when collected
+        close = getattr(cluster, 'close', None) or getattr(cluster, 'disconnect', None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                self.debug(e)
+
+    def close(self):
+        self.reconnect()
@@ -1,47 +1,176 @@
-import subprocess
-from couchbase.auth import PasswordAuthenticator
-from couchbase.cluster import Cluster
+from couchbase.collection import GetOptions
+from couchbase.exceptions import CouchbaseException, DocumentNotFoundException
+from datetime import timedelta
 from lib.Operations import (
     FullTextSearchOperation, InsertOperation, N1QLQueryOperation,
-    OperationCommander,UpdateOperation,DeleteOperation
+    OperationCommander,UpdateOperation,DeleteOperation,
+    BinaryInsertOperation, BinaryUpdateOperation, BinaryGetOperation,
+    PAYLOAD_MODE_ENCODE, PAYLOAD_MODE_PREENCODED, COMPRESSION_NONE, SAMPLING_RESERVOIR
 )
+from lib.AdminClient import AdminClient, AdminClientError, poll_until
+from lib.ConnectionRegistry import ConnectionRegistry
+from lib.MetricsRecorder import MetricsRecorder
 from lib.RandomDocumentGenerator import RandomDocumentGenerator
+from lib.PhraseVocabulary import PhraseVocabulary
 import requests
+import hashlib
 import json
 import logging
+import numpy as np
 import os
+import queue
 import random
 import string
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from yaspin import yaspin
 
 DEFAULT_SCOPE = "default_scope"
 DEFAULT_COLLECTION = "default_collection"
+# Key read (never written) to check that the data service answers for a bucket/collection
+READINESS_PROBE_KEY = "readiness-probe"
+# Key of the document describing the dataset a bucket was loaded with (see get_dataset_fingerprint)
+DATASET_FINGERPRINT_KEY = "__dataset_fingerprint__"
+# Number of documents whose mean serialized size files latencies measured at a target document size
+DOC_SIZE_SAMPLES = 20
 
 class DataManager:
-    def __init__(self, username="", password="", verbose=False, leader_address=""):
+    def __init__(self, username="", password="", verbose=False, leader_address="", document_seed=None,
+            doc_size=50, key_size=30, value_size=30, payload_mode=PAYLOAD_MODE_ENCODE, phrase_vocabulary=None,
+            document_schema=None, target_doc_size=None, load_workers=8, load_batch_size=500,
+            sampling_mode=SAMPLING_RESERVOIR, connection_registry=None, admin_client=None):
         self.username = username
         self.password = password
         self.verbose = verbose
         self.setup_logging(verbose=verbose)
         self.leader_address = leader_address
         self.random_data_generator = RandomDocumentGenerator()
-        self.database_operation_commander = OperationCommander()
-        self.couchbase_endpoint = f'couchbase://{self.leader_address}'
-        self.cluster = Cluster(
-            self.couchbase_endpoint,
-            authenticator=PasswordAuthenticator(
-                self.username,
-                self.password
-            )
-        )
+        # If a document seed is provided, documents are regenerated on the fly from (seed, key)
+        # instead of being drawn from the pre-generated corpus on disk
+        self.document_seed = document_seed
+        self.doc_size = doc_size
+        self.key_size = key_size
+        self.value_size = value_size
+        # If a document schema is provided ({field: spec}, see RandomDocumentGenerator.DEFAULT_DOCUMENT_SCHEMA),
+        # nested schema-driven documents are written instead of flat ones. A target_doc_size pads schema-driven
+        # documents (the default schema if none is provided) to that many bytes
+        self.document_schema = document_schema
+        self.target_doc_size = target_doc_size
+        # target document size -> mean serialized size of the documents actually written (see get_measured_doc_size)
+        self.measured_doc_sizes = {}
+        # number of host partitions running cells concurrently, this one included (see Driver.run_partitioned);
+        # they share the client, so their latencies are kept apart from those measured alone
+        self.partitions = None
+        # encode (SDK serializes a dict on every call) or preencoded (JSON bytes via raw JSON transcoder)
+        self.payload_mode = payload_mode
+        # Searchable phrase vocabulary; when one is provided, each document's vandy_phrase is assigned from it
+        # by key so query result sizes are controlled. The default (uniform vandy phrases) only supplies
+        # expected match counts and leaves documents untouched.
+        self.phrase_vocabulary = phrase_vocabulary or PhraseVocabulary()
+        self.apply_phrase_vocabulary = phrase_vocabulary is not None
+        # bucket name -> number of documents inserted by run_inserts, for expected match counts
+        self.bucket_doc_counts = {}
+        # bulk loader: concurrent workers, each upserting batches of load_batch_size documents
+        self.load_workers = load_workers
+        self.load_batch_size = load_batch_size
+        # which operations of a phase get their latency recorded (see OperationCommander.begin_phase)
+        self.database_operation_commander = OperationCommander(sampling_mode=sampling_mode, seed=document_seed)
+        # SDK connections are bootstrapped once and shared with the other managers (see ConnectionRegistry)
+        self.connections = connection_registry or ConnectionRegistry(username, password, verbose)
+        # bucket/scope/collection management over a pooled REST session instead of couchbase-cli processes
+        self.admin_client = admin_client or AdminClient(address=self.leader_address, username=self.username,
+            password=self.password, verbose=verbose)
+        # readiness durations (and other framework metrics) go to data/metrics/<metric>.jsonl
+        self.metrics = MetricsRecorder()
         self.bucket_ram_quota_mb = 1024
         self.bucket_replica_number = 2
 
+    @property
+    def cluster(self):
+        """ Shared connection to the cluster at leader_address (re-bootstrapped after a reconnect) """
+        return self.connections.get_cluster(self.leader_address)
+
     def set_bucket_replica_number(self, new_replica_number):
         self.info(f'Updating bucket replica number from {self.bucket_replica_number} to {new_replica_number}')
         self.bucket_replica_number = new_replica_number
 
+    def set_document_seed(self, new_document_seed):
+        self.info(f'Updating document seed from {self.document_seed} to {new_document_seed}')
+        self.document_seed = new_document_seed
+
+    def set_payload_mode(self, new_payload_mode):
+        self.info(f'Updating payload mode from {self.payload_mode} to {new_payload_mode}')
+        self.payload_mode = new_payload_mode
+
+    def set_document_schema(self, new_document_schema, new_target_doc_size=None):
+        self.info(f'Updating document schema (target_doc_size={new_target_doc_size})')
+        self.document_schema = new_document_schema
+        self.target_doc_size = new_target_doc_size
+
+    def set_partitions(self, new_partitions):
+        self.info(f'Updating concurrently running partitions from {self.partitions} to {new_partitions}')
+        self.partitions = new_partitions
+
+    def set_target_doc_size(self, new_target_doc_size):
+        self.info(f'Updating target document size from {self.target_doc_size} to {new_target_doc_size}')
+        self.target_doc_size = new_target_doc_size
+
+    def set_phrase_vocabulary(self, new_phrase_vocabulary):
+        self.info(f'Updating phrase vocabulary (distribution={new_phrase_vocabulary.distribution}, '
+                  f'rare_terms={new_phrase_vocabulary.rare_terms})')
+        self.phrase_vocabulary = new_phrase_vocabulary
+        self.apply_phrase_vocabulary = True
+
+    def get_document(self, key=0, num_docs=None):
+        """ Get the document to write under key; seeded (reproducible) if a document seed is set,
+        otherwise a random document from the pre-generated corpus. Returned as JSON bytes
+        in preencoded payload mode, else as a dict. If a phrase vocabulary is applied and the
+        bucket size num_docs is known, the vandy_phrase is assigned from the vocabulary by key """
+        assign_phrase = self.apply_phrase_vocabulary and num_docs
+        if self.document_schema is not None or self.target_doc_size:
+            if self.document_seed is not None:
+                doc = self.random_data_generator.generate_seeded_schema_json_document(
+                    seed=self.document_seed, key=key, schema=self.document_schema,
+                    target_size_bytes=self.target_doc_size)
+            else:
+                doc = self.random_data_generator.generate_schema_json_document(
+                    schema=self.document_schema, target_size_bytes=self.target_doc_size)
+        elif self.document_seed is not None:
+            doc = self.random_data_generator.generate_seeded_json_document(
+                seed=self.document_seed, key=key, doc_size=self.doc_size,
+                key_size=self.key_size, value_size=self.value_size)
+        elif self.payload_mode == PAYLOAD_MODE_PREENCODED and not assign_phrase:
+            return self.random_data_generator.get_random_json_doc_bytes()
+        else:
+            doc = self.random_data_generator.get_random_json_doc()
+        if assign_phrase:
+            doc['vandy_phrase'] = self.phrase_vocabulary.phrase_for_document(key=key, num_docs=num_docs)
+        return json.dumps(doc).encode() if self.payload_mode == PAYLOAD_MODE_PREENCODED else doc
+
+    def get_measured_doc_size(self):
+        """ Mean serialized size in bytes of the documents written at the current target document size,
+        measured (once per target) over the first DOC_SIZE_SAMPLES keys """
+        if self.target_doc_size not in self.measured_doc_sizes:
+            sizes = [len(doc) if isinstance(doc, bytes) else len(json.dumps(doc).encode())
+                     for doc in (self.get_document(key) for key in range(DOC_SIZE_SAMPLES))]
+            measured = round(sum(sizes) / len(sizes))
+            if measured != self.target_doc_size:
+                self.info(f'Documents at target size {self.target_doc_size} B measure {measured} B on average')
+            self.measured_doc_sizes[self.target_doc_size] = measured
+        return self.measured_doc_sizes[self.target_doc_size]
+
+    def document_stream(self, keys=None, num_docs=None):
+        """ Lazily yield (key, document) pairs for keys; nothing is pre-generated """
+        for key in keys or []:
+            yield key, self.get_document(key, num_docs=num_docs)
+
+    def get_query_phrase(self, bucket_name=""):
+        """ Pick a phrase to query bucket_name for; return (phrase, expected number of matching documents) """
+        phrase = self.phrase_vocabulary.random_query_phrase()
+        return phrase, self.phrase_vocabulary.expected_matches(
+            phrase=phrase, num_docs=self.bucket_doc_counts.get(bucket_name, 0))
+
     def setup_logging(self, verbose=False):
         """ set up self.logger for Driver logging """
         self.logger = logging.getLogger('DataManager')
@@ -49,7 +178,8 @@ class DataManager:
         handler = logging.StreamHandler()
         handler.setFormatter(formatter)
         self.prefix = {'prefix': 'Data Manager'}
-        self.logger.addHandler(handler)
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
         self.logger = logging.LoggerAdapter(self.logger, self.prefix )
         if verbose:
             self.logger.setLevel(logging.DEBUG)
@@ -86,13 +216,18 @@ class DataManager:
         else:
             index_name = f'default_primary_index_{bucket_name.replace("-","_")}'
             query = f'CREATE PRIMARY INDEX `{index_name}` ON `{bucket_name}`'
+        start = time.time()
+        response = None
         try:
             response = self.cluster.query(f'CREATE PRIMARY INDEX ON `default`:`{bucket_name}`')
             for r in response.rows():
                 self.info(r)
-            return response
         except:
-            return None
+            pass
+        # the index may also have existed already; either way it must be online before queries run
+        self.wait_until_ready(resource='primary-index', name=bucket_name,
+            check=lambda: self.primary_index_online(bucket_name), start=start, timeout=300)
+        return response
 
 
     def create_bucket(self, bucket_name="", bucket_ram_quota_mb=1024, bucket_replicas=0):
@@ -101,122 +236,143 @@ class DataManager:
             f"Creating bucket {bucket_name} with RAM quota {bucket_ram_quota_mb}MB "
             f"and {bucket_replicas} replicas"
             )
-        create_bucket_cmd = (
-            f'couchbase-cli bucket-create '
-            f'-c {self.couchbase_endpoint} '
-            f'--username {self.username} '
-            f'--password {self.password} '
-            f'--bucket {bucket_name} '
-            f'--bucket-type couchbase '
-            f'--durability-min-level none '
-            f'--bucket-ramsize {bucket_ram_quota_mb} '
-            f'--bucket-replica {bucket_replicas} '
-            f'--enable-flush 1 '
-            f'--conflict-resolution sequence '
-            f'--wait '
-        )
-        process = subprocess.Popen(create_bucket_cmd.split())
-        output, error = process.communicate()
-        if output and output != "None":
-            self.info(output)
-        if error and error != "None":
-            if "Bucket with given name already exists" in error:
-                # Simply update the replica number
-                self.info(f'Bucket {bucket_name} already exists, just applying updates (updated_replica_num={self.bucket_replica_number})')
-                create_bucket_cmd = (
-                    f'couchbase-cli bucket-edit '
-                    f'-c {self.couchbase_endpoint} '
-                    f'--username {self.username} '
-                    f'--password {self.password} '
-                    f'--bucket {bucket_name} '
-                    f'--bucket-type couchbase '
-                    f'--durability-min-level none '
-                    f'--bucket-ramsize {self.bucket_ram_quota_mb} '
-                    f'--bucket-replica {self.bucket_replica_number} '
-                    f'--enable-flush 1 '
-                    f'--conflict-resolution sequence '
-                    f'--wait '
-                )
-                process = subprocess.Popen(create_bucket_cmd.split())
-                output, error = process.communicate()
-                if output and output != "None":
-                    self.info(output)
-                if error and error != "None":
-                    self.error(error)
-        return output
+        start = time.time()
+        try:
+            response = self.admin_client.create_bucket(
+                bucket_name=bucket_name, ram_quota_mb=bucket_ram_quota_mb, replicas=bucket_replicas, wait=False)
+        except AdminClientError as e:
+            if not e.already_exists():
+                self.error(e)
+                return None
+            try:
+                existing = self.admin_client.get_buckets().get(bucket_name, {})
+                if (existing.get('replicas') == bucket_replicas
+                        and existing.get('ram_quota_mb') == bucket_ram_quota_mb):
+                    self.info(f'Bucket {bucket_name} already exists with these settings')
+                    return None
+                # Simply update the replica number (and quota)
+                self.info(f'Bucket {bucket_name} already exists, just applying updates '
+                          f'(updated_replica_num={bucket_replicas})')
+                response = self.admin_client.edit_bucket(bucket_name=bucket_name,
+                    ram_quota_mb=bucket_ram_quota_mb, replicas=bucket_replicas, wait=False)
+                if existing.get('replicas') != bucket_replicas:
+                    # replicas are only created or dropped by a rebalance
+                    self.admin_client.rebalance()
+            except AdminClientError as e:
+                self.error(e)
+                return None
+        self.wait_for_bucket_ready(bucket_name=bucket_name, start=start)
+        return response
 
     def create_scope(self, scope_name="", bucket_name=""):
         """ Create a collection """
         self.info(f'Creating scope {scope_name} on bucket {bucket_name}')
-        cmd = (
-            f'couchbase-cli collection-manage '
-            f'--cluster {self.couchbase_endpoint} '
-            f'--username {self.username} '
-            f'--password {self.password} '
-            f'--create-scope {scope_name} '
-            f'--bucket {bucket_name}'
-        )
-        process = subprocess.Popen(cmd.split())
-        output, error = process.communicate()
-        if error and error != "None":
-            self.error(error)
-        self.debug(output)
-        return output
+        try:
+            return self.admin_client.create_scope(bucket_name=bucket_name, scope_name=scope_name)
+        except AdminClientError as e:
+            self.error(e)
+            return None
 
     def create_collection(self, bucket_name="", scope_name="", collection_name=""):
         """ Create a collection """
         self.info(f'Creating collection {collection_name} on bucket {bucket_name}')
-        cmd = (
-            f'couchbase-cli collection-manage --cluster {self.couchbase_endpoint} '
-            f'--username {self.username} --password {self.password} '
-            f'--create-collection {scope_name}.{collection_name} '
-            f'--bucket {bucket_name}'
-        )
-        process = subprocess.Popen(cmd.split())
-        output, error = process.communicate()
-        if error and error != "None":
-            self.error(error)
-        self.debug(output)
-        return output
+        start = time.time()
+        response = None
+        try:
+            response = self.admin_client.create_collection(
+                bucket_name=bucket_name, scope_name=scope_name, collection_name=collection_name)
+        except AdminClientError as e:
+            if not e.already_exists():
+                self.error(e)
+                return None
+        # the manifest must list the collection and the data service must serve it on every vBucket owner
+        self.wait_until_ready(resource='collection', name=f'{bucket_name}.{scope_name}.{collection_name}',
+            check=lambda: (self.admin_client.collection_exists(bucket_name, scope_name, collection_name)
+                           and self.kv_probe(bucket_name, scope_name, collection_name)),
+            start=start)
+        return response
 
     def drop_bucket(self, bucket_name=""):
         """ Drop a bucket from the database """
-        cmd = (
-            f'couchbase-cli bucket-delete '
-            f'--cluster {self.couchbase_endpoint} '
-            f'--username {self.username} '
-            f'--password {self.password} '
-            f'--bucket {bucket_name}'
-        )
-        process = subprocess.Popen(cmd, shell=True)
-        output, error = process.communicate()
-        if error and error != "None":
-            self.error(error)
-        if output and output != "None":
-            self.info(output)
-        return output
+        try:
+            return self.admin_client.delete_bucket(bucket_name=bucket_name)
+        except AdminClientError as e:
+            self.error(e)
+            return None
 
     def flush_bucket(self, bucket_name=""):
         self.info(f"Flushing bucket {bucket_name}")
-        cmd = (
-            f'echo "Yes" | couchbase-cli bucket-flush --cluster {self.couchbase_endpoint} --username {self.username} '
-            f'--password {self.password} --bucket {bucket_name}'
-        )
-        process = subprocess.Popen(cmd, shell=True)
-        output, error = process.communicate()
-        if error and error != "None":
-            self.error(error)
-        if output and output != "None":
-            self.info(output)
-        return output
-
-    def init_data_file(self, cluster_size=1, bucket_name="small-bucket", operation="insert",  durability_level="", service_layout=None):
+        start = time.time()
+        try:
+            response = self.admin_client.flush_bucket(bucket_name=bucket_name)
+        except AdminClientError as e:
+            self.error(e)
+            return None
+        self.wait_for_bucket_ready(bucket_name=bucket_name, start=start, resource='bucket-flush')
+        return response
+
+    def kv_probe(self, bucket_name="", scope_name="_default", collection_name="_default"):
+        """ True if the data service serves reads on the collection: a get of a key that is never written
+        is answered with DocumentNotFound rather than a timeout, temporary failure or unknown collection """
+        try:
+            self.cluster.bucket(bucket_name).scope(scope_name).collection(collection_name).get(
+                READINESS_PROBE_KEY, GetOptions(timeout=timedelta(seconds=2)))
+        except DocumentNotFoundException:
+            return True
+        except CouchbaseException:
+            return False
+        return True
+
+    def primary_index_online(self, bucket_name=""):
+        """ True once every primary index on bucket_name has finished building """
+        try:
+            states = list(self.cluster.query(
+                f'SELECT RAW state FROM system:indexes WHERE keyspace_id = "{bucket_name}" AND is_primary = true'
+            ).rows())
+        except CouchbaseException:
+            return False
+        return bool(states) and all(state == 'online' for state in states)
+
+    def wait_for_bucket_ready(self, bucket_name="", start=None, resource='bucket'):
+        """ Wait until bucket_name is healthy on every node and its default collection serves reads """
+        return self.wait_until_ready(resource=resource, name=bucket_name,
+            check=lambda: self.admin_client.is_bucket_ready(bucket_name) and self.kv_probe(bucket_name),
+            start=start)
+
+    def wait_until_ready(self, resource="", name="", check=None, start=None, timeout=120):
+        """ Poll check with backoff until it passes, then record the seconds since start (when the resource
+        was requested) as a readiness metric. Raises AdminClientError on timeout, so no operation ever runs
+        against a resource that is not ready """
+        start = start or time.time()
+        _, attempts = poll_until(check, description=f'{resource} {name}', timeout=timeout)
+        ready_seconds = time.time() - start
+        self.info(f'{resource} {name} ready after {ready_seconds:.2f}s ({attempts} checks)')
+        self.metrics.record('readiness', ready_seconds, resource=resource, name=name, attempts=attempts)
+        return ready_seconds
+
+    def init_data_file(self, cluster_size=1, bucket_name="small-bucket", operation="insert",  durability_level="", service_layout=None,
+            value_size=None, compression=COMPRESSION_NONE):
         """ Initialize an empty file to which operation latency data can be written during execution;
-        Use cluster_size + 1 for folder name because cluster_size excludes leader. (cluster_size = 0 is just leader) """
+        Use cluster_size + 1 for folder name because cluster_size excludes leader. (cluster_size = 0 is just leader).
+        Latencies measured at a target document size go to a doc-size-<bytes> subfolder named after the
+        measured mean document size; insert/update latencies
+        measured with pre-encoded payloads go to a payload-preencoded subfolder so they can be compared against
+        the default encode-on-call latencies. Binary operations go to value-size-<bytes>[/compression-<mode>].
+        Latencies measured while other partitions of the host pool ran concurrently go to partitions-<N> """
         if service_layout:
             folder = f'data/durability-{durability_level}/cluster-size-{cluster_size + 1}/{bucket_name}/{operation}/{service_layout.get_simple_name()}'
         else:
             folder = f'data/durability-{durability_level}/cluster-size-{cluster_size + 1}/{bucket_name}/{operation}'
+        if value_size:
+            folder = f'{folder}/value-size-{value_size}'
+            if compression != COMPRESSION_NONE:
+                folder = f'{folder}/compression-{compression}'
+        elif self.target_doc_size:
+            folder = f'{folder}/doc-size-{self.get_measured_doc_size()}'
+        if operation in ['insert', 'update'] and self.payload_mode != PAYLOAD_MODE_ENCODE:
+            folder = f'{folder}/payload-{self.payload_mode}'
+        if self.partitions:
+            folder = f'{folder}/partitions-{self.partitions}'
         full_folder = os.path.join(
             os.path.dirname(__file__), folder
         )
@@ -226,9 +382,149 @@ class DataManager:
         return data_file
 
 
+    def get_dataset_fingerprint(self, num_docs=0):
+        """ Describe the dataset load_dataset writes: document count and everything that decides the
+        documents (seed or source corpus, schema, target size, phrase vocabulary) """
+        fingerprint = {
+            'num_docs': num_docs,
+            'document_seed': self.document_seed,
+            'target_doc_size': self.target_doc_size,
+            'schema_sha1': hashlib.sha1(json.dumps(self.document_schema, sort_keys=True).encode()).hexdigest()
+                if self.document_schema is not None else None,
+            'phrase_vocabulary': self.phrase_vocabulary.get_config() if self.apply_phrase_vocabulary else None,
+        }
+        if self.document_seed is not None:
+            fingerprint['flat_shape'] = [self.doc_size, self.key_size, self.value_size]
+        elif self.document_schema is None and not self.target_doc_size:
+            # unseeded documents are drawn from a corpus; the same corpus gives the same distribution
+            fingerprint['corpus'] = self.random_data_generator.get_corpus_id()
+        return fingerprint
+
+    def read_dataset_fingerprint(self, bucket_name="", scope_name=DEFAULT_SCOPE, collection_name=DEFAULT_COLLECTION):
+        """ Return the fingerprint stored in the collection, or None if there is none """
+        try:
+            return self.cluster.bucket(bucket_name).scope(scope_name).collection(collection_name).get(
+                DATASET_FINGERPRINT_KEY).content_as[dict]
+        except CouchbaseException:
+            return None
+
+    def write_dataset_fingerprint(self, bucket_name="", fingerprint=None, scope_name=DEFAULT_SCOPE,
+            collection_name=DEFAULT_COLLECTION):
+        self.cluster.bucket(bucket_name).scope(scope_name).collection(collection_name).upsert(
+            DATASET_FINGERPRINT_KEY, fingerprint)
+
+    def clear_dataset_fingerprint(self, bucket_name="", scope_name=DEFAULT_SCOPE, collection_name=DEFAULT_COLLECTION):
+        """ Mark the collection as no longer holding a known dataset (e.g. after unbalanced inserts) """
+        try:
+            self.cluster.bucket(bucket_name).scope(scope_name).collection(collection_name).remove(
+                DATASET_FINGERPRINT_KEY)
+        except DocumentNotFoundException:
+            pass
+
+    def remove_keys(self, bucket_name="", keys=None, scope_name=DEFAULT_SCOPE, collection_name=DEFAULT_COLLECTION):
+        """ Remove the documents under keys, skipping keys that hold none """
+        collection = self.cluster.bucket(bucket_name).scope(scope_name).collection(collection_name)
+        for key in keys or []:
+            try:
+                collection.remove(str(key))
+            except DocumentNotFoundException:
+                pass
+
+    def dataset_matches(self, bucket_name="", fingerprint=None, scope_name=DEFAULT_SCOPE,
+            collection_name=DEFAULT_COLLECTION):
+        # compare through JSON so tuples/lists and int/str keys stored in the bucket compare equal
+        return (json.loads(json.dumps(fingerprint)) ==
+                self.read_dataset_fingerprint(bucket_name, scope_name, collection_name))
+
+    def load_dataset(self, bucket_name="", num_docs=1000):
+        """ Make bucket_name hold documents 0..num_docs-1 and nothing else. If the stored fingerprint already
+        matches, the (unmeasured) load is skipped; otherwise the bucket is flushed, loaded and fingerprinted.
+        Return True if documents were loaded """
+        fingerprint = self.get_dataset_fingerprint(num_docs)
+        self.bucket_doc_counts[bucket_name] = num_docs
+        if self.dataset_matches(bucket_name, fingerprint):
+            self.info(f'Bucket {bucket_name} already holds the expected {num_docs} documents; skipping load')
+            self.metrics.record('dataset_load', 0, bucket=bucket_name, num_docs=num_docs, skipped=True)
+            return False
+        if self.document_seed is None:
+            self.info('No document seed set: measured updates will replace loaded documents with other '
+                      'documents from the same corpus')
+        self.flush_bucket(bucket_name=bucket_name)
+        start = time.time()
+        self.bulk_load(bucket_name=bucket_name, num_docs=num_docs)
+        # fingerprint last, so an interrupted load is never mistaken for a complete one
+        self.write_dataset_fingerprint(bucket_name, fingerprint)
+        self.metrics.record('dataset_load', time.time() - start, bucket=bucket_name, num_docs=num_docs, skipped=False)
+        return True
+
+    def open_worker_clusters(self, count=1):
+        """ Bootstrap count cluster connections of their own for concurrent workers, so workers never contend
+        for (or trip the lock on) the connection used by measured operations. They are not shared through the
+        registry; release them with close_worker_clusters """
+        endpoint = self.connections.get_endpoint(self.leader_address)
+        return [self.connections.bootstrap(endpoint, owner='worker') for _ in range(count)]
+
+    def close_worker_clusters(self, clusters=None):
+        for cluster in clusters or []:
+            self.connections.close_cluster(cluster)
+
+    def load_batch(self, bucket_name="", keys=None, num_docs=0, cluster=None):
+        """ Generate and upsert the documents for keys in one multi-document call through cluster (a worker
+        connection, see open_worker_clusters); return how many failed """
+        docs = {}
+        for key, doc in self.document_stream(keys=keys, num_docs=num_docs):
+            # the multi-document API only takes documents for the default JSON transcoder
+            docs[str(key)] = json.loads(bytes(doc)) if isinstance(doc, (bytes, bytearray, memoryview)) else doc
+        try:
+            cluster.bucket(bucket_name).scope(DEFAULT_SCOPE).collection(DEFAULT_COLLECTION).upsert_multi(docs)
+        except CouchbaseException as e:
+            failed = [key for key, result in getattr(e, 'all_results', {}).items() if not result.success]
+            self.error(f'{len(failed) or len(docs)} of {len(docs)} documents failed to load: {e}')
+            return len(failed) or len(docs)
+        return 0
+
+    def bulk_load(self, bucket_name="", num_docs=1000, workers=None, batch_size=None):
+        """ Fill bucket_name with documents 0..num_docs-1 as fast as possible: load_workers threads upsert
+        batches of load_batch_size documents without durability requirements, each thread through a connection
+        of its own bootstrapped before the load is timed. Nothing is recorded as an operation latency; the load
+        throughput (docs/sec) is logged and recorded as a metric """
+        workers = workers or self.load_workers
+        batch_size = batch_size or self.load_batch_size
+        batches = [range(start, min(start + batch_size, num_docs)) for start in range(0, num_docs, batch_size)]
+        self.info(f'Bulk loading {num_docs} documents into {bucket_name} '
+                  f'({workers} workers, batches of {batch_size}, not recorded)...')
+        # no more connections than batches can use at once; a thread takes an idle one for each batch
+        clusters = self.open_worker_clusters(count=min(workers, len(batches)))
+        idle_clusters = queue.Queue()
+        for cluster in clusters:
+            idle_clusters.put(cluster)
+
+        def load(keys):
+            cluster = idle_clusters.get()
+            try:
+                return self.load_batch(bucket_name=bucket_name, keys=keys, num_docs=num_docs, cluster=cluster)
+            finally:
+                idle_clusters.put(cluster)
+
+        try:
+            start = time.time()
+            with yaspin().white.bold.shark.on_blue as sp:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    failed = sum(pool.map(load, batches))
+            elapsed = time.time() - start
+        finally:
+            self.close_worker_clusters(clusters)
+        docs_per_sec = (num_docs - failed) / elapsed if elapsed else float('inf')
+        self.info(f'Loaded {num_docs - failed} documents in {elapsed:.2f}s ({docs_per_sec:.1f} docs/sec)')
+        self.metrics.record('load_throughput', docs_per_sec, bucket=bucket_name, num_docs=num_docs,
+            failed=failed, seconds=elapsed, workers=workers, batch_size=batch_size, partitions=self.partitions,
+            doc_size=self.get_measured_doc_size() if self.target_doc_size else None)
+        return num_docs - failed
+
     def run_inserts(self, cluster_size=1, bucket_name="", num_docs=1000, operations_to_record=100,
-        durability_level="low", service_layout=None):
-        """ Insert num_docs random JSON documents into the specified bucket """
+        durability_level="low", service_layout=None, key_offset=0):
+        """ Insert num_docs random JSON documents into the specified bucket, keyed from key_offset
+        (past the end of a dataset loaded by load_dataset when key_offset is its size) """
         # Write all the insert latency data to this file
         data_file_name = self.init_data_file(
             cluster_size=cluster_size,
@@ -237,24 +533,45 @@ class DataManager:
             durability_level=durability_level,
             service_layout=service_layout
         )
-        self.info(f'Running {num_docs} Insert operations (only RECORDING {operations_to_record})...')
-        operations_recorded = 0
+        self.info(f'Running {num_docs} Insert operations (RECORDING {operations_to_record}, '
+                  f'{self.database_operation_commander.sampling_mode} sampling)...')
+        self.bucket_doc_counts[bucket_name] = key_offset + num_docs
+        # phrases are assigned relative to the loaded dataset size, so its rare terms keep their counts
+        dataset_size = key_offset if key_offset else num_docs
+        self.begin_phase(data_file_name, sample_size=operations_to_record, expected_operations=num_docs)
         with yaspin().white.bold.shark.on_blue as sp:
-            for i in range(num_docs):
+            for i, doc in self.document_stream(keys=range(key_offset, key_offset + num_docs), num_docs=dataset_size):
                 # Create an Insert operation object and execute it with commander.
-                # Insert one of the pre-generated random JSON documents.
+                # Insert one of the pre-generated (or seeded) random JSON documents.
                 self.database_operation_commander.execute_operation(
                     operation=InsertOperation(
                         verbose=self.verbose,
                         data_file_name=data_file_name,
                         cluster=self.cluster,
                         bucket_name=bucket_name,
-                        insert_doc=self.random_data_generator.get_random_json_doc(),
+                        insert_doc=doc,
                         doc_key=i,
-                        durability_level=durability_level),
-                    record_operation_latency=(operations_recorded < operations_to_record)
+                        durability_level=durability_level,
+                        payload_mode=self.payload_mode)
                     )
-                operations_recorded += 1
+        self.end_phase(bucket_name=bucket_name)
+
+    def begin_phase(self, data_file_name="", sample_size=100, expected_operations=None):
+        """ Start a phase of operations writing to data_file_name; see OperationCommander.begin_phase """
+        self.database_operation_commander.begin_phase(name=data_file_name, sample_size=sample_size,
+            expected_operations=expected_operations)
+
+    def end_phase(self, bucket_name=""):
+        """ Flush the phase's sampled latencies and record its operation counters as a 'phase_operations'
+        metric (value = operations executed, with recorded samples and wall time as labels) """
+        summary = self.database_operation_commander.end_phase()
+        if summary is None:
+            return None
+        self.debug(f'Phase {summary["phase"]}: {summary["operations"]} operations in {summary["seconds"]:.2f}s, '
+                   f'{summary["recorded"]} recorded')
+        self.metrics.record('phase_operations', summary.pop('operations'), bucket=bucket_name,
+            partitions=self.partitions, **summary)
+        return summary
 
     def run_n1ql_selects(self,  cluster_size=1, bucket_name="", operations_to_record=100,durability_level="low",
         service_layout=None):
@@ -266,20 +583,24 @@ class DataManager:
             durability_level=durability_level,
             service_layout=service_layout)
         self.info(f'Running {operations_to_record} N1QL SELECT [...] operations...')
+        self.begin_phase(data_file_name, sample_size=operations_to_record)
         with yaspin().white.bold.shark.on_blue as sp:
             for i in range(operations_to_record):
                 # Create an Insert operation object and execute it with commander.
                 # Insert one of the pre-generated random JSON documents.
+                vandy_phrase, expected_matches = self.get_query_phrase(bucket_name=bucket_name)
                 self.database_operation_commander.execute_operation(
                     operation=N1QLQueryOperation(
                         verbose=self.verbose,
                         data_file_name=data_file_name,
                         cluster=self.cluster,
                         bucket_name=bucket_name,
-                        vandy_phrase=self.random_data_generator.random_vandy_phrase()
+                        vandy_phrase=vandy_phrase,
+                        expected_matches=expected_matches
                     ),
                     record_operation_latency=True
                     )
+        self.end_phase(bucket_name=bucket_name)
 
     def run_full_text_searches(self,  cluster_size=1, bucket_name="", operations_to_record=100,
         durability_level="low", service_layout=None):
@@ -293,20 +614,24 @@ class DataManager:
             durability_level=durability_level,
             service_layout=service_layout
         )
+        self.begin_phase(data_file_name, sample_size=operations_to_record)
         with yaspin().white.bold.shark.on_blue as sp:
             for i in range(operations_to_record):
                 # Create an Insert operation object and execute it with commander.
                 # Insert one of the pre-generated random JSON documents.
+                vandy_phrase, expected_matches = self.get_query_phrase(bucket_name=bucket_name)
                 self.database_operation_commander.execute_operation(
                     operation=FullTextSearchOperation(
                         verbose=self.verbose,
                         data_file_name=data_file_name,
                         cluster=self.cluster,
                         bucket_name=bucket_name,
-                        vandy_phrase=self.random_data_generator.random_vandy_phrase()
+                        vandy_phrase=vandy_phrase,
+                        expected_matches=expected_matches
                     ),
                     record_operation_latency=True
                 )
+        self.end_phase(bucket_name=bucket_name)
 
     def run_updates(self, cluster_size=1, bucket_name="", operations_to_record=100,durability_level="low",
         service_layout=None):
@@ -318,22 +643,28 @@ class DataManager:
             durability_level=durability_level,
             service_layout=service_layout)
 
+        self.begin_phase(data_file_name, sample_size=operations_to_record)
         with yaspin().white.bold.shark.on_blue as sp:
-            for i in range(operations_to_record):
+            for i, doc in self.document_stream(keys=range(operations_to_record),
+                    num_docs=self.bucket_doc_counts.get(bucket_name)):
                 self.database_operation_commander.execute_operation(
                     UpdateOperation(
                         verbose=self.verbose,
                         data_file_name=data_file_name,
                         cluster=self.cluster,
                         bucket_name=bucket_name,
-                        doc_replace_value=self.random_data_generator.get_random_json_doc(),
+                        doc_replace_value=doc,
                         doc_key=i,
-                        durability_level=durability_level),
+                        durability_level=durability_level,
+                        payload_mode=self.payload_mode),
                         record_operation_latency=True
                     )
+        self.end_phase(bucket_name=bucket_name)
 
     def delete_docs_in_bucket(self, cluster_size=1, bucket_name="", operations_to_record=100,
-        durability_level="low", service_layout=None):
+        durability_level="low", service_layout=None, key_offset=0):
+        """ Delete documents key_offset..key_offset+operations_to_record-1; with key_offset at the end of a
+        loaded dataset this removes exactly the measured inserts and leaves the dataset intact """
         self.info(f'Running {operations_to_record} Delete operations...')
         data_file_name = self.init_data_file(
             cluster_size=cluster_size,
@@ -341,8 +672,9 @@ class DataManager:
             operation='delete',
             durability_level=durability_level,
             service_layout=service_layout)
+        self.begin_phase(data_file_name, sample_size=operations_to_record)
         with yaspin().white.bold.shark.on_blue as sp:
-            for i in range(operations_to_record):
+            for i in range(key_offset, key_offset + operations_to_record):
                 self.database_operation_commander.execute_operation(
                     DeleteOperation(
                         verbose=self.verbose,
@@ -353,5 +685,70 @@ class DataManager:
                         durability_level=durability_level),
                         record_operation_latency=True
                     )
+        self.end_phase(bucket_name=bucket_name)
+        if key_offset:
+            self.bucket_doc_counts[bucket_name] = key_offset
+
 
 
+    def run_binary_operations(self, cluster_size=1, bucket_name="", value_size=1024 * 1024, compressibility=0.0,
+        compression=COMPRESSION_NONE, operations_to_record=100, durability_level="low", service_layout=None):
+        """ Insert, update and get operations_to_record raw binary values of value_size bytes (through the
+        raw binary transcoder, optionally compressed on the client), recording latency plus payload size and
+        bytes on the wire for each; the values are removed again afterward, and values left behind by an
+        interrupted run are removed first. Payloads are generated one at a time from a seeded stream, so
+        multi-megabyte values are never all held in memory """
+        data_file_names = {
+            operation: self.init_data_file(
+                cluster_size=cluster_size,
+                bucket_name=bucket_name,
+                operation=operation,
+                durability_level=durability_level,
+                service_layout=service_layout,
+                value_size=value_size,
+                compression=compression)
+            for operation in ['binary-insert', 'binary-update', 'binary-get']
+        }
+        seed = self.document_seed if self.document_seed is not None else random.randrange(2 ** 32)
+        self.remove_keys(bucket_name=bucket_name, keys=range(operations_to_record))
+        self.info(f'Running {operations_to_record} binary Insert/Update/Get operations '
+                  f'(value_size={value_size}, compressibility={compressibility}, compression={compression})...')
+        with yaspin().white.bold.shark.on_blue as sp:
+            for stream, (operation_class, operation) in enumerate([(BinaryInsertOperation, 'binary-insert'),
+                                                                   (BinaryUpdateOperation, 'binary-update')]):
+                # updates draw from their own stream so every replace writes a different value
+                rng = np.random.default_rng([seed, stream])
+                for i in range(operations_to_record):
+                    self.database_operation_commander.execute_operation(
+                        operation_class(
+                            verbose=self.verbose,
+                            data_file_name=data_file_names[operation],
+                            cluster=self.cluster,
+                            bucket_name=bucket_name,
+                            payload=self.random_data_generator.generate_binary_payload(
+                                size=value_size, compressibility=compressibility, rng=rng),
+                            doc_key=i,
+                            durability_level=durability_level,
+                            compression=compression),
+                        record_operation_latency=True
+                    )
+            for i in range(operations_to_record):
+                self.database_operation_commander.execute_operation(
+                    BinaryGetOperation(
+                        verbose=self.verbose,
+                        data_file_name=data_file_names['binary-get'],
+                        cluster=self.cluster,
+                        bucket_name=bucket_name,
+                        doc_key=i,
+                        compression=compression),
+                    record_operation_latency=True
+                )
+            for i in range(operations_to_record):
+                self.database_operation_commander.execute_operation(
+                    DeleteOperation(
+                        verbose=self.verbose,
+                        cluster=self.cluster,
+                        bucket_name=bucket_name,
+                        doc_key=i,
+                        durability_level=durability_level)
+                )
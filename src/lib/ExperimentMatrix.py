@@ -0,0 +1,294 @@
+""" Declarative experiment matrix: a spec lists the sweep dimensions of an experiment (e.g. durability level x
+cluster size x bucket size), the matrix expands their Cartesian product into cells (outermost dimension
+first, like nested for-loops) and runs them in order. Every cell start, completion and failure is journaled
+to disk, so a sweep interrupted by a crash can be resumed: completed cells are skipped, and latency lines an
+interrupted cell had already appended are truncated away before it runs again.
+
+Each dimension also has a transition cost: changing cluster_size means a cluster resize, changing the bucket a
+bucket (re)load, while durability is only a per-operation option. The scheduler runs the cells with the most
+expensive dimensions outermost, in a snake order where consecutive cells differ in one costly dimension, so
+expensive transitions stay rare. Cells are identified by their values, never by position, so the order does not
+change where results are written. """
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+CELL_STARTED = 'started'
+CELL_APPENDED = 'appended'
+CELL_DONE = 'done'
+CELL_FAILED = 'failed'
+
+# transition cost levels, most expensive first
+COST_CLUSTER = 'cluster'
+COST_BUCKET = 'bucket'
+COST_OPERATION = 'operation'
+COST_LEVELS = [COST_CLUSTER, COST_BUCKET, COST_OPERATION]
+# rough setup seconds paid per transition at each level, used for the estimate before any was measured
+DEFAULT_TRANSITION_SECONDS = {COST_CLUSTER: 90.0, COST_BUCKET: 15.0, COST_OPERATION: 0.0}
+
+
+def get_cell_id(experiment="", cell=None):
+    """ Stable id of a cell: the same experiment and dimension values always give the same id """
+    canonical = json.dumps({'experiment': experiment, 'cell': cell}, sort_keys=True)
+    return hashlib.sha1(canonical.encode()).hexdigest()[:16]
+
+
+class ExperimentJournal:
+    def __init__(self, journal_file="", resume=False):
+        """ Append-only JSONL log of cell events. Without resume the journal starts over """
+        self.journal_file = journal_file
+        Path(os.path.dirname(journal_file) or '.').mkdir(parents=True, exist_ok=True)
+        if not resume and os.path.exists(journal_file):
+            os.remove(journal_file)
+        # partition workers (see HostPool) record cells concurrently
+        self.lock = threading.Lock()
+        # cell id -> {'status': last status, 'appends': {file: size before the cell first appended to it}}
+        self.cells = self.load()
+
+    def load(self):
+        cells = {}
+        if not os.path.exists(self.journal_file):
+            return cells
+        with open(self.journal_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line torn by the crash; everything before it is intact
+                    continue
+                self.apply(cells, entry)
+        return cells
+
+    @staticmethod
+    def apply(cells=None, entry=None):
+        """ Update the cell states with one journal entry; appends are forgotten once a cell is done """
+        cell = cells.setdefault(entry['cell_id'], {'status': None, 'appends': {}})
+        if entry['event'] == CELL_APPENDED:
+            cell['appends'].setdefault(entry['file'], entry['offset'])
+        else:
+            cell['status'] = entry['event']
+            if entry['event'] == CELL_DONE:
+                cell['appends'] = {}
+
+    def record(self, event="", cell_id="", **fields):
+        """ Append one event and force it to disk before the sweep goes on """
+        entry = {'timestamp': time.time(), 'event': event, 'cell_id': cell_id}
+        entry.update(fields)
+        with self.lock:
+            with open(self.journal_file, 'a') as f:
+                f.write(f'{json.dumps(entry)}\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.apply(self.cells, entry)
+
+    def is_done(self, cell_id=""):
+        return self.cells.get(cell_id, {}).get('status') == CELL_DONE
+
+    def record_append(self, cell_id="", file_name="", offset=0):
+        """ Note that cell_id is about to append to file_name, currently offset bytes long (first append only) """
+        with self.lock:
+            recorded = file_name in self.cells.get(cell_id, {}).get('appends', {})
+        if not recorded:
+            self.record(CELL_APPENDED, cell_id, file=file_name, offset=offset)
+
+    def rollback(self, cell_id=""):
+        """ Truncate every file an interrupted or failed cell appended to back to its size before the cell;
+        return those files """
+        appends = self.cells.get(cell_id, {}).get('appends', {})
+        for file_name, offset in appends.items():
+            if os.path.exists(file_name) and os.path.getsize(file_name) > offset:
+                with open(file_name, 'r+') as f:
+                    f.truncate(offset)
+        return list(appends)
+
+
+class ExperimentMatrix:
+    def __init__(self, name="", experiment="", dimensions=None, settings=None, costs=None, schedule=True,
+            transition_seconds=None, verbose=False):
+        """
+        name: names the journal (data/journal/<name>.jsonl).
+        experiment: which Driver experiment runs each cell ('homogeneous', 'heterogeneous', 'ycsb').
+        dimensions: {dimension: [values]}, outermost first.
+        settings: experiment-wide options that are not swept (e.g. {'layout_edition': 'community'}).
+        costs: {dimension: cost level} (COST_CLUSTER, COST_BUCKET); other dimensions are COST_OPERATION.
+        schedule: run the cells in cost order (get_scheduled_cells) instead of declaration order.
+        transition_seconds: {cost level: seconds} for the savings estimate (DEFAULT_TRANSITION_SECONDS).
+        """
+        self.name = name or experiment
+        self.experiment = experiment
+        self.dimensions = dimensions or {}
+        self.settings = settings or {}
+        self.costs = costs or {}
+        self.schedule = schedule
+        self.transition_seconds = dict(DEFAULT_TRANSITION_SECONDS, **(transition_seconds or {}))
+        # cost level -> measured setup seconds, filled by record_setup while the cells run
+        self.setup_seconds = {}
+        self.setup_logging(verbose)
+
+    @classmethod
+    def from_config_file(cls, config_file="", verbose=False):
+        """ Build a matrix from a JSON file, e.g.
+        {"name": "durability-sweep", "experiment": "homogeneous",
+         "dimensions": {"durability_level": ["low", "high"], "cluster_size": [0, 2, 4], "bucket": ["small-bucket"]},
+         "costs": {"cluster_size": "cluster", "bucket": "bucket"}} """
+        with open(config_file) as f:
+            config = json.load(f)
+        return cls(
+            name=config.get('name'),
+            experiment=config['experiment'],
+            dimensions=config.get('dimensions'),
+            settings=config.get('settings'),
+            costs=config.get('costs'),
+            schedule=config.get('schedule', True),
+            transition_seconds=config.get('transition_seconds'),
+            verbose=verbose)
+
+    def setup_logging(self, verbose=False):
+        """ set up self.logger for ExperimentMatrix logging """
+        self.logger = logging.getLogger('ExperimentMatrix')
+        formatter = logging.Formatter('%(prefix)s - %(message)s')
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+        self.prefix = {'prefix': 'Experiment Matrix'}
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+        self.logger = logging.LoggerAdapter(self.logger, self.prefix)
+        self.logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
+
+    def get_journal_file(self, journal_folder=None):
+        journal_folder = journal_folder or os.path.join(os.path.dirname(__file__), 'data', 'journal')
+        return os.path.join(journal_folder, f'{self.name}.jsonl')
+
+    def get_cells(self):
+        """ Cartesian product of the dimensions as a list of {dimension: value}, last dimension varying fastest """
+        names = list(self.dimensions)
+        return [dict(zip(names, values)) for values in itertools.product(*(self.dimensions[n] for n in names))]
+
+    def get_cost_level(self, dimension=""):
+        return self.costs.get(dimension, COST_OPERATION)
+
+    def get_scheduled_cells(self):
+        """ The cells ordered to keep expensive transitions rare: costly dimensions are sorted outermost
+        (cluster, then bucket) and walked in snake order, each block of inner values running backward after
+        a forward one, so consecutive cells differ in a single costly dimension. COST_OPERATION dimensions stay
+        innermost in their declared order (an experiment may rely on it, e.g. YCSB inserts last) """
+        names = sorted(self.dimensions, key=lambda n: COST_LEVELS.index(self.get_cost_level(n)))
+        costly = [n for n in names if self.get_cost_level(n) != COST_OPERATION]
+        free = [n for n in names if self.get_cost_level(n) == COST_OPERATION]
+        blocks = [{}]
+        for name in reversed(costly):
+            values = self.dimensions[name]
+            blocks = [dict({name: value}, **block) for i, value in enumerate(values)
+                      for block in (blocks if i % 2 == 0 else blocks[::-1])]
+        free_cells = [dict(zip(free, values)) for values in itertools.product(*(self.dimensions[n] for n in free))]
+        return [dict(block, **free_cell) for block in blocks for free_cell in free_cells]
+
+    def count_transitions(self, cells=None):
+        """ {cost level: number of times it is paid} running cells in order: a cell pays each level whose
+        dimensions differ from the previous cell's (the first cell pays every level once) """
+        counts = {level: 0 for level in COST_LEVELS}
+        previous = None
+        for cell in cells:
+            changed = {self.get_cost_level(n) for n in cell if previous is None or previous[n] != cell[n]}
+            for level in changed:
+                counts[level] += 1
+            previous = cell
+        return counts
+
+    def estimate_setup_seconds(self, cells=None, transition_seconds=None):
+        transition_seconds = transition_seconds or self.transition_seconds
+        return sum(n * transition_seconds.get(level, 0) for level, n in self.count_transitions(cells).items())
+
+    def record_setup(self, level=COST_CLUSTER, seconds=0.0):
+        """ Measured wall time of one transition at level (e.g. a cluster resize), for the savings report """
+        self.setup_seconds.setdefault(level, []).append(seconds)
+
+    def get_measured_transition_seconds(self):
+        """ Mean measured seconds per transition at each level; levels not measured keep their estimate """
+        measured = dict(self.transition_seconds)
+        measured.update({level: sum(s) / len(s) for level, s in self.setup_seconds.items() if s})
+        return measured
+
+    def describe_transitions(self, counts=None):
+        return ', '.join(f'{n} {level}' for level, n in counts.items() if level != COST_OPERATION)
+
+    def get_run_cells(self):
+        """ The cells in the order run executes them """
+        return self.get_scheduled_cells() if self.schedule else self.get_cells()
+
+    def run(self, run_cell=None, journal=None, on_cell_start=None):
+        """ Call run_cell(**cell) for every cell not yet done according to journal. A failing cell is journaled
+        and its exception re-raised, so the sweep stops there and a resumed run retries it. on_cell_start(cell_id)
+        is called before each cell runs (e.g. to route appended latency lines to journal.record_append).
+        Return (cells run, cells skipped) """
+        cells = self.get_run_cells()
+        if self.schedule:
+            declared = self.get_cells()
+            self.info(
+                f'Scheduled {len(cells)} cells: {self.describe_transitions(self.count_transitions(cells))} '
+                f'transitions instead of {self.describe_transitions(self.count_transitions(declared))}; estimated '
+                f'setup saved {self.estimate_setup_seconds(declared) - self.estimate_setup_seconds(cells):.0f}s')
+        ran, skipped = 0, 0
+        for index, cell in enumerate(cells):
+            if self.execute_cell(cell, run_cell, journal, on_cell_start, position=f'{index + 1}/{len(cells)}') is None:
+                skipped += 1
+            else:
+                ran += 1
+        if skipped:
+            self.info(f'Skipped {skipped} cells already completed in {journal.journal_file}')
+        if self.schedule and self.setup_seconds:
+            self.report_savings(declared, cells)
+        return ran, skipped
+
+    def execute_cell(self, cell=None, run_cell=None, journal=None, on_cell_start=None, position=""):
+        """ Run one cell as run does (skip if done, roll back if interrupted, journal it); safe to call from
+        several threads sharing journal. Return the seconds it took, or None if it was already done """
+        cell_id = get_cell_id(self.experiment, cell)
+        if journal.is_done(cell_id):
+            self.debug(f'Skipping completed cell {position} {cell}')
+            return None
+        rolled_back = journal.rollback(cell_id)
+        if rolled_back:
+            self.info(f'Cell {cell} was interrupted; truncated the {len(rolled_back)} files it had appended to')
+        self.info(f'Running cell {position} of {self.name}: {cell}')
+        journal.record(CELL_STARTED, cell_id, cell=cell)
+        if on_cell_start:
+            on_cell_start(cell_id)
+        start = time.time()
+        try:
+            run_cell(**cell)
+        except BaseException as e:
+            journal.record(CELL_FAILED, cell_id, cell=cell, error=repr(e), seconds=time.time() - start)
+            self.error(f'Cell {cell} failed after {time.time() - start:.1f}s: {e!r}')
+            raise
+        seconds = time.time() - start
+        journal.record(CELL_DONE, cell_id, cell=cell, seconds=seconds)
+        return seconds
+
+    def report_savings(self, declared=None, scheduled=None):
+        """ Log the setup time the schedule saved, pricing the transitions it avoided at the measured mean cost
+        of each level (estimated cost for levels that were never measured). Return the seconds saved """
+        measured = self.get_measured_transition_seconds()
+        estimated = self.estimate_setup_seconds(declared) - self.estimate_setup_seconds(scheduled)
+        saved = (self.estimate_setup_seconds(declared, measured) -
+                 self.estimate_setup_seconds(scheduled, measured))
+        spent = sum(sum(s) for s in self.setup_seconds.values())
+        setups = ', '.join(f'{len(s)} {level} x {measured[level]:.1f}s' for level, s in self.setup_seconds.items())
+        self.info(f'Setup time saved by scheduling: {saved:.1f}s at the measured transition costs '
+                  f'(estimated {estimated:.0f}s); {spent:.1f}s spent on setup ({setups})')
+        return saved
@@ -0,0 +1,689 @@
+""" In-process stand-in for a Couchbase cluster, so the harness can be profiled, tested and run end to end
+without EC2 hosts. FakeBackend keeps the whole cluster (nodes, buckets, scopes, collections, documents,
+primary indexes, users) in memory; FakeCluster implements the part of the SDK Cluster / Bucket / Scope /
+Collection API that Operations and DataManager use, and FakeAdminClient answers the management REST calls
+AdminClient makes. Every SDK call sleeps for a latency drawn from a LatencyModel (per operation type and
+durability level) and may fail with an error picked by a FaultInjector. """
+
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from types import SimpleNamespace
+
+from couchbase.exceptions import (
+    BucketNotFoundException, CollectionNotFoundException, CouchbaseException, DocumentExistsException,
+    DocumentNotFoundException, DurabilityImpossibleException, QueryIndexNotFoundException, ScopeNotFoundException,
+    SearchException, TemporaryFailException, TimeoutException
+)
+
+from .AdminClient import AdminClient, AdminClientError
+from .Operations import DURABILITY_MAP
+
+# Latency of each operation type: lognormal with the given median (ms) and sigma, plus per_kb_ms for every KB of
+# value written or read. A '<operation>:<durability level>' entry overrides the durability factor for that pair
+DEFAULT_LATENCIES = {
+    'get': {'median_ms': 0.4, 'sigma': 0.3, 'per_kb_ms': 0.01},
+    'insert': {'median_ms': 0.8, 'sigma': 0.3, 'per_kb_ms': 0.02},
+    'upsert': {'median_ms': 0.8, 'sigma': 0.3, 'per_kb_ms': 0.02},
+    'replace': {'median_ms': 0.8, 'sigma': 0.3, 'per_kb_ms': 0.02},
+    'remove': {'median_ms': 0.6, 'sigma': 0.3, 'per_kb_ms': 0},
+    'query': {'median_ms': 4.0, 'sigma': 0.4, 'per_kb_ms': 0.05},
+    'search': {'median_ms': 6.0, 'sigma': 0.4, 'per_kb_ms': 0.05},
+}
+# Mutations wait for replication (low), persistence on the active (medium) or persistence on a majority (high)
+DEFAULT_DURABILITY_FACTORS = {'low': 1.6, 'medium': 2.5, 'high': 6.0}
+MUTATIONS = ['insert', 'upsert', 'replace', 'remove']
+# Errors a FaultInjector can raise
+FAULT_ERRORS = {
+    'timeout': TimeoutException,
+    'temporary_failure': TemporaryFailException,
+    'durability_impossible': DurabilityImpossibleException,
+}
+
+
+def get_option(options=(), name=""):
+    """ Value of name in the first SDK option block (GetOptions, InsertOptions, ...) that sets it """
+    for block in options:
+        if isinstance(block, dict) and name in block:
+            return block[name]
+    return None
+
+
+def get_durability_level(durability=None):
+    """ Framework durability level ('low', 'medium', 'high') of an SDK durability setting, None if unset """
+    return next((level for level, d in DURABILITY_MAP.items() if durability is not None and d == durability), None)
+
+
+def get_value_size(value=None):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return len(json.dumps(value))
+
+
+def get_json_document(value=None):
+    """ Stored value as the JSON object N1QL and FTS see: dicts as is, JSON bytes (pre-encoded payloads)
+    decoded; None for anything else (e.g. raw binary values) """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        try:
+            value = json.loads(bytes(value))
+        except ValueError:
+            return None
+    return value if isinstance(value, dict) else None
+
+
+class LatencyModel:
+    def __init__(self, latencies=None, durability_factors=None, scale=1.0, seed=0):
+        """
+        latencies: {operation or 'operation:durability': {'median_ms', 'sigma', 'per_kb_ms'}} on top of
+        DEFAULT_LATENCIES. durability_factors: multiplier of mutation latency per durability level.
+        scale: multiplies every latency; 0 turns sleeping off (fast functional tests).
+        """
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.durability_factors = dict(DEFAULT_DURABILITY_FACTORS, **(durability_factors or {}))
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self, operation="", durability=None, size=0):
+        """ Seconds operation takes for a value of size bytes at the given durability level """
+        if self.scale == 0:
+            return 0
+        spec, factor = self.latencies.get(f'{operation}:{durability}'), 1
+        if spec is None:
+            spec = self.latencies.get(operation, {})
+            factor = self.durability_factors.get(durability, 1) if operation in MUTATIONS else 1
+        median_ms = spec.get('median_ms', 0)
+        with self.lock:
+            noise = self.rng.lognormvariate(0, spec.get('sigma', 0)) if median_ms else 0
+        latency_ms = median_ms * noise * factor + spec.get('per_kb_ms', 0) * size / 1024
+        return latency_ms * self.scale / 1000
+
+
+class FaultInjector:
+    def __init__(self, faults=None, seed=0):
+        """ faults: [{'operation': operation or '*', 'error': one of FAULT_ERRORS, 'rate': probability per call,
+        'count': at most this many injections (unlimited if missing)}] """
+        self.faults = [dict(f) for f in faults or []]
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # (operation, error) -> injections so far
+        self.injected = Counter()
+
+    def add_fault(self, operation='*', error='timeout', rate=1.0, count=None):
+        if error not in FAULT_ERRORS:
+            raise Exception(f'Unsupported fault {error}; use one of {list(FAULT_ERRORS)}')
+        with self.lock:
+            self.faults.append({'operation': operation, 'error': error, 'rate': rate, 'count': count})
+
+    def clear(self):
+        with self.lock:
+            self.faults = []
+
+    def draw(self, operation=""):
+        """ Name of the error to raise for this call of operation, or None """
+        with self.lock:
+            for fault in self.faults:
+                if fault.get('operation', '*') not in ('*', operation):
+                    continue
+                if fault.get('count') is not None and fault.get('injected', 0) >= fault['count']:
+                    continue
+                if self.rng.random() < fault.get('rate', 1.0):
+                    fault['injected'] = fault.get('injected', 0) + 1
+                    self.injected[(operation, fault['error'])] += 1
+                    return fault['error']
+        return None
+
+    @staticmethod
+    def get_exception(error="", operation="", key=None):
+        return FAULT_ERRORS[error]({'message': f'Injected {error} on {operation}', 'key': key})
+
+
+class FakeResponse:
+    """ The part of requests.Response that AdminClient reads """
+    def __init__(self, status_code=200, body=None):
+        self.status_code = status_code
+        self.body = body if body is not None else {}
+        self.text = body if isinstance(body, str) else json.dumps(self.body)
+
+    def json(self):
+        if isinstance(self.body, str):
+            raise ValueError('Response is not JSON')
+        return self.body
+
+
+class FakeContent:
+    """ result.content_as[type] """
+    def __init__(self, value=None):
+        self.value = value
+
+    def __getitem__(self, value_type):
+        if isinstance(self.value, (bytes, bytearray, memoryview)):
+            raw = bytes(self.value)
+            return raw if value_type is bytes else raw.decode() if value_type is str else json.loads(raw)
+        if value_type is bytes:
+            return json.dumps(self.value).encode()
+        return self.value
+
+
+class FakeResult:
+    """ Result of a KV operation; reads carry the document """
+    def __init__(self, key="", value=None, cas=0, success=True):
+        self.key = key
+        self.value = value
+        self.cas = cas
+        self.success = success
+
+    @property
+    def content(self):
+        return self.value
+
+    @property
+    def content_as(self):
+        return FakeContent(self.value)
+
+
+class FakeRowsResult:
+    """ Result of a N1QL query or full text search """
+    def __init__(self, rows=None):
+        self._rows = rows or []
+
+    def rows(self):
+        return iter(self._rows)
+
+    def __iter__(self):
+        return self.rows()
+
+    def metadata(self):
+        return {'metrics': {'resultCount': len(self._rows)}}
+
+
+class FakeCollection:
+    def __init__(self, backend=None, bucket_name="", scope_name="_default", name="_default"):
+        self.backend = backend
+        self.bucket_name = bucket_name
+        self.scope_name = scope_name
+        self.name = name
+
+    def get_store(self):
+        return self.backend.get_collection_store(self.bucket_name, self.scope_name, self.name)
+
+    def get(self, key="", *options, **kwargs):
+        self.backend.simulate('get', options, key=key)
+        with self.backend.lock:
+            document = self.get_store().get(key)
+        if document is None:
+            raise DocumentNotFoundException({'message': f'Document {key} not found', 'key': key})
+        return FakeResult(key, *document)
+
+    def mutate(self, operation="", key="", value=None, options=()):
+        self.backend.simulate(operation, options, size=get_value_size(value) if value is not None else 0, key=key)
+        with self.backend.lock:
+            store = self.get_store()
+            if operation == 'insert' and key in store:
+                raise DocumentExistsException({'message': f'Document {key} already exists', 'key': key})
+            if operation in ('replace', 'remove') and key not in store:
+                raise DocumentNotFoundException({'message': f'Document {key} not found', 'key': key})
+            cas = self.backend.next_cas()
+            if operation == 'remove':
+                del store[key]
+            else:
+                # materialize views so later changes to the caller's buffer do not change the stored document
+                store[key] = (bytes(value) if isinstance(value, memoryview) else value, cas)
+        return FakeResult(key, cas=cas)
+
+    def insert(self, key="", value=None, *options, **kwargs):
+        return self.mutate('insert', key, value, options)
+
+    def upsert(self, key="", value=None, *options, **kwargs):
+        return self.mutate('upsert', key, value, options)
+
+    def replace(self, key="", value=None, *options, **kwargs):
+        return self.mutate('replace', key, value, options)
+
+    def remove(self, key="", *options, **kwargs):
+        return self.mutate('remove', key, None, options)
+
+    def upsert_multi(self, docs=None, *options, **kwargs):
+        """ Upsert all docs ({key: value}) as one pipelined batch: one latency draw for the batch's total size;
+        an injected fault fails the whole batch """
+        docs = docs or {}
+        try:
+            self.backend.simulate('upsert', options, size=sum(get_value_size(v) for v in docs.values()))
+        except CouchbaseException as e:
+            e.all_results = {key: FakeResult(key, success=False) for key in docs}
+            raise
+        with self.backend.lock:
+            store = self.get_store()
+            results = {}
+            for key, value in docs.items():
+                store[key] = (value, self.backend.next_cas())
+                results[key] = FakeResult(key, cas=store[key][1])
+        return results
+
+
+class FakeScope:
+    def __init__(self, backend=None, bucket_name="", name="_default"):
+        self.backend = backend
+        self.bucket_name = bucket_name
+        self.name = name
+
+    def collection(self, name="_default"):
+        return FakeCollection(self.backend, self.bucket_name, self.name, name)
+
+
+class FakeBucket:
+    def __init__(self, backend=None, name=""):
+        self.backend = backend
+        self.name = name
+
+    def scope(self, name="_default"):
+        return FakeScope(self.backend, self.name, name)
+
+    def default_collection(self):
+        return self.scope().collection()
+
+
+class FakeUserManager:
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    def upsert_user(self, user=None, *options, **kwargs):
+        with self.backend.lock:
+            self.backend.users[getattr(user, 'username', None)] = user
+
+    def get_all_users(self, *options, **kwargs):
+        with self.backend.lock:
+            return list(self.backend.users.values())
+
+
+class FakeCluster:
+    """ SDK Cluster connected to a FakeBackend """
+    # N1QL statements the harness issues
+    CREATE_PRIMARY_INDEX = re.compile(r'CREATE PRIMARY INDEX (?:`?[\w-]+`? )?ON `?(?:default`?:`?)?([\w-]+)`?', re.I)
+    INDEX_STATES = re.compile(r'SELECT RAW state FROM system:indexes WHERE keyspace_id = "([\w-]+)"', re.I)
+    SELECT_WHERE = re.compile(r'SELECT \* FROM `?([\w-]+)`? WHERE (\w+) = "([^"]*)"', re.I)
+
+    def __init__(self, backend=None, endpoint=""):
+        self.backend = backend
+        self.endpoint = endpoint
+
+    def bucket(self, name=""):
+        return FakeBucket(self.backend, name)
+
+    def users(self):
+        return FakeUserManager(self.backend)
+
+    def query(self, statement="", *options, **kwargs):
+        self.backend.simulate('query', options)
+        match = self.CREATE_PRIMARY_INDEX.match(statement)
+        if match:
+            return FakeRowsResult(self.backend.create_primary_index(match.group(1)))
+        match = self.INDEX_STATES.match(statement)
+        if match:
+            with self.backend.lock:
+                state = self.backend.indexes.get(match.group(1))
+            return FakeRowsResult([state] if state else [])
+        match = self.SELECT_WHERE.match(statement)
+        if match:
+            bucket_name, field, value = match.groups()
+            with self.backend.lock:
+                if bucket_name not in self.backend.indexes:
+                    raise QueryIndexNotFoundException({'message': f'No index available on keyspace {bucket_name}'})
+                # a bare bucket keyspace is its default collection
+                store = self.backend.get_collection_store(bucket_name, '_default', '_default')
+                docs = [get_json_document(stored) for stored, _ in store.values()]
+                return FakeRowsResult([{bucket_name: doc} for doc in docs if doc and doc.get(field) == value])
+        raise CouchbaseException({'message': f'Statement not supported by the fake backend: {statement}'})
+
+    def search_query(self, index="", query=None, *options, **kwargs):
+        """ Match the query string's terms against every string field of the documents of the bucket the
+        index is named after (default_primary_index_<bucket>) """
+        self.backend.simulate('search', options)
+        terms = str(getattr(query, 'query', query)).lower().split()
+        with self.backend.lock:
+            bucket_name = next((b for b in self.backend.buckets
+                                if index == f'default_primary_index_{b.replace("-", "_")}'), None)
+            if bucket_name is None:
+                raise SearchException({'message': f'Search index {index} not found'})
+            rows = []
+            for scope in self.backend.buckets[bucket_name]['scopes'].values():
+                for store in scope.values():
+                    for key, (stored, _) in store.items():
+                        doc = get_json_document(stored) or {}
+                        text = ' '.join(v for v in doc.values() if isinstance(v, str)).lower()
+                        if terms and all(t in text.split() for t in terms):
+                            rows.append({'id': key, 'score': 1.0, 'index': index})
+        return FakeRowsResult(rows)
+
+    def ping(self, *options, **kwargs):
+        with self.backend.lock:
+            nodes = [a for a, n in self.backend.nodes.items() if n['membership'] == 'active']
+        return SimpleNamespace(endpoints={'kv': [SimpleNamespace(latency=timedelta(0), state='ok', remote=a)
+                                                 for a in nodes]})
+
+    def diagnostics(self, *options, **kwargs):
+        return SimpleNamespace(state='online')
+
+    def wait_until_ready(self, timeout=None, *options, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeBackend:
+    def __init__(self, latency_model=None, fault_injector=None, verbose=False):
+        self.latency_model = latency_model or LatencyModel()
+        self.fault_injector = fault_injector or FaultInjector()
+        self.lock = threading.RLock()
+        # node address -> {'services': [REST service names], 'membership': 'active' / 'inactiveAdded' /
+        # 'inactiveFailed', 'recovery': recovery type set for a failed over node}
+        self.nodes = {}
+        # bucket name -> {'settings': {...}, 'scopes': {scope: {collection: {key: (value, cas)}}}}
+        self.buckets = {}
+        # bucket name -> primary index state
+        self.indexes = {}
+        self.users = {}
+        self.cas = itertools.count(1)
+        # SDK calls per operation type, for profiling the harness
+        self.operation_counts = Counter()
+        self.setup_logging(verbose)
+
+    @classmethod
+    def from_config_file(cls, config_file="", verbose=False):
+        """ Build a backend from a JSON file, e.g.
+        {"scale": 1.0, "seed": 0, "latencies": {"get": {"median_ms": 0.4, "sigma": 0.3}, "insert:high": {"median_ms": 8}},
+         "durability_factors": {"low": 1.6}, "faults": [{"operation": "get", "error": "timeout", "rate": 0.001}]} """
+        with open(config_file) as f:
+            config = json.load(f)
+        return cls(
+            latency_model=LatencyModel(latencies=config.get('latencies'),
+                durability_factors=config.get('durability_factors'), scale=config.get('scale', 1.0),
+                seed=config.get('seed', 0)),
+            fault_injector=FaultInjector(faults=config.get('faults'), seed=config.get('seed', 0)),
+            verbose=verbose)
+
+    def setup_logging(self, verbose=False):
+        """ set up self.logger for FakeBackend logging """
+        self.logger = logging.getLogger('FakeBackend')
+        formatter = logging.Formatter('%(prefix)s - %(message)s')
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+        self.prefix = {'prefix': 'Fake Backend'}
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+        self.logger = logging.LoggerAdapter(self.logger, self.prefix)
+        self.logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
+
+    def connect(self, endpoint=""):
+        """ SDK cluster connection (ConnectionRegistry calls this instead of couchbase.cluster.Cluster) """
+        self.debug(f'Connecting to {endpoint}')
+        return FakeCluster(self, endpoint)
+
+    def new_cluster(self):
+        """ An empty backend with the same latency model and faults, standing in for another independent
+        cluster (one per host partition, see HostPool) """
+        return FakeBackend(latency_model=self.latency_model, fault_injector=self.fault_injector,
+            verbose=self.logger.isEnabledFor(logging.DEBUG))
+
+    def get_admin_client(self, address="", username="", password="", verbose=False):
+        return FakeAdminClient(self, address=address, username=username, password=password, verbose=verbose)
+
+    def next_cas(self):
+        return next(self.cas)
+
+    def simulate(self, operation="", options=(), size=0, key=None):
+        """ Sleep for the modelled latency of operation and raise an injected fault, if one is drawn; an
+        operation slower than its timeout option fails with a timeout after the timeout """
+        with self.lock:
+            self.operation_counts[operation] += 1
+        latency = self.latency_model.sample(operation, get_durability_level(get_option(options, 'durability')), size)
+        error = self.fault_injector.draw(operation)
+        timeout = get_option(options, 'timeout')
+        if timeout is not None and latency > timeout.total_seconds():
+            latency, error = timeout.total_seconds(), 'timeout'
+        if latency > 0:
+            time.sleep(latency)
+        if error:
+            raise self.fault_injector.get_exception(error, operation, key)
+
+    def get_collection_store(self, bucket_name="", scope_name="_default", collection_name="_default"):
+        """ {key: (value, cas)} of a collection; call with self.lock held """
+        bucket = self.buckets.get(bucket_name)
+        if bucket is None:
+            raise BucketNotFoundException({'message': f'Bucket {bucket_name} not found'})
+        scope = bucket['scopes'].get(scope_name)
+        if scope is None:
+            raise ScopeNotFoundException({'message': f'Scope {bucket_name}.{scope_name} not found'})
+        store = scope.get(collection_name)
+        if store is None:
+            raise CollectionNotFoundException(
+                {'message': f'Collection {bucket_name}.{scope_name}.{collection_name} not found'})
+        return store
+
+    def create_primary_index(self, bucket_name=""):
+        with self.lock:
+            if bucket_name not in self.buckets:
+                raise BucketNotFoundException({'message': f'Keyspace not found: {bucket_name}'})
+            if bucket_name in self.indexes:
+                raise CouchbaseException({'message': f'Primary index on {bucket_name} already exists'})
+            self.indexes[bucket_name] = 'online'
+        return []
+
+    # Management REST API
+
+    def handle_request(self, method="GET", path="", address="", data=None):
+        """ Answer a management request sent to the node at address; return (status code, body) """
+        for route_method, pattern, handler in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                with self.lock:
+                    return getattr(self, handler)(address, data or {}, *match.groups())
+        return 404, f'Not found: {method} {path}'
+
+    @staticmethod
+    def get_node_name(hostname=""):
+        """ Node address of a hostname given as host, host:port or http://host:port """
+        return re.sub(r'^\w+://', '', hostname).rsplit(':', 1)[0]
+
+    def get_node_entry(self, address=""):
+        node = self.nodes[address]
+        return {
+            'hostname': f'{address}:8091',
+            'otpNode': f'ns_1@{address}',
+            'services': list(node['services']),
+            'status': 'healthy',
+            'clusterMembership': node['membership'],
+        }
+
+    def get_node_address(self, otp_node=""):
+        return otp_node.split('@', 1)[-1]
+
+    def init_cluster(self, address, data):
+        if self.nodes:
+            return 400, {'errors': {'_': 'Cluster is already initialized'}}
+        name = data.get('hostname') or address
+        self.nodes[name] = {'services': data.get('services', 'kv').split(','), 'membership': 'active',
+                            'recovery': None}
+        return 200, {}
+
+    def get_pool(self, address, data):
+        if not self.nodes:
+            return 404, '"unknown pool"'
+        return 200, {'nodes': [self.get_node_entry(a) for a in self.nodes]}
+
+    def add_node(self, address, data):
+        name = self.get_node_name(data.get('hostname', ''))
+        if name in self.nodes:
+            return 400, ['Prepare join failed. Node is already part of cluster.']
+        self.nodes[name] = {'services': data.get('services', 'kv').split(','), 'membership': 'inactiveAdded',
+                            'recovery': None}
+        return 200, {'otpNode': f'ns_1@{name}'}
+
+    def rebalance(self, address, data):
+        """ Eject the ejected nodes and failed over nodes without a recovery type, activate the rest """
+        ejected = {self.get_node_address(n) for n in data.get('ejectedNodes', '').split(',') if n}
+        for name in list(self.nodes):
+            node = self.nodes[name]
+            if name in ejected or (node['membership'] == 'inactiveFailed' and not node['recovery']):
+                del self.nodes[name]
+            else:
+                node.update(membership='active', recovery=None)
+        return 200, {}
+
+    def get_tasks(self, address, data):
+        # rebalances complete immediately
+        return 200, [{'type': 'rebalance', 'status': 'notRunning', 'progress': 100}]
+
+    def failover(self, address, data):
+        name = self.get_node_address(data.get('otpNode', ''))
+        if name not in self.nodes:
+            return 400, f'Unknown server given: {name}'
+        self.nodes[name]['membership'] = 'inactiveFailed'
+        return 200, {}
+
+    def set_recovery_type(self, address, data):
+        name = self.get_node_address(data.get('otpNode', ''))
+        if self.nodes.get(name, {}).get('membership') != 'inactiveFailed':
+            return 400, {'errors': {'otpNode': 'invalid node name or node is not failed over'}}
+        self.nodes[name]['recovery'] = data.get('recoveryType')
+        return 200, {}
+
+    def rename_node(self, address, data):
+        if len(self.nodes) > 1:
+            return 400, 'Renaming is disallowed for nodes that are already part of a cluster'
+        if address in self.nodes:
+            self.nodes[data['hostname']] = self.nodes.pop(address)
+        return 200, {}
+
+    def set_alternate_address(self, address, data):
+        return 200, {}
+
+    def get_bucket_entry(self, name=""):
+        bucket = self.buckets[name]
+        return {
+            'name': name,
+            'replicaNumber': bucket['settings'].get('replicaNumber', 0),
+            'quota': {'rawRAM': int(bucket['settings'].get('ramQuotaMB', 0)) * 1024 ** 2},
+            'basicStats': {'itemCount': sum(len(c) for s in bucket['scopes'].values() for c in s.values())},
+            'nodes': [{'hostname': f'{a}:8091', 'status': 'healthy'}
+                      for a, n in self.nodes.items() if n['membership'] == 'active'],
+        }
+
+    def get_buckets(self, address, data):
+        return 200, [self.get_bucket_entry(name) for name in self.buckets]
+
+    def create_bucket(self, address, data):
+        name = data.get('name')
+        if name in self.buckets:
+            return 400, {'errors': {'name': 'Bucket with given name already exists'}}
+        self.buckets[name] = {'settings': dict(data), 'scopes': {'_default': {'_default': {}}}}
+        return 202, {}
+
+    def get_bucket(self, address, data, name):
+        if name not in self.buckets:
+            return 404, 'Requested resource not found.'
+        return 200, self.get_bucket_entry(name)
+
+    def edit_bucket(self, address, data, name):
+        if name not in self.buckets:
+            return 404, 'Requested resource not found.'
+        self.buckets[name]['settings'].update(data)
+        return 200, {}
+
+    def delete_bucket(self, address, data, name):
+        if name not in self.buckets:
+            return 404, 'Requested resource not found.'
+        del self.buckets[name]
+        self.indexes.pop(name, None)
+        return 200, {}
+
+    def flush_bucket(self, address, data, name):
+        if name not in self.buckets:
+            return 404, 'Requested resource not found.'
+        for scope in self.buckets[name]['scopes'].values():
+            for store in scope.values():
+                store.clear()
+        return 200, {}
+
+    def get_scopes(self, address, data, name):
+        if name not in self.buckets:
+            return 404, 'Requested resource not found.'
+        return 200, {'scopes': [{'name': s, 'collections': [{'name': c} for c in collections]}
+                                for s, collections in self.buckets[name]['scopes'].items()]}
+
+    def create_scope(self, address, data, name):
+        if name not in self.buckets:
+            return 404, 'Requested resource not found.'
+        scopes = self.buckets[name]['scopes']
+        if data.get('name') in scopes:
+            return 400, {'errors': {'name': 'Scope with this name already exists'}}
+        scopes[data.get('name')] = {}
+        return 200, {}
+
+    def create_collection(self, address, data, name, scope_name):
+        scopes = self.buckets.get(name, {}).get('scopes', {})
+        if scope_name not in scopes:
+            return 404, {'errors': {'scope': 'Scope with this name is not found'}}
+        if data.get('name') in scopes[scope_name]:
+            return 400, {'errors': {'name': 'Collection with this name already exists'}}
+        scopes[scope_name][data.get('name')] = {}
+        return 200, {}
+
+    def upsert_user(self, address, data, username):
+        self.users[username] = SimpleNamespace(username=username, roles=data.get('roles', '').split(','))
+        return 200, ''
+
+    ROUTES = [
+        ('POST', r'/clusterInit', 'init_cluster'),
+        ('GET', r'/pools/default', 'get_pool'),
+        ('POST', r'/controller/addNode', 'add_node'),
+        ('POST', r'/controller/rebalance', 'rebalance'),
+        ('GET', r'/pools/default/tasks', 'get_tasks'),
+        ('POST', r'/controller/(?:startGracefulFailover|failOver)', 'failover'),
+        ('POST', r'/controller/setRecoveryType', 'set_recovery_type'),
+        ('POST', r'/node/controller/rename', 'rename_node'),
+        ('PUT', r'/node/controller/setupAlternateAddresses/external', 'set_alternate_address'),
+        ('GET', r'/pools/default/buckets', 'get_buckets'),
+        ('POST', r'/pools/default/buckets', 'create_bucket'),
+        ('GET', r'/pools/default/buckets/([^/]+)', 'get_bucket'),
+        ('POST', r'/pools/default/buckets/([^/]+)', 'edit_bucket'),
+        ('DELETE', r'/pools/default/buckets/([^/]+)', 'delete_bucket'),
+        ('POST', r'/pools/default/buckets/([^/]+)/controller/doFlush', 'flush_bucket'),
+        ('GET', r'/pools/default/buckets/([^/]+)/scopes', 'get_scopes'),
+        ('POST', r'/pools/default/buckets/([^/]+)/scopes', 'create_scope'),
+        ('POST', r'/pools/default/buckets/([^/]+)/scopes/([^/]+)/collections', 'create_collection'),
+        ('PUT', r'/settings/rbac/users/local/([^/]+)', 'upsert_user'),
+    ]
+
+
+class FakeAdminClient(AdminClient):
+    """ AdminClient whose management requests are answered by a FakeBackend instead of sent over HTTP """
+    def __init__(self, backend=None, address="", username="", password="", verbose=False, port=8091):
+        super().__init__(address=address, username=username, password=password, verbose=verbose, port=port)
+        self.backend = backend
+
+    def request(self, method="GET", path="", node_address=None, expected_statuses=(200,), **kwargs):
+        self.debug(f'{method} {path} {kwargs.get("data", "")}')
+        status_code, body = self.backend.handle_request(method, path, node_address or self.address,
+            kwargs.get('data'))
+        response = FakeResponse(status_code, body)
+        if status_code not in expected_statuses:
+            raise AdminClientError(f'{method} {path} failed', status_code=status_code,
+                errors=self.parse_errors(response))
+        return response
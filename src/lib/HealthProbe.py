@@ -0,0 +1,178 @@
+""" Pre-run health probe: before a sweep cell, check that every host in hosts.json is reachable and every
+service of the cluster is healthy, and measure client-to-node round-trip time. TCP connect time to each
+service port gives the network RTT distribution per node and service; SDK ping/diagnostics and the node
+status reported by the REST API show whether the services themselves answer. RTT distributions are
+recorded with the results ('health_probe' metric) so the Analyzer can subtract the network baseline. """
+
+import logging
+import socket
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from .AdminClient import AdminClientError
+from .MetricsRecorder import MetricsRecorder
+
+# Client-facing port of each service (plaintext)
+SERVICE_PORTS = {
+    'management': 8091,
+    'data': 11210,
+    'query': 8093,
+    'index': 9102,
+    'fts': 8094,
+}
+# What to do when a node is degraded
+PROBE_OFF = 'off'
+PROBE_WARN = 'warn'
+PROBE_ABORT = 'abort'
+PROBE_MODES = [PROBE_OFF, PROBE_WARN, PROBE_ABORT]
+
+
+class HealthProbeError(Exception):
+    pass
+
+
+class HealthProbe:
+    def __init__(self, cluster_manager=None, attempts=10, timeout=2, max_rtt_ms=50, outlier_factor=3,
+            mode=PROBE_WARN, verbose=False, metrics=None):
+        self.cluster_manager = cluster_manager
+        # TCP connects per node and port
+        self.attempts = attempts
+        self.timeout = timeout
+        # a node is degraded if its median RTT exceeds max_rtt_ms, or outlier_factor times the median of all nodes
+        self.max_rtt_ms = max_rtt_ms
+        self.outlier_factor = outlier_factor
+        self.mode = mode
+        self.metrics = metrics or MetricsRecorder()
+        self.setup_logging(verbose)
+
+    def setup_logging(self, verbose=False):
+        """ set up self.logger for HealthProbe logging """
+        self.logger = logging.getLogger('HealthProbe')
+        formatter = logging.Formatter('%(prefix)s - %(message)s')
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+        self.prefix = {'prefix': 'Health Probe'}
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+        self.logger = logging.LoggerAdapter(self.logger, self.prefix)
+        self.logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
+
+    def set_mode(self, new_mode=PROBE_WARN):
+        self.info(f'Updating health probe mode from {self.mode} to {new_mode}')
+        self.mode = new_mode
+
+    def tcp_connect_rtt(self, address="", port=8091):
+        """ Seconds to complete a TCP handshake with address:port, or None if it failed """
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((address, port), timeout=self.timeout):
+                return time.perf_counter() - start
+        except OSError as e:
+            self.debug(f'TCP connect to {address}:{port} failed: {e}')
+            return None
+
+    def probe_port(self, address="", port=8091):
+        """ Connect attempts times; return (rtts of the successful connects, number of failures) """
+        rtts = [self.tcp_connect_rtt(address, port) for _ in range(self.attempts)]
+        return [r for r in rtts if r is not None], sum(1 for r in rtts if r is None)
+
+    @staticmethod
+    def summarize(rtts=None):
+        rtts = rtts or []
+        if not rtts:
+            return {'p50': None, 'p99': None}
+        return {'p50': float(np.percentile(rtts, 50)), 'p99': float(np.percentile(rtts, 99))}
+
+    def probe_sdk(self, cluster=None):
+        """ SDK ping of every service endpoint: {service: [{'latency': s, 'state': str, 'remote': str}]},
+        plus the overall diagnostics state; empty where the SDK version lacks ping/diagnostics """
+        endpoints, state = {}, None
+        try:
+            result = cluster.ping()
+            for service_type, reports in getattr(result, 'endpoints', {}).items():
+                service = str(getattr(service_type, 'value', service_type))
+                for report in reports:
+                    latency = getattr(report, 'latency', None)
+                    if isinstance(latency, timedelta):
+                        latency = latency.total_seconds()
+                    endpoints.setdefault(service, []).append({
+                        'latency': latency,
+                        'state': str(getattr(report, 'state', '')),
+                        'remote': str(getattr(report, 'remote', '')),
+                    })
+            state = str(getattr(cluster.diagnostics(), 'state', ''))
+        except Exception as e:
+            self.error(f'SDK ping failed: {e}')
+        return endpoints, state
+
+    def run(self, **labels):
+        """ Probe every host: TCP connect RTT to its management port and, for cluster members, to each of
+        its service ports; node status from the REST API; SDK ping of the cluster. Record one 'health_probe'
+        sample per host and port (value = median RTT, with the full distribution) labelled with labels.
+        Warn about, or with mode 'abort' raise HealthProbeError for, unreachable or degraded nodes.
+        Return {'nodes': {host: {...}}, 'sdk': {...}, 'degraded': [reasons]} """
+        if self.mode == PROBE_OFF:
+            return None
+        cm = self.cluster_manager
+        try:
+            cluster_nodes = cm.get_admin_client().get_nodes()
+        except AdminClientError as e:
+            self.error(e)
+            cluster_nodes = []
+        report = {'nodes': {}, 'degraded': []}
+        for host in cm.hosts:
+            address = cm.get_public_address(host)
+            node = next((n for n in cluster_nodes if any(cm.get_admin_client().node_matches(n, a)
+                for a in (cm.get_dns_name(host), cm.get_private_address(host), address))), None)
+            services = ['management'] + ([cm.normalize_service(s) for s in node['services']] if node else [])
+            host_report = {'member': node is not None, 'status': node.get('status') if node else None, 'ports': {}}
+            for service in services:
+                if service not in SERVICE_PORTS:
+                    continue
+                rtts, failures = self.probe_port(address, SERVICE_PORTS[service])
+                host_report['ports'][service] = dict(self.summarize(rtts), rtts=rtts, failures=failures)
+                self.metrics.record('health_probe', host_report['ports'][service]['p50'], host=address,
+                    service=service, port=SERVICE_PORTS[service], rtts=rtts, failures=failures, **labels)
+                if failures:
+                    report['degraded'].append(f'{address}:{SERVICE_PORTS[service]} ({service}) failed '
+                                              f'{failures}/{self.attempts} connects')
+            if node and node.get('status') != 'healthy':
+                report['degraded'].append(f'{address} reports status {node.get("status")}')
+            report['nodes'][address] = host_report
+        report['degraded'].extend(self.find_slow_nodes(report['nodes']))
+        endpoints, state = self.probe_sdk(cm.connections.get_cluster(cm.get_cluster_url()))
+        report['sdk'] = {'endpoints': endpoints, 'state': state}
+        self.metrics.record('sdk_ping', state, endpoints=endpoints, **labels)
+        self.check(report)
+        return report
+
+    def find_slow_nodes(self, nodes=None):
+        """ Nodes whose median management-port RTT is above max_rtt_ms or far above the other nodes' """
+        medians = {address: n['ports']['management']['p50'] for address, n in (nodes or {}).items()
+                   if n['ports'].get('management', {}).get('p50') is not None}
+        if not medians:
+            return []
+        overall = float(np.median(list(medians.values())))
+        return [f'{address} RTT {p50 * 1000:.2f}ms (median of nodes {overall * 1000:.2f}ms)'
+                for address, p50 in medians.items()
+                if p50 * 1000 > self.max_rtt_ms or (len(medians) > 2 and p50 > self.outlier_factor * overall)]
+
+    def check(self, report=None):
+        if not report['degraded']:
+            self.info(f'All {len(report["nodes"])} hosts reachable and healthy')
+            return
+        for reason in report['degraded']:
+            self.error(f'Degraded: {reason}')
+        if self.mode == PROBE_ABORT:
+            raise HealthProbeError(f'{len(report["degraded"])} health problem(s): {"; ".join(report["degraded"])}')
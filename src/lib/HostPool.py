@@ -0,0 +1,62 @@
+""" Partitioned host pool: a sweep over small clusters leaves most hosts of a large pool idle, so the pool is
+split into several independent clusters (one leader each) that run separate experiment cells at the same time.
+plan_partitions picks the partition size from the cluster sizes the cells need, and a CellQueue hands the cells
+to the partitions, keeping each partition on one cluster size for as long as possible. """
+
+import math
+import threading
+
+
+def plan_partitions(num_hosts=0, cell_nodes=None):
+    """ Choose how to split num_hosts into equal partitions for cells needing cell_nodes hosts each.
+    Cells that do not fit in a partition run one at a time on the whole pool, the others are spread over
+    the partitions; the partition size with the fewest cell slots (one cell's wall time each) wins, ties going to
+    fewer, larger partitions. Return (partition size, number of partitions, cell slots) """
+    best = None
+    for size in sorted(set(cell_nodes or []), reverse=True):
+        if size > num_hosts:
+            continue
+        count = num_hosts // size
+        fits = sum(1 for nodes in cell_nodes if nodes <= size)
+        slots = (len(cell_nodes) - fits) + math.ceil(fits / count)
+        if best is None or slots < best[2]:
+            best = (size, count, slots)
+    return best or (num_hosts, 1, len(cell_nodes or []))
+
+
+def partition_hosts(hosts=None, partition_size=1, num_partitions=1):
+    """ Consecutive slices of hosts, the first host of each slice being its cluster leader; the first
+    partition keeps the pool's leader. Hosts left over after num_partitions slices stay idle """
+    return [hosts[i * partition_size:(i + 1) * partition_size] for i in range(num_partitions)]
+
+
+class CellQueue:
+    def __init__(self, cells=None, get_nodes=None):
+        """ Thread-safe queue of experiment cells shared by the partition workers. Cells are grouped by
+        get_nodes(cell), the number of hosts they need, and keep their order within a group """
+        self.lock = threading.Lock()
+        self.groups = {}
+        for cell in cells or []:
+            self.groups.setdefault(get_nodes(cell), []).append(cell)
+        self.closed = False
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(cells) for cells in self.groups.values())
+
+    def next_cell(self, nodes=None):
+        """ Next cell for a partition whose cluster currently has nodes hosts: one of the same size if any is
+        left (no resize), otherwise one from the largest group left, so long runs of one cluster size are
+        split across partitions first. None when the queue is empty or closed """
+        with self.lock:
+            groups = {n: cells for n, cells in self.groups.items() if cells}
+            if self.closed or not groups:
+                return None
+            if nodes not in groups:
+                nodes = max(groups, key=lambda n: (len(groups[n]), n))
+            return groups[nodes].pop(0)
+
+    def close(self):
+        """ Hand out no more cells (e.g. after a partition failed) """
+        with self.lock:
+            self.closed = True
@@ -0,0 +1,176 @@
+""" Steady background load (KV reads and updates plus N1QL queries) run against a bucket while the cluster
+changes underneath it, e.g. during failover and recovery. Every operation's latency and outcome is kept
+with its timestamp, events (failover started, recovery finished, ...) are marked on the same clock, and
+the run is written as fixed-width time windows so latency and error rate can be followed over time. """
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from couchbase.exceptions import CouchbaseException
+
+from .Operations import GetFullDocByKeyOperation, N1QLQueryOperation, UpdateOperation
+
+KV_GET = 'kv-get'
+KV_UPDATE = 'kv-update'
+N1QL_SELECT = 'n1qlselect'
+
+
+class LiveLoad:
+    def __init__(self, data_manager=None, bucket_name="", num_docs=1000, kv_workers=4, query_workers=1,
+            update_ratio=0.5, durability_level="low", window_seconds=0.5, verbose=False):
+        self.data_manager = data_manager
+        self.bucket_name = bucket_name
+        self.num_docs = num_docs
+        self.kv_workers = kv_workers
+        self.query_workers = query_workers
+        # fraction of KV operations that are updates (the rest are gets)
+        self.update_ratio = update_ratio
+        self.durability_level = durability_level
+        self.window_seconds = window_seconds
+        self.verbose = verbose
+        self.setup_logging(verbose)
+        # (seconds since start, operation, latency, succeeded) for every operation
+        self.samples = []
+        # (seconds since start, event name)
+        self.events = []
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.clusters = []
+        self.start_time = None
+
+    def setup_logging(self, verbose=False):
+        """ set up self.logger for LiveLoad logging """
+        self.logger = logging.getLogger('LiveLoad')
+        formatter = logging.Formatter('%(prefix)s - %(message)s')
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+        self.prefix = {'prefix': 'Live Load'}
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
+        self.logger = logging.LoggerAdapter(self.logger, self.prefix)
+        self.logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def start(self):
+        """ Start kv_workers KV threads and query_workers N1QL threads; return immediately """
+        self.info(f'Starting background load on {self.bucket_name} '
+                  f'({self.kv_workers} KV workers, {self.query_workers} N1QL workers)')
+        # every worker gets a connection of its own, bootstrapped before the timeline starts
+        self.clusters = self.data_manager.open_worker_clusters(count=self.kv_workers + self.query_workers)
+        self.start_time = time.time()
+        self.stopping.clear()
+        self.threads = [threading.Thread(target=self.run_kv_worker, args=(i, self.clusters[i]), daemon=True)
+                        for i in range(self.kv_workers)]
+        self.threads += [threading.Thread(target=self.run_query_worker, args=(cluster,), daemon=True)
+                         for cluster in self.clusters[self.kv_workers:]]
+        for thread in self.threads:
+            thread.start()
+        self.mark('load_started')
+
+    def stop(self):
+        self.mark('load_stopped')
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.data_manager.close_worker_clusters(self.clusters)
+        self.clusters = []
+        self.info(f'Background load stopped after {len(self.samples)} operations')
+
+    def mark(self, event=""):
+        """ Mark an event (e.g. 'graceful_failover_start') at the current point of the load timeline """
+        with self.lock:
+            self.events.append((self.elapsed(), event))
+        self.info(f'[{self.elapsed():.1f}s] {event}')
+
+    def execute(self, operation_name="", operation=None):
+        """ Time operation; a failed operation is kept as an error with the time it took to fail """
+        start = time.time()
+        try:
+            operation.execute()
+            succeeded = True
+        except CouchbaseException as e:
+            self.debug(f'{operation_name} failed: {e}')
+            succeeded = False
+        with self.lock:
+            self.samples.append((start - self.start_time, operation_name, time.time() - start, succeeded))
+
+    def run_kv_worker(self, worker=0, cluster=None):
+        rng = random.Random(worker)
+        while not self.stopping.is_set():
+            key = rng.randrange(self.num_docs)
+            if rng.random() < self.update_ratio:
+                self.execute(KV_UPDATE, UpdateOperation(
+                    verbose=self.verbose,
+                    cluster=cluster,
+                    bucket_name=self.bucket_name,
+                    doc_key=key,
+                    doc_replace_value=self.data_manager.get_document(key, num_docs=self.num_docs),
+                    durability_level=self.durability_level,
+                    payload_mode=self.data_manager.payload_mode))
+            else:
+                self.execute(KV_GET, GetFullDocByKeyOperation(
+                    verbose=self.verbose,
+                    cluster=cluster,
+                    bucket_name=self.bucket_name,
+                    doc_key=key))
+
+    def run_query_worker(self, cluster=None):
+        while not self.stopping.is_set():
+            vandy_phrase, _ = self.data_manager.get_query_phrase(bucket_name=self.bucket_name)
+            self.execute(N1QL_SELECT, N1QLQueryOperation(
+                verbose=self.verbose,
+                cluster=cluster,
+                bucket_name=self.bucket_name,
+                vandy_phrase=vandy_phrase))
+
+    def get_windows(self):
+        """ Aggregate the samples into window_seconds wide windows; per window and operation (plus 'all')
+        return count, errors, error rate and p50/p99/max latency (seconds) of the operations started in it """
+        grouped = {}
+        for started, operation_name, latency, succeeded in self.samples:
+            window = int(started // self.window_seconds)
+            for name in (operation_name, 'all'):
+                grouped.setdefault((window, name), []).append((latency, succeeded))
+        windows = []
+        for (window, name), outcomes in sorted(grouped.items()):
+            latencies = [latency for latency, _ in outcomes]
+            errors = sum(1 for _, succeeded in outcomes if not succeeded)
+            windows.append({
+                'start': window * self.window_seconds,
+                'seconds': self.window_seconds,
+                'operation': name,
+                'count': len(outcomes),
+                'errors': errors,
+                'error_rate': errors / len(outcomes),
+                'p50': float(np.percentile(latencies, 50)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': max(latencies),
+            })
+        return windows
+
+    def write(self, data_folder=""):
+        """ Write windows.jsonl and events.jsonl to data_folder """
+        Path(data_folder).mkdir(parents=True, exist_ok=True)
+        with open(os.path.join(data_folder, 'windows.jsonl'), 'w') as f:
+            f.writelines(f'{json.dumps(w)}\n' for w in self.get_windows())
+        with open(os.path.join(data_folder, 'events.jsonl'), 'w') as f:
+            f.writelines(f'{json.dumps({"time": t, "event": event})}\n' for t, event in self.events)
+        self.info(f'Wrote load timeline to {data_folder}')
@@ -0,0 +1,34 @@
+""" Records framework-level metrics that are not per-operation latencies (e.g. how long a bucket took to
+become ready). Each metric is appended as one JSON object per line to data/metrics/<metric>.jsonl, with
+a timestamp and whatever labels the caller provides, so runs accumulate and can be filtered later. """
+
+import json
+import os
+import time
+from pathlib import Path
+
+
+class MetricsRecorder:
+    def __init__(self, metrics_folder=None):
+        self.metrics_folder = metrics_folder or os.path.join(os.path.dirname(__file__), 'data', 'metrics')
+
+    def get_metric_file(self, metric=""):
+        return os.path.join(self.metrics_folder, f'{metric}.jsonl')
+
+    def record(self, metric="", value=None, **labels):
+        """ Append one sample of metric with its labels; return the written record """
+        Path(self.metrics_folder).mkdir(parents=True, exist_ok=True)
+        record = {'timestamp': time.time(), 'value': value}
+        record.update(labels)
+        with open(self.get_metric_file(metric), 'a') as f:
+            f.write(f'{json.dumps(record)}\n')
+        return record
+
+    def read(self, metric="", **labels):
+        """ Return every record of metric whose labels match all given labels """
+        metric_file = self.get_metric_file(metric)
+        if not os.path.exists(metric_file):
+            return []
+        with open(metric_file) as f:
+            records = [json.loads(l) for l in f if l.strip()]
+        return [r for r in records if all(r.get(k) == v for k, v in labels.items())]
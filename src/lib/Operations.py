@@ -1,11 +1,16 @@
 """ Commander pattern responsible for managing the execution of database operations and maintaining records (analysis) of their execution """
 import time
+import os
+import random
+import zlib
+from collections import Counter
 import couchbase
 import logging
 from couchbase.collection import GetOptions, InsertOptions, RemoveOptions, ReplaceOptions
 from couchbase.durability import ServerDurability
 from couchbase.options import QueryBaseOptions
 import couchbase.search as search
+from couchbase.transcoder import RawBinaryTranscoder, RawJSONTranscoder
 from datetime import timedelta
 
 from couchbase_core.durability import Durability
@@ -17,6 +22,43 @@ DURABILITY_MAP = {
     'medium': ServerDurability(Durability.MAJORITY_AND_PERSIST_TO_ACTIVE),
     'high': ServerDurability(Durability.PERSIST_TO_MAJORITY)
 }
+# Payload modes for mutations: 'encode' hands the SDK a dict that it JSON-encodes inside the timed call;
+# 'preencoded' hands it JSON bytes that pass through RawJSONTranscoder untouched
+PAYLOAD_MODE_ENCODE = 'encode'
+PAYLOAD_MODE_PREENCODED = 'preencoded'
+PAYLOAD_MODES = [PAYLOAD_MODE_ENCODE, PAYLOAD_MODE_PREENCODED]
+RAW_JSON_TRANSCODER = RawJSONTranscoder()
+# Binary payloads (opaque blobs) go through RawBinaryTranscoder, optionally zlib-compressed on the client
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_MODES = [COMPRESSION_NONE, COMPRESSION_ZLIB]
+RAW_BINARY_TRANSCODER = RawBinaryTranscoder()
+# Fixed memcached binary protocol header on every KV request/response, counted toward bytes on the wire
+KV_HEADER_BYTES = 24
+# How a phase picks the operations whose latency is recorded: the first sample_size operations, a uniform
+# reservoir sample over the whole phase, or every k-th operation (k spreading the sample over the phase)
+SAMPLING_FIRST = 'first'
+SAMPLING_RESERVOIR = 'reservoir'
+SAMPLING_EVERY_K = 'every_k'
+SAMPLING_MODES = [SAMPLING_FIRST, SAMPLING_RESERVOIR, SAMPLING_EVERY_K]
+
+def prepare_payload(doc=None, payload_mode=PAYLOAD_MODE_ENCODE):
+    """ Return (value, transcoder) to hand the SDK for doc. Pre-encoded payloads (bytes or a zero-copy
+    view over a packed corpus) are materialized here, before the operation is timed """
+    if payload_mode == PAYLOAD_MODE_PREENCODED:
+        return bytes(doc), RAW_JSON_TRANSCODER
+    return doc, None
+
+def compress_payload(payload=b"", compression=COMPRESSION_NONE):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(payload)
+    return payload
+
+def decompress_payload(payload=b"", compression=COMPRESSION_NONE):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(payload)
+    return payload
+
 class Operation:
     """ Operation superclass to be overridden with concrete operation types """
     def __init__(self, verbose=False, data_file_name="", cluster=None,bucket_name="",operation_type=""):
@@ -57,19 +99,23 @@ class Operation:
 
 class N1QLQueryOperation(Operation):
     """ Operation representing a N1QL query execution (read) against database """
-    def __init__(self, verbose=False,  data_file_name="", cluster=None,bucket_name="",vandy_phrase="vanderbilt"):
+    def __init__(self, verbose=False,  data_file_name="", cluster=None,bucket_name="",vandy_phrase="vanderbilt",
+            expected_matches=None):
         super().__init__(
             verbose=verbose,
             data_file_name=data_file_name,
             cluster=cluster,
             bucket_name=bucket_name,
             operation_type='N1QLQuery')
+        # How many documents the query should match (from the phrase vocabulary)
+        self.expected_matches = expected_matches
         self.query = f'SELECT * FROM {self.bucket_name} WHERE vandy_phrase = "{vandy_phrase}"'
         self.opts = QueryBaseOptions(timeout=timedelta(seconds=10))
     def execute(self):
-        result = self.cluster.query(self.query, self.opts)
-        # self.info(result)
-        return result
+        # SDK 3 streams query results: read every row so fetching them is part of the timed call
+        rows = list(self.cluster.query(self.query, self.opts).rows())
+        # self.info(rows)
+        return rows
 
 class GetFullDocByKeyOperation(Operation):
     """ Operation representing an operation to get a full JSON document by its key from database """
@@ -84,36 +130,39 @@ class GetFullDocByKeyOperation(Operation):
         self.bucket = bucket_name
         self.opts = GetOptions(timeout=timedelta(seconds=10))
     def execute(self):
-        response = self.cluster.bucket(self.bucket_name).collection(
-            DEFAULT_COLLECTION).get(self.key, self.opts)
+        response = self.cluster.bucket(self.bucket_name).scope(
+            DEFAULT_SCOPE).collection(DEFAULT_COLLECTION).get(self.key, self.opts)
         # self.info(response)
         return response
 
 class FullTextSearchOperation(Operation):
     """ Operation representing a full text search (read) against database """
-    def __init__(self, verbose=False, data_file_name="", cluster=None, bucket_name="", vandy_phrase="vanderbilt"):
+    def __init__(self, verbose=False, data_file_name="", cluster=None, bucket_name="", vandy_phrase="vanderbilt",
+            expected_matches=None):
         super().__init__(
             verbose=verbose,
             data_file_name=data_file_name,
             cluster=cluster,
             bucket_name=bucket_name,
             operation_type='FTS')
+        # How many documents the search should match (from the phrase vocabulary); exact for single-token phrases
+        self.expected_matches = expected_matches
         self.query = search.QueryStringQuery(vandy_phrase)
         self.opts = search.SearchOptions(timeout=timedelta(seconds=10))
         self.index = f'default_primary_index_{bucket_name.replace("-","_")}'
 
     def execute(self):
-        result = self.cluster.search_query(
+        rows = list(self.cluster.search_query(
             self.index,
             self.query,
-            self.opts)
-        # self.info(result)
-        return result
+            self.opts).rows())
+        # self.info(rows)
+        return rows
 
 class InsertOperation(Operation):
     """ Operation representing a document insertion into database """
     def __init__(self, verbose=False, data_file_name="", cluster=None, bucket_name="", insert_doc=None, doc_key=0,
-            durability_level="low"):
+            durability_level="low", payload_mode=PAYLOAD_MODE_ENCODE):
         super().__init__(
             verbose=verbose,
             data_file_name=data_file_name,
@@ -122,9 +171,12 @@ class InsertOperation(Operation):
             operation_type='INSERT'
             )
 
-        self.val = insert_doc
+        self.val, transcoder = prepare_payload(insert_doc, payload_mode)
         self.key = str(doc_key)
         self.opts = InsertOptions(timeout=timedelta(seconds=10), durability=DURABILITY_MAP[durability_level])
+        if transcoder:
+            self.opts = InsertOptions(timeout=timedelta(seconds=10), durability=DURABILITY_MAP[durability_level],
+                transcoder=transcoder)
         # Wait for majority replication before committing - longer time
 
     def execute(self):
@@ -147,7 +199,7 @@ class InsertOperation(Operation):
 class UpdateOperation(Operation):
     """ Operation representing a document update (REPLACE) in database """
     def __init__(self, verbose=False, data_file_name="", cluster=None, bucket_name="",
-        doc_key=0, doc_replace_value=None, durability_level="low"):
+        doc_key=0, doc_replace_value=None, durability_level="low", payload_mode=PAYLOAD_MODE_ENCODE):
         super().__init__(
             verbose=verbose,
             data_file_name=data_file_name,
@@ -155,8 +207,11 @@ class UpdateOperation(Operation):
             bucket_name=bucket_name,
             operation_type='UPDATE')
         self.key = str(doc_key)
-        self.val = doc_replace_value
+        self.val, transcoder = prepare_payload(doc_replace_value, payload_mode)
         self.opts = ReplaceOptions(timeout=timedelta(seconds=10), durability=DURABILITY_MAP[durability_level])
+        if transcoder:
+            self.opts = ReplaceOptions(timeout=timedelta(seconds=10), durability=DURABILITY_MAP[durability_level],
+                transcoder=transcoder)
 
     def execute(self):
         response = self.cluster.bucket(self.bucket_name).scope(
@@ -190,36 +245,211 @@ class DeleteOperation(Operation):
         # self.info(response)
         return response
 
+class BinaryOperation(Operation):
+    """ Operation carrying a raw binary value; records the uncompressed payload size and the bytes
+    sent or received on the wire (value after compression + key + KV header) once executed.
+    Compression and decompression happen inside execute, so they count toward latency """
+    def __init__(self, verbose=False, data_file_name="", cluster=None, bucket_name="", doc_key=0,
+            compression=COMPRESSION_NONE, operation_type=""):
+        super().__init__(
+            verbose=verbose,
+            data_file_name=data_file_name,
+            cluster=cluster,
+            bucket_name=bucket_name,
+            operation_type=operation_type)
+        self.key = str(doc_key)
+        self.compression = compression
+        self.payload_size = None
+        self.wire_bytes = None
+
+    def get_collection(self):
+        return self.cluster.bucket(self.bucket_name).scope(DEFAULT_SCOPE).collection(DEFAULT_COLLECTION)
+
+    def record_payload(self, payload_size=0, value_size=0):
+        self.payload_size = payload_size
+        self.wire_bytes = value_size + len(self.key) + KV_HEADER_BYTES
+
+class BinaryInsertOperation(BinaryOperation):
+    """ Operation representing the insertion of a raw binary value into database """
+    def __init__(self, verbose=False, data_file_name="", cluster=None, bucket_name="", payload=b"", doc_key=0,
+            durability_level="low", compression=COMPRESSION_NONE):
+        super().__init__(verbose=verbose, data_file_name=data_file_name, cluster=cluster, bucket_name=bucket_name,
+            doc_key=doc_key, compression=compression, operation_type='BINARY_INSERT')
+        self.payload = payload
+        self.opts = InsertOptions(timeout=timedelta(seconds=10), durability=DURABILITY_MAP[durability_level],
+            transcoder=RAW_BINARY_TRANSCODER)
+
+    def execute(self):
+        # an existing key raises DocumentExistsException, so no latency is recorded for an insert that did not happen
+        value = compress_payload(self.payload, self.compression)
+        response = self.get_collection().insert(self.key, value, self.opts)
+        self.record_payload(payload_size=len(self.payload), value_size=len(value))
+        return response
+
+class BinaryUpdateOperation(BinaryOperation):
+    """ Operation representing the replacement of a raw binary value in database """
+    def __init__(self, verbose=False, data_file_name="", cluster=None, bucket_name="", payload=b"", doc_key=0,
+            durability_level="low", compression=COMPRESSION_NONE):
+        super().__init__(verbose=verbose, data_file_name=data_file_name, cluster=cluster, bucket_name=bucket_name,
+            doc_key=doc_key, compression=compression, operation_type='BINARY_UPDATE')
+        self.payload = payload
+        self.opts = ReplaceOptions(timeout=timedelta(seconds=10), durability=DURABILITY_MAP[durability_level],
+            transcoder=RAW_BINARY_TRANSCODER)
+
+    def execute(self):
+        value = compress_payload(self.payload, self.compression)
+        response = self.get_collection().replace(self.key, value, self.opts)
+        self.record_payload(payload_size=len(self.payload), value_size=len(value))
+        return response
+
+class BinaryGetOperation(BinaryOperation):
+    """ Operation representing a get of a raw binary value by its key from database """
+    def __init__(self, verbose=False, data_file_name="", cluster=None, bucket_name="", doc_key=0,
+            compression=COMPRESSION_NONE):
+        super().__init__(verbose=verbose, data_file_name=data_file_name, cluster=cluster, bucket_name=bucket_name,
+            doc_key=doc_key, compression=compression, operation_type='BINARY_GET')
+        self.opts = GetOptions(timeout=timedelta(seconds=10), transcoder=RAW_BINARY_TRANSCODER)
+
+    def execute(self):
+        response = self.get_collection().get(self.key, self.opts)
+        value = response.content
+        payload = decompress_payload(value, self.compression)
+        self.record_payload(payload_size=len(payload), value_size=len(value))
+        return response
+
 
 class OperationCommander:
-    def __init__(self):
+    def __init__(self, sampling_mode=SAMPLING_RESERVOIR, seed=None):
         self.n1ql_query_operations = []
         self.full_text_search_operations = []
         self.insert_operations = []
         self.delete_operations = []
         self.update_operations = []
         self.get_doc_by_key_operations = []
+        self.binary_operations = []
+        self.sampling_mode = sampling_mode
+        self.random = random.Random(seed)
+        # state of the phase started by begin_phase (None outside a phase)
+        self.phase = None
+        # called as on_append(file name, size before the append) before each data file is appended to, so an
+        # experiment journal can truncate the lines of an interrupted sweep cell (see ExperimentMatrix)
+        self.on_append = None
+
+    def begin_phase(self, name="", sample_size=100, expected_operations=None):
+        """ Start a phase: until end_phase every executed operation is counted (no timing), and sample_size of
+        them are timed and buffered, chosen by the sampling mode so the sample represents the whole phase.
+        every_k needs expected_operations to spread the sample; without it the first sample_size are taken """
+        self.phase = {
+            'name': name,
+            'sample_size': sample_size,
+            'k': max(1, (expected_operations or sample_size) // max(1, sample_size)),
+            'operations': 0,
+            'counts': Counter(),
+            # (operation index, operation, latency); flushed in phase order by end_phase
+            'samples': [],
+            'start': time.time(),
+        }
+
+    def get_sample_slot(self):
+        """ Decide, before the phase's next operation runs, whether it is sampled: return the index in the
+        sample buffer it goes to (appended or replacing a reservoir entry), or None to run it untimed """
+        phase = self.phase
+        i, sample_size, samples = phase['operations'], phase['sample_size'], phase['samples']
+        if self.sampling_mode == SAMPLING_RESERVOIR:
+            if len(samples) < sample_size:
+                return len(samples)
+            # Algorithm R: operation i replaces a random entry with probability sample_size / (i + 1)
+            j = self.random.randint(0, i)
+            return j if j < sample_size else None
+        if len(samples) >= sample_size:
+            return None
+        if self.sampling_mode == SAMPLING_EVERY_K and i % phase['k']:
+            return None
+        return len(samples)
+
+    def end_phase(self):
+        """ Flush the phase's sampled latencies (one write per data file) and return a summary with the
+        always-on counters: operations executed, per operation type, recorded samples and wall time """
+        phase, self.phase = self.phase, None
+        if phase is None:
+            return None
+        samples = sorted(phase['samples'], key=lambda sample: sample[0])
+        self.record_latencies([(operation, diff) for _, operation, diff in samples])
+        return {
+            'phase': phase['name'],
+            'sampling_mode': self.sampling_mode,
+            'operations': phase['operations'],
+            'counts': dict(phase['counts']),
+            'recorded': len(samples),
+            'seconds': time.time() - phase['start'],
+        }
 
     def execute_operation(self, operation=None, record_operation_latency=False):
-        """ Method to take in an operation (an object representing an operation to be executed) and measure the time of its execution """
+        """ Method to take in an operation (an object representing an operation to be executed) and measure the time of its execution.
+        Inside a phase the sampler decides whether the operation is timed, and record_operation_latency is ignored """
+        if self.phase is not None:
+            return self.execute_phase_operation(operation)
         start = time.time()
         operation.execute()
         end = time.time()
         diff = end - start
 
         if record_operation_latency: # Save latency
+            self.record_latencies([(operation, diff)])
+
+    def execute_phase_operation(self, operation=None):
+        phase = self.phase
+        slot = self.get_sample_slot()
+        if slot is None:
+            operation.execute()
+        else:
+            start = time.time()
+            operation.execute()
+            sample = (phase['operations'], operation, time.time() - start)
+            if slot < len(phase['samples']):
+                phase['samples'][slot] = sample
+            else:
+                phase['samples'].append(sample)
+        phase['operations'] += 1
+        phase['counts'][type(operation).__name__] += 1
+
+    def record_latencies(self, samples=None):
+        """ Append (operation, latency) samples to their operations' data files, opening each file once """
+        lines = {}
+        for operation, diff in samples or []:
+            data_file_name = operation.get_data_file_name()
+            data_folder = os.path.dirname(data_file_name)
             # write this latency as a new line in the operation's designated file
-            with open(operation.get_data_file_name(), 'a') as f:
-                f.write(f'{diff}\n')
-            if isinstance(operation, N1QLQueryOperation):
-                self.n1ql_query_operations.append(operation)
-            elif isinstance(operation, FullTextSearchOperation):
-                self.full_text_search_operations.append(operation)
-            elif isinstance(operation, InsertOperation):
-                self.insert_operations.append(operation)
-            elif isinstance(operation, UpdateOperation):
-                self.update_operations.append(operation)
-            elif isinstance(operation, DeleteOperation):
-                self.delete_operations.append(operation)
-            elif isinstance(operation, GetFullDocByKeyOperation):
-                self.get_doc_by_key_operations.append(operation)
\ No newline at end of file
+            lines.setdefault(data_file_name, []).append(f'{diff}\n')
+            # queries also record their expected result-set size, line-aligned with latencies.txt
+            expected_matches = getattr(operation, 'expected_matches', None)
+            if expected_matches is not None:
+                lines.setdefault(os.path.join(data_folder, 'expected_matches.txt'), []).append(
+                    f'{expected_matches}\n')
+            # binary operations record "<payload bytes> <wire bytes>", line-aligned with latencies.txt
+            wire_bytes = getattr(operation, 'wire_bytes', None)
+            if wire_bytes is not None:
+                lines.setdefault(os.path.join(data_folder, 'payload_bytes.txt'), []).append(
+                    f'{operation.payload_size} {wire_bytes}\n')
+            self.keep_operation(operation)
+        for file_name, file_lines in lines.items():
+            if self.on_append:
+                self.on_append(file_name, os.path.getsize(file_name) if os.path.exists(file_name) else 0)
+            with open(file_name, 'a') as f:
+                f.writelines(file_lines)
+
+    def keep_operation(self, operation=None):
+        if isinstance(operation, N1QLQueryOperation):
+            self.n1ql_query_operations.append(operation)
+        elif isinstance(operation, FullTextSearchOperation):
+            self.full_text_search_operations.append(operation)
+        elif isinstance(operation, InsertOperation):
+            self.insert_operations.append(operation)
+        elif isinstance(operation, UpdateOperation):
+            self.update_operations.append(operation)
+        elif isinstance(operation, DeleteOperation):
+            self.delete_operations.append(operation)
+        elif isinstance(operation, GetFullDocByKeyOperation):
+            self.get_doc_by_key_operations.append(operation)
+        elif isinstance(operation, BinaryOperation):
+            self.binary_operations.append(operation)
@@ -0,0 +1,185 @@
+""" Packed single-file corpus of pre-serialized JSON documents. Documents are stored back to back
+in one data file (<name>.dat) alongside an offset index (<name>.idx) of unsigned 64-bit offsets, so a
+corpus of any size costs two inodes instead of one file per document. The data file is read through
+mmap, so any process can pull any document out of the shared page cache without copying it.
+A corpus may also be built as several shards (one per worker process) tied together by a merged
+shard manifest (<name>.manifest.json); open_corpus opens either layout behind the same interface. """
+
+import array
+import bisect
+import json
+import mmap
+import os
+import random
+
+DATA_SUFFIX = '.dat'
+INDEX_SUFFIX = '.idx'
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+class PackedCorpus:
+    def __init__(self, path=""):
+        """ Open the packed corpus at path (the shared prefix of the .dat and .idx files) """
+        self.path = path
+        self.data_file = f'{path}{DATA_SUFFIX}'
+        self.index_file = f'{path}{INDEX_SUFFIX}'
+        self.offsets = array.array('Q')
+        with open(self.index_file, 'rb') as f:
+            self.offsets.frombytes(f.read())
+        self._file = open(self.data_file, 'rb')
+        # mmap refuses to map an empty file
+        self._mmap = None
+        if self.offsets and self.offsets[-1] > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap) if self._mmap else memoryview(b'')
+
+    def __len__(self):
+        # index holds one trailing end offset
+        return max(len(self.offsets) - 1, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._view.release()
+        if self._mmap:
+            self._mmap.close()
+        self._file.close()
+
+    def get_raw_doc(self, index=0):
+        """ Return a zero-copy memoryview over the serialized JSON bytes of document at index """
+        return self._view[self.offsets[index]:self.offsets[index + 1]]
+
+    def get_doc(self, index=0):
+        """ Return the decoded JSON document at index """
+        return json.loads(bytes(self.get_raw_doc(index)))
+
+    def get_random_raw_doc(self):
+        return self.get_raw_doc(random.randrange(len(self)))
+
+    def get_random_doc(self):
+        return self.get_doc(random.randrange(len(self)))
+
+    @staticmethod
+    def exists(path=""):
+        return os.path.exists(f'{path}{DATA_SUFFIX}') and os.path.exists(f'{path}{INDEX_SUFFIX}')
+
+    @staticmethod
+    def write(path="", docs=None):
+        """ Serialize an iterable of documents (dicts or already-encoded JSON bytes) into a packed corpus
+        at path; return the number of documents written """
+        offsets = array.array('Q', [0])
+        with open(f'{path}{DATA_SUFFIX}', 'wb') as f:
+            for doc in docs or []:
+                record = doc if isinstance(doc, (bytes, bytearray)) else json.dumps(doc).encode()
+                f.write(record)
+                offsets.append(offsets[-1] + len(record))
+        with open(f'{path}{INDEX_SUFFIX}', 'wb') as f:
+            offsets.tofile(f)
+        return len(offsets) - 1
+
+    @staticmethod
+    def pack_folder(folder="", path=""):
+        """ Convert a folder of one-document-per-file JSON (e.g. random_docs) into a packed corpus at path """
+        def raw_docs():
+            for filename in sorted(os.listdir(folder)):
+                if filename.endswith('.json'):
+                    with open(os.path.join(folder, filename), 'rb') as f:
+                        # round trip so every record is compact and newline free
+                        yield json.dumps(json.load(f)).encode()
+        return PackedCorpus.write(path=path, docs=raw_docs())
+
+    @staticmethod
+    def unpack_to_folder(path="", folder=""):
+        """ Convert a packed corpus at path (sharded or single file) back into one JSON file per document
+        in folder """
+        os.makedirs(folder, exist_ok=True)
+        with open_corpus(path) as corpus:
+            for i in range(len(corpus)):
+                with open(os.path.join(folder, f'{i}.json'), 'wb') as f:
+                    f.write(corpus.get_raw_doc(i))
+            return len(corpus)
+
+
+class ShardedPackedCorpus:
+    def __init__(self, path=""):
+        """ Open the sharded corpus described by the manifest at path (written by merge_shards) """
+        self.path = path
+        with open(f'{path}{MANIFEST_SUFFIX}') as f:
+            self.manifest = json.load(f)
+        folder = os.path.dirname(path)
+        self.shards = [PackedCorpus(os.path.join(folder, shard['name'])) for shard in self.manifest['shards']]
+        # first global document index held by each shard
+        self.shard_starts = []
+        total = 0
+        for shard in self.shards:
+            self.shard_starts.append(total)
+            total += len(shard)
+        self.num_docs = total
+
+    def __len__(self):
+        return self.num_docs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def _locate(self, index=0):
+        shard_number = bisect.bisect_right(self.shard_starts, index) - 1
+        return self.shards[shard_number], index - self.shard_starts[shard_number]
+
+    def get_raw_doc(self, index=0):
+        shard, local_index = self._locate(index)
+        return shard.get_raw_doc(local_index)
+
+    def get_doc(self, index=0):
+        shard, local_index = self._locate(index)
+        return shard.get_doc(local_index)
+
+    def get_random_raw_doc(self):
+        return self.get_raw_doc(random.randrange(len(self)))
+
+    def get_random_doc(self):
+        return self.get_doc(random.randrange(len(self)))
+
+    @staticmethod
+    def exists(path=""):
+        return os.path.exists(f'{path}{MANIFEST_SUFFIX}')
+
+
+def get_shard_path(path="", shard_index=0):
+    return f'{path}-shard-{shard_index}'
+
+
+def merge_shards(path="", shard_paths=None):
+    """ Merge the indexes of independently written shards into one manifest at path so they can be
+    read as a single corpus; shard data files are left in place. Return the total number of documents """
+    shards = []
+    total = 0
+    for shard_path in shard_paths or []:
+        num_docs = max(os.path.getsize(f'{shard_path}{INDEX_SUFFIX}') // array.array('Q').itemsize - 1, 0)
+        shards.append({'name': os.path.basename(shard_path), 'num_docs': num_docs})
+        total += num_docs
+    with open(f'{path}{MANIFEST_SUFFIX}', 'w') as f:
+        json.dump({'num_docs': total, 'shards': shards}, f)
+    return total
+
+
+def corpus_exists(path=""):
+    return ShardedPackedCorpus.exists(path) or PackedCorpus.exists(path)
+
+
+def open_corpus(path=""):
+    """ Open the corpus at path, sharded (manifest) or single file """
+    if ShardedPackedCorpus.exists(path):
+        return ShardedPackedCorpus(path)
+    return PackedCorpus(path)
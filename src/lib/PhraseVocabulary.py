@@ -0,0 +1,110 @@
+""" Searchable phrase vocabulary with a controllable term frequency distribution. Decides which vandy_phrase
+each document carries and how many documents a query for a given phrase is expected to match, so N1QL/FTS
+result-set size can be varied independently of bucket size. """
+
+import json
+import os
+import random
+
+UNIFORM = 'uniform'
+ZIPFIAN = 'zipfian'
+
+
+class PhraseVocabulary:
+    def __init__(self, phrases=None, distribution=UNIFORM, zipf_exponent=1.0, rare_terms=None, seed=0):
+        """
+        phrases: common phrases, most frequent first when distribution is zipfian
+        (default: the phrases in vandy_phrases.json).
+        distribution: 'uniform' or 'zipfian' (frequency of the phrase of rank k is proportional to 1/k^zipf_exponent).
+        rare_terms: {term: guaranteed number of matching documents}; rare terms are placed on exactly
+        that many documents and never drawn otherwise. Use single tokens so FTS counts are exact.
+        seed: fixes which documents carry which phrase, so document key k always gets the same phrase.
+        """
+        if distribution not in [UNIFORM, ZIPFIAN]:
+            raise Exception(f"Unsupported phrase distribution {distribution}; use {UNIFORM} or {ZIPFIAN}")
+        self.phrases = phrases if phrases else self.load_vandy_phrases()
+        self.distribution = distribution
+        self.zipf_exponent = zipf_exponent
+        self.rare_terms = rare_terms or {}
+        self.seed = seed
+        if distribution == ZIPFIAN:
+            weights = [1 / (rank ** zipf_exponent) for rank in range(1, len(self.phrases) + 1)]
+        else:
+            weights = [1] * len(self.phrases)
+        total = sum(weights)
+        self.probabilities = {p: w / total for p, w in zip(self.phrases, weights)}
+        self.cumulative_weights = []
+        running = 0
+        for w in weights:
+            running += w
+            self.cumulative_weights.append(running)
+        # num_docs -> {document index: rare term}
+        self._rare_assignments = {}
+
+    @staticmethod
+    def load_vandy_phrases():
+        vandy_phrases_file = os.path.join(os.path.dirname(__file__), 'vandy_phrases.json')
+        with open(vandy_phrases_file) as f:
+            return json.load(f)['vandy_phrases']
+
+    @classmethod
+    def from_config_file(cls, config_file=""):
+        """ Build a vocabulary from a JSON file, e.g.
+        {"distribution": "zipfian", "zipf_exponent": 1.1, "rare_terms": {"rareterm1": 1, "rareterm10": 10}}
+        ("phrases" is optional and defaults to vandy_phrases.json) """
+        with open(config_file) as f:
+            config = json.load(f)
+        return cls(
+            phrases=config.get('phrases'),
+            distribution=config.get('distribution', UNIFORM),
+            zipf_exponent=config.get('zipf_exponent', 1.0),
+            rare_terms=config.get('rare_terms'),
+            seed=config.get('seed', 0))
+
+    def get_config(self):
+        """ The settings that decide which document carries which phrase (the from_config_file format) """
+        return {
+            'phrases': self.phrases,
+            'distribution': self.distribution,
+            'zipf_exponent': self.zipf_exponent,
+            'rare_terms': self.rare_terms,
+            'seed': self.seed,
+        }
+
+    def get_rare_assignments(self, num_docs=0):
+        """ Spread each rare term over exactly its guaranteed number of distinct document indexes in [0, num_docs) """
+        if num_docs not in self._rare_assignments:
+            total_rare = sum(self.rare_terms.values())
+            if total_rare > num_docs:
+                raise Exception(f"Rare terms need {total_rare} documents but the bucket only holds {num_docs}")
+            positions = random.Random(self.seed).sample(range(num_docs), total_rare)
+            assignments = {}
+            for term, count in self.rare_terms.items():
+                for _ in range(count):
+                    assignments[positions.pop()] = term
+            self._rare_assignments[num_docs] = assignments
+        return self._rare_assignments[num_docs]
+
+    def phrase_for_document(self, key=0, num_docs=0):
+        """ The phrase carried by document key of a bucket holding num_docs documents keyed 0..num_docs-1 """
+        rare_term = self.get_rare_assignments(num_docs).get(int(key)) if self.rare_terms else None
+        if rare_term:
+            return rare_term
+        rng = random.Random(f'{self.seed}:{key}')
+        return rng.choices(self.phrases, cum_weights=self.cumulative_weights)[0]
+
+    def expected_matches(self, phrase="", num_docs=0):
+        """ How many of num_docs documents are expected to carry phrase; exact for rare terms,
+        the expectation under the frequency distribution for common phrases """
+        if phrase in self.rare_terms:
+            return self.rare_terms[phrase]
+        common_docs = num_docs - sum(self.rare_terms.values()) if self.rare_terms else num_docs
+        return round(common_docs * self.probabilities.get(phrase, 0))
+
+    def get_query_terms(self):
+        return self.phrases + list(self.rare_terms.keys())
+
+    def random_query_phrase(self):
+        """ Pick a query term uniformly over all terms (not weighted by frequency) so queries span
+        the whole range of result-set sizes, from rare terms to the most frequent phrase """
+        return random.choice(self.get_query_terms())
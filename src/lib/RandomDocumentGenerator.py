@@ -5,14 +5,69 @@ import random
 import json
 import logging
 import os
+import time
+import argparse
+import hashlib
+import multiprocessing
+import datetime
+import numpy as np
 from yaspin import yaspin
 from pathlib import Path
 
+try:
+    from .PackedCorpus import (
+        INDEX_SUFFIX, MANIFEST_SUFFIX, PackedCorpus, corpus_exists, get_shard_path, merge_shards, open_corpus
+    )
+except ImportError:
+    # run as a script (python lib/RandomDocumentGenerator.py): lib/ itself is on sys.path
+    from PackedCorpus import (
+        INDEX_SUFFIX, MANIFEST_SUFFIX, PackedCorpus, corpus_exists, get_shard_path, merge_shards, open_corpus
+    )
+
+# Byte table for vectorized string generation; index with random uint8s to draw whole batches at once
+ALPHANUMERIC_BYTES = np.frombuffer((string.ascii_letters + string.digits).encode(), dtype=np.uint8)
+
+# Field spec used by generate_schema_json_document when no schema is provided. Field types:
+#   string    {'length': N, 'cardinality': C (optional; draw from C distinct values)}
+#   int/float {'min': lo, 'max': hi, 'cardinality': C (optional, int only)}
+#   bool
+#   timestamp {'start': 'YYYY-MM-DD', 'days': span}  -> ISO 8601 string, range-scannable
+#   array     {'length': N or [min, max], 'items': field spec}
+#   object    {'fields': {name: field spec, ...}}
+DEFAULT_DOCUMENT_SCHEMA = {
+    'name': {'type': 'string', 'length': 16},
+    'category': {'type': 'string', 'length': 10, 'cardinality': 20},
+    'age': {'type': 'int', 'min': 18, 'max': 90},
+    'score': {'type': 'float', 'min': 0, 'max': 100},
+    'active': {'type': 'bool'},
+    'created_at': {'type': 'timestamp', 'start': '2020-01-01', 'days': 730},
+    'tags': {'type': 'array', 'length': [1, 8], 'items': {'type': 'string', 'length': 6, 'cardinality': 50}},
+    'address': {'type': 'object', 'fields': {
+        'city': {'type': 'string', 'length': 12, 'cardinality': 100},
+        'zip': {'type': 'int', 'min': 10000, 'max': 99999},
+        'geo': {'type': 'object', 'fields': {
+            'lat': {'type': 'float', 'min': -90, 'max': 90},
+            'lon': {'type': 'float', 'min': -180, 'max': 180},
+        }},
+    }},
+    'orders': {'type': 'array', 'length': [0, 4], 'items': {'type': 'object', 'fields': {
+        'order_id': {'type': 'int', 'min': 1, 'max': 10**9},
+        'amount': {'type': 'float', 'min': 1, 'max': 500},
+        'placed_at': {'type': 'timestamp', 'start': '2021-01-01', 'days': 365},
+    }}},
+}
+# json.dumps overhead of appending , "padding": "" to a document
+PADDING_FIELD_OVERHEAD = len(', "padding": ""')
+
 class RandomDocumentGenerator:
     def __init__(self, verbose=False):
         self.verbose = False
         self.random_docs_folder = os.path.join(os.path.dirname(__file__),'random_docs')
         Path(self.random_docs_folder).mkdir(parents=True, exist_ok=True)
+        # Packed single-file alternative to random_docs (random_docs_corpus.dat + random_docs_corpus.idx)
+        self.packed_corpus_path = os.path.join(os.path.dirname(__file__),'random_docs_corpus')
+        self.packed_corpus = None
+        self.vandy_phrases = None
         self.set_logger()
 
     def get_parent_folder(self):
@@ -46,12 +101,35 @@ class RandomDocumentGenerator:
         Reference: https://stackoverflow.com/questions/2257441/random-string-generation-with-upper-case-letters-and-digits """
         return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(size))
 
+    def generate_random_strings_batch(self, count=1, size=25, rng=None):
+        """ Vectorized counterpart of generate_random_string_of_length; draw count random
+        letter/number strings of size N from a single NumPy byte array """
+        rng = rng if rng is not None else np.random.default_rng()
+        indexes = rng.integers(0, len(ALPHANUMERIC_BYTES), size=(count, size), dtype=np.uint8)
+        # each row of bytes viewed as one fixed-width bytes value, then decoded in bulk
+        return ALPHANUMERIC_BYTES[indexes].view(f'S{size}').ravel().astype(f'U{size}').tolist()
+
+    def generate_binary_payload(self, size=1024, compressibility=0.0, rng=None):
+        """ Generate an opaque binary value of size bytes. The first (1 - compressibility) of it is uniformly
+        random and incompressible; the rest repeats a 64 byte block, so zlib shrinks the payload to roughly
+        (1 - compressibility) of its size """
+        rng = rng if rng is not None else np.random.default_rng()
+        random_size = int(size * (1 - compressibility))
+        block = rng.integers(0, 256, size=64, dtype=np.uint8).tobytes()
+        repeated_size = size - random_size
+        return (rng.integers(0, 256, size=random_size, dtype=np.uint8).tobytes()
+                + (block * (repeated_size // len(block) + 1))[:repeated_size])
+
+    def get_vandy_phrases(self):
+        """ Load (once) the list of searchable vandy phrases """
+        if self.vandy_phrases is None:
+            vandy_phrases_file = os.path.join(os.path.dirname(__file__),'vandy_phrases.json')
+            with open(vandy_phrases_file) as f:
+                self.vandy_phrases = json.load(f)['vandy_phrases']
+        return self.vandy_phrases
+
     def random_vandy_phrase(self):
-        vandy_phrases_file = os.path.join(os.path.dirname(__file__),'vandy_phrases.json')
-        f = open(vandy_phrases_file)
-        vandy_phrases = json.load(f)['vandy_phrases']
-        f.close()
-        return random.choice(vandy_phrases)
+        return random.choice(self.get_vandy_phrases())
 
     def generate_random_json_document(self, doc_size=25, key_size=25, value_size=25):
         """ Generate a random JSON document with doc_size pairs of key/vals"""
@@ -64,8 +142,171 @@ class RandomDocumentGenerator:
         doc['vandy_phrase'] = self.random_vandy_phrase()
         return doc
 
+    def generate_random_json_documents_batch(self, num_docs=1000, doc_size=25, key_size=25, value_size=25, rng=None):
+        """ Vectorized counterpart of generate_random_json_document; build num_docs documents
+        of the same shape from whole batches of keys, values and phrases drawn with NumPy """
+        rng = rng if rng is not None else np.random.default_rng()
+        keys = self.generate_random_strings_batch(count=num_docs * doc_size, size=key_size, rng=rng)
+        values = self.generate_random_strings_batch(count=num_docs * doc_size, size=value_size, rng=rng)
+        vandy_phrases = self.get_vandy_phrases()
+        phrase_choices = rng.integers(0, len(vandy_phrases), size=num_docs).tolist()
+        docs = []
+        for i in range(num_docs):
+            start, end = i * doc_size, (i + 1) * doc_size
+            doc = dict(zip(keys[start:end], values[start:end]))
+            doc['vandy_phrase'] = vandy_phrases[phrase_choices[i]]
+            docs.append(doc)
+        return docs
+
+    def generate_schema_value(self, spec=None, rng=None):
+        """ Generate one value for a schema field spec (see DEFAULT_DOCUMENT_SCHEMA) """
+        field_type = spec.get('type', 'string')
+        if field_type == 'string':
+            length = spec.get('length', 25)
+            if spec.get('cardinality'):
+                # one of cardinality distinct values, zero padded to length
+                return str(rng.randrange(spec['cardinality'])).zfill(length)
+            return ''.join(rng.choices(string.ascii_letters + string.digits, k=length))
+        if field_type == 'int':
+            if spec.get('cardinality'):
+                return spec.get('min', 0) + rng.randrange(spec['cardinality'])
+            return rng.randint(spec.get('min', 0), spec.get('max', 2**31 - 1))
+        if field_type == 'float':
+            return round(rng.uniform(spec.get('min', 0), spec.get('max', 1)), 4)
+        if field_type == 'bool':
+            return rng.random() < 0.5
+        if field_type == 'timestamp':
+            start = datetime.datetime.fromisoformat(spec.get('start', '2020-01-01'))
+            offset = datetime.timedelta(seconds=rng.randrange(spec.get('days', 365) * 86400))
+            return (start + offset).isoformat()
+        if field_type == 'array':
+            length = spec.get('length', 3)
+            if isinstance(length, (list, tuple)):
+                length = rng.randint(length[0], length[1])
+            return [self.generate_schema_value(spec=spec.get('items', {}), rng=rng) for _ in range(length)]
+        if field_type == 'object':
+            return {name: self.generate_schema_value(spec=field_spec, rng=rng)
+                    for name, field_spec in spec.get('fields', {}).items()}
+        raise Exception(f"Unsupported schema field type {field_type}")
+
+    def build_nested_schema(self, depth=3, fields_per_level=3, array_length=3, leaf_spec=None):
+        """ Build a schema nesting objects depth levels deep, fields_per_level leaves per level plus
+        one array of array_length leaves, e.g. to benchmark deep paths and array indexes """
+        leaf_spec = leaf_spec or {'type': 'string', 'length': 10, 'cardinality': 100}
+        fields = {f'field{i}': leaf_spec for i in range(fields_per_level)}
+        fields['values'] = {'type': 'array', 'length': array_length, 'items': leaf_spec}
+        if depth > 1:
+            fields['child'] = {'type': 'object', 'fields': self.build_nested_schema(
+                depth=depth - 1, fields_per_level=fields_per_level, array_length=array_length, leaf_spec=leaf_spec)}
+        return fields
+
+    def generate_schema_json_document(self, schema=None, target_size_bytes=None, rng=None):
+        """ Generate a document following schema ({field name: field spec}; default DEFAULT_DOCUMENT_SCHEMA),
+        plus the searchable vandy_phrase. If target_size_bytes is given, a padding string tops the serialized
+        document up to exactly that size; targets below the generated document's size get a flat document
+        (vandy_phrase and padding only), and targets too small even for that raise a ValueError """
+        rng = rng if rng is not None else random.Random()
+        doc = {name: self.generate_schema_value(spec=spec, rng=rng)
+               for name, spec in (schema or DEFAULT_DOCUMENT_SCHEMA).items()}
+        doc['vandy_phrase'] = rng.choice(self.get_vandy_phrases())
+        if target_size_bytes:
+            if len(json.dumps(doc)) + PADDING_FIELD_OVERHEAD > target_size_bytes:
+                doc = {'vandy_phrase': doc['vandy_phrase']}
+            padding_length = target_size_bytes - len(json.dumps(doc)) - PADDING_FIELD_OVERHEAD
+            if padding_length < 0:
+                raise ValueError(f'Target document size {target_size_bytes} B is below the smallest document '
+                                 f'({target_size_bytes - padding_length} B)')
+            doc['padding'] = ''.join(rng.choices(string.ascii_letters + string.digits, k=padding_length))
+        return doc
+
+    def generate_seeded_schema_json_document(self, seed=0, key=0, schema=None, target_size_bytes=None):
+        """ Deterministic counterpart of generate_schema_json_document for (seed, key) """
+        rng = random.Random(f'{seed}:{self.get_key_entropy(key)}')
+        return self.generate_schema_json_document(schema=schema, target_size_bytes=target_size_bytes, rng=rng)
+
+    def get_key_entropy(self, key=0):
+        """ Map a document key (int or str) to a stable integer; numeric strings map to their int value
+        so that key 5 and key '5' produce the same document """
+        if (isinstance(key, int) and key >= 0) or str(key).isdigit():
+            return int(key)
+        return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+    def generate_seeded_json_document(self, seed=0, key=0, doc_size=25, key_size=25, value_size=25):
+        """ Deterministically generate the document for (seed, key). The same pair always yields the
+        same document on any machine, so no corpus needs to be written to or read from disk """
+        rng = np.random.default_rng([seed, self.get_key_entropy(key)])
+        return self.generate_random_json_documents_batch(
+            num_docs=1, doc_size=doc_size, key_size=key_size, value_size=value_size, rng=rng)[0]
+
+    def stream_seeded_json_documents(self, seed=0, keys=None, doc_size=25, key_size=25, value_size=25):
+        """ Lazily yield (key, document) pairs for keys, each regenerated from (seed, key) on demand """
+        for key in keys or []:
+            yield key, self.generate_seeded_json_document(
+                seed=seed, key=key, doc_size=doc_size, key_size=key_size, value_size=value_size)
+
+    def iter_random_json_documents(self, num_docs=1000, doc_size=25, key_size=25, value_size=25,
+            vectorized=True, batch_size=10000, rng=None):
+        """ Yield num_docs random JSON documents, built in NumPy batches of batch_size if vectorized """
+        if not vectorized:
+            for _ in range(num_docs):
+                yield self.generate_random_json_document(doc_size=doc_size, key_size=key_size, value_size=value_size)
+            return
+        rng = rng if rng is not None else np.random.default_rng()
+        for batch_start in range(0, num_docs, batch_size):
+            yield from self.generate_random_json_documents_batch(
+                num_docs=min(batch_size, num_docs - batch_start),
+                doc_size=doc_size, key_size=key_size, value_size=value_size, rng=rng)
+
+    def benchmark_document_generation(self, num_docs=1000, doc_size=50, key_size=30, value_size=30):
+        """ Measure generation throughput (docs/sec) of the per-character and the vectorized generator """
+        results = {}
+        for label, vectorized in [('python', False), ('numpy', True)]:
+            start = time.time()
+            for _ in self.iter_random_json_documents(num_docs=num_docs, doc_size=doc_size,
+                    key_size=key_size, value_size=value_size, vectorized=vectorized):
+                pass
+            elapsed = time.time() - start
+            results[f'{label}_docs_per_sec'] = num_docs / elapsed if elapsed else float('inf')
+            self.info(f'{label} generator: {num_docs} docs in {elapsed:.3f}s ({results[f"{label}_docs_per_sec"]:.1f} docs/sec)')
+        results['speedup'] = results['numpy_docs_per_sec'] / results['python_docs_per_sec']
+        self.info(f'Vectorized speedup: {results["speedup"]:.1f}x')
+        return results
+
+    def get_packed_corpus(self):
+        """ Lazily open (mmap) the packed corpus if one has been built, else return None """
+        if self.packed_corpus is None and corpus_exists(self.packed_corpus_path):
+            self.packed_corpus = open_corpus(self.packed_corpus_path)
+        return self.packed_corpus
+
+    def pack_random_docs(self):
+        """ Convert the random_docs folder into the packed corpus format """
+        self.info(f"Packing random_docs folder into {self.packed_corpus_path}")
+        self.remove_packed_corpus()
+        num_docs = PackedCorpus.pack_folder(folder=self.random_docs_folder, path=self.packed_corpus_path)
+        self.info(f"Packed {num_docs} documents")
+        return num_docs
+
+    def unpack_random_docs(self):
+        """ Convert the packed corpus back into one file per document in the random_docs folder """
+        self.info(f"Unpacking {self.packed_corpus_path} into random_docs folder")
+        return PackedCorpus.unpack_to_folder(path=self.packed_corpus_path, folder=self.random_docs_folder)
+
+    def get_corpus_id(self):
+        """ Identify the corpus random documents are drawn from (name, document count and build time),
+        so a dataset loaded from it can be recognized later """
+        path = self.packed_corpus_path
+        for suffix in [MANIFEST_SUFFIX, INDEX_SUFFIX]:
+            if os.path.exists(f'{path}{suffix}'):
+                with open_corpus(path) as corpus:
+                    return f'{os.path.basename(path)}:{len(corpus)}:{int(os.path.getmtime(f"{path}{suffix}"))}'
+        return f'{os.path.basename(self.random_docs_folder)}:{len(os.listdir(self.random_docs_folder))}'
+
     def get_random_json_doc(self):
-        """ Get one of the pre-generated random JSON documents (as JSON, not a file pointer) """
+        """ Get one of the pre-generated random JSON documents (as JSON, not a file pointer).
+        Reads from the packed corpus when one exists, otherwise from the random_docs folder """
+        corpus = self.get_packed_corpus()
+        if corpus and len(corpus):
+            return corpus.get_random_doc()
         choices = os.listdir(self.random_docs_folder)
         random_doc_filename = random.choice(choices)
         random_doc_fullpath = os.path.join(self.random_docs_folder, random_doc_filename)
@@ -74,22 +315,114 @@ class RandomDocumentGenerator:
         f.close()
         return response
 
-    def generate_random_docs(self, num_docs=1000, doc_size=25, key_size=25, value_size=25):
-        """ Generate self.num_docs random JSON documents and write them to random_docs folder """
+    def get_random_json_doc_bytes(self):
+        """ Get one of the pre-generated random JSON documents as already-encoded JSON bytes; taken
+        straight from the packed corpus without a decode/encode round trip when one exists """
+        corpus = self.get_packed_corpus()
+        if corpus and len(corpus):
+            return bytes(corpus.get_random_raw_doc())
+        return json.dumps(self.get_random_json_doc()).encode()
+
+    def close_packed_corpus(self):
+        if self.packed_corpus is not None:
+            self.packed_corpus.close()
+            self.packed_corpus = None
+
+    def remove_packed_corpus(self):
+        """ Delete any packed corpus (single file or sharded) so a new one can replace it """
+        self.close_packed_corpus()
+        folder = os.path.dirname(self.packed_corpus_path)
+        prefix = os.path.basename(self.packed_corpus_path)
+        for filename in os.listdir(folder):
+            if filename.startswith(f'{prefix}.') or filename.startswith(f'{prefix}-shard-'):
+                os.remove(os.path.join(folder, filename))
+
+    def generate_random_docs_parallel(self, num_docs=1000, doc_size=25, key_size=25, value_size=25,
+            processes=None, seed=None, vectorized=True):
+        """ Build the packed corpus with a pool of worker processes. Each worker writes its own shard
+        (data + index) from its own seed, then the shard indexes are merged into one manifest. Shards are
+        only reproducible from seed when vectorized (the per-character generator draws from random) """
+        processes = processes or os.cpu_count()
+        seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.info(f"Building packed corpus of {num_docs} documents with {processes} processes (seed={seed})")
+        self.remove_packed_corpus()
+        shard_size, remainder = divmod(num_docs, processes)
+        shard_args = [
+            (get_shard_path(self.packed_corpus_path, i), shard_size + (1 if i < remainder else 0),
+                seed, i, doc_size, key_size, value_size, vectorized)
+            for i in range(processes)
+        ]
+        start = time.time()
+        with yaspin().white.bold.shark.on_blue as sp:
+            with multiprocessing.Pool(processes=processes) as pool:
+                pool.starmap(build_corpus_shard, shard_args)
+        total = merge_shards(path=self.packed_corpus_path, shard_paths=[args[0] for args in shard_args])
+        elapsed = time.time() - start
+        self.info(f"Successfully generated {total} documents in {elapsed:.2f}s ({total / elapsed:.1f} docs/sec)")
+        return total
+
+    def generate_random_docs(self, num_docs=1000, doc_size=25, key_size=25, value_size=25, packed=False,
+            vectorized=True, processes=1, seed=None):
+        """ Generate self.num_docs random JSON documents and write them to random_docs folder,
+        or to the packed corpus (one data file + offset index) if packed=True. Documents are built
+        in NumPy batches unless vectorized=False. With processes > 1 the packed corpus is built
+        as one shard per worker process, which needs packed=True """
+        if processes and processes > 1:
+            if not packed:
+                raise ValueError('parallel generation (processes > 1) only writes the packed corpus; pass packed=True')
+            return self.generate_random_docs_parallel(num_docs=num_docs, doc_size=doc_size, key_size=key_size,
+                value_size=value_size, processes=processes, seed=seed, vectorized=vectorized)
+        docs = self.iter_random_json_documents(
+            num_docs=num_docs, doc_size=doc_size, key_size=key_size, value_size=value_size, vectorized=vectorized)
+        if packed:
+            self.info(f"Populating random sample document data (packed corpus {self.packed_corpus_path})")
+            self.remove_packed_corpus()
+            with yaspin().white.bold.shark.on_blue as sp:
+                PackedCorpus.write(path=self.packed_corpus_path, docs=docs)
+            self.info("Successfully generated sample data!")
+            return
         self.info("Populating random sample document data (random_docs folder)")
+        # documents are read from the packed corpus in preference to the folder; drop it so it cannot go stale
+        self.remove_packed_corpus()
         with yaspin().white.bold.shark.on_blue as sp:
-            for i in range(num_docs):
+            for i, doc in enumerate(docs):
                 self.debug(f'Generating random JSON document {i}')
-                doc = self.generate_random_json_document(doc_size=doc_size, key_size=key_size, value_size=value_size)
                 filename = f'{self.generate_random_string_of_length(10)}.json'
                 self.debug(f'Writing document <doc_size={doc_size},key_size={key_size},value_size={value_size}> to {filename}')
                 with open(f'{self.random_docs_folder}/{filename}', 'w') as f:
                     json.dump(doc, f)
         self.info("Successfully generated sample data!")
+
+
+def build_corpus_shard(shard_path="", num_docs=0, seed=0, shard_index=0, doc_size=25, key_size=25, value_size=25,
+        vectorized=True):
+    """ Worker process entry point for generate_random_docs_parallel; write one packed shard
+    generated from the (seed, shard_index) stream """
+    gen = RandomDocumentGenerator(verbose=False)
+    rng = np.random.default_rng([seed, shard_index])
+    return PackedCorpus.write(path=shard_path, docs=gen.iter_random_json_documents(
+        num_docs=num_docs, doc_size=doc_size, key_size=key_size, value_size=value_size, vectorized=vectorized,
+        rng=rng))
+
+
 def main():
     """ Run this before testing to set up test data samples. Generates 5000 random JSON documents. Subsets can be used to """
+    parser = argparse.ArgumentParser(description='generate random JSON test documents')
+    parser.add_argument('-n', '--num-docs', type=int, default=5000, help='how many documents to generate? default=5000')
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='number of worker processes; > 1 builds a sharded packed corpus in parallel. default=1')
+    parser.add_argument('-p', '--packed', action='store_true',
+                        help='write the packed corpus instead of the random_docs folder (implied by --processes > 1)')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='base seed for parallel corpus generation')
+    parser.add_argument('-b', '--benchmark', action='store_true',
+                        help='report docs/sec of the per-character and vectorized generators instead of writing documents')
+    args = parser.parse_args()
     gen = RandomDocumentGenerator(verbose=True)
-    gen.generate_random_docs(num_docs=5000, doc_size=50, key_size=30, value_size=30)
+    if args.benchmark:
+        gen.benchmark_document_generation(num_docs=args.num_docs, doc_size=50, key_size=30, value_size=30)
+    else:
+        gen.generate_random_docs(num_docs=args.num_docs, doc_size=50, key_size=30, value_size=30,
+                                 packed=args.packed or args.processes > 1, processes=args.processes, seed=args.seed)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,5 +1,133 @@
+""" Service layouts of a heterogeneous cluster, the search space of valid layouts for N hosts and the
+topology changes needed to move between them """
+
+import itertools
+import random
+from collections import Counter
+
+import numpy as np
+
+SERVICES = ['data', 'index', 'query', 'fts']
+# Community Edition only supports nodes with these combinations of services
+COMMUNITY_SERVICE_COMBINATIONS = [
+    ('data',),
+    ('data', 'index', 'query'),
+    ('data', 'fts', 'index', 'query'),
+]
+# Enterprise Edition allows any non-empty combination on a node
+ENTERPRISE_SERVICE_COMBINATIONS = [tuple(sorted(c)) for n in range(1, len(SERVICES) + 1)
+                                   for c in itertools.combinations(SERVICES, n)]
+EDITION_SERVICE_COMBINATIONS = {
+    'community': COMMUNITY_SERVICE_COMBINATIONS,
+    'enterprise': ENTERPRISE_SERVICE_COMBINATIONS,
+}
+# Sweeps with more valid layouts than this are sampled (e.g. enterprise edition on 4 followers has 3060)
+DEFAULT_MAX_LAYOUTS = 100
+# Services the cluster as a whole needs (besides the leader's) and the services each one depends on
+SERVICE_DEPENDENCIES = {
+    'query': ['index', 'data'],
+    'index': ['data'],
+    'fts': ['data'],
+}
+
+
+def plan_topology_change(current_node_services=None, target_node_services=None, spare_hosts=None):
+    """ Compute the smallest set of node removals and additions that turns the current followers
+    ({host: services}) into a cluster with the same multiset of per-node service sets as the target
+    ({host: services}; which host runs which set does not matter). Community Edition cannot change a node's
+    services in place, so a node whose services must change is removed and some host added with the new
+    services: spare_hosts (not in the cluster) are used first, so removals and additions fit in one
+    rebalance; only when no spare host is left is a removed host re-added, which needs a second rebalance.
+    Return {'keep': [hosts], 'remove': [hosts], 'add': {host: services}, 'readd': {host: services}} """
+    current = {host: frozenset(services) for host, services in (current_node_services or {}).items()}
+    unmatched = [frozenset(services) for services in (target_node_services or {}).values()]
+    keep = []
+    for host, services in current.items():
+        if services in unmatched:
+            unmatched.remove(services)
+            keep.append(host)
+    remove = [host for host in current if host not in keep]
+    spares = [host for host in spare_hosts or [] if host not in current]
+    removed = list(remove)
+    add, readd = {}, {}
+    for services in unmatched:
+        if spares:
+            add[spares.pop(0)] = sorted(services)
+        elif removed:
+            readd[removed.pop(0)] = sorted(services)
+        else:
+            raise Exception(f"Not enough hosts for the target layout ({len(target_node_services)} nodes)")
+    return {'keep': keep, 'remove': remove, 'add': add, 'readd': readd}
+
+
+def generate_service_layouts(num_hosts=4, edition='community', allowed_combinations=None, leader_services=None):
+    """ List every valid layout of num_hosts followers, one ServiceLayout with explicit node_services per
+    layout. Each node runs one of the allowed service combinations (edition rules unless given). Hosts are
+    interchangeable, so layouts that only differ by which host runs what are symmetric duplicates and only
+    one (a multiset of combinations) is kept. A layout is valid if, together with leader_services, every
+    service it runs has the services it depends on somewhere in the cluster. """
+    combinations = [tuple(sorted(c)) for c in allowed_combinations or EDITION_SERVICE_COMBINATIONS[edition]]
+    layouts = []
+    for multiset in itertools.combinations_with_replacement(sorted(set(combinations)), num_hosts):
+        cluster_services = set(leader_services or []).union(*multiset)
+        if all(set(SERVICE_DEPENDENCIES.get(s, [])) <= cluster_services for s in cluster_services):
+            layouts.append(ServiceLayout(node_services=[list(c) for c in multiset]))
+    return layouts
+
+
+def sample_service_layouts(layouts=None, max_layouts=DEFAULT_MAX_LAYOUTS, seed=0):
+    """ At most max_layouts of layouts (all of them if max_layouts is 0 or None), drawn at random and kept in
+    their original order. The sample is seeded, so a resumed sweep gets the same layouts again """
+    layouts = list(layouts or [])
+    if not max_layouts or len(layouts) <= max_layouts:
+        return layouts
+    return [layouts[i] for i in sorted(random.Random(seed).sample(range(len(layouts)), max_layouts))]
+
+
+def get_reconfiguration_count(layout_a=None, layout_b=None):
+    """ Number of nodes whose services differ between two layouts (each one removed and re-added) """
+    a, b = Counter(layout_a.get_combinations()), Counter(layout_b.get_combinations())
+    return max(sum(a.values()), sum(b.values())) - sum((a & b).values())
+
+
+def order_service_layouts(layouts=None, start=None):
+    """ Order layouts so the sweep changes few nodes from one layout to the next: starting at start (or
+    the first layout), greedily step to the unvisited layout needing the fewest node reconfigurations.
+    Return (ordered layouts, total reconfigurations) """
+    layouts = list(layouts or [])
+    if not layouts:
+        return [], 0
+    combinations = sorted({c for layout in layouts for c in layout.get_combinations()})
+    index = {c: i for i, c in enumerate(combinations)}
+    # one row of per-combination node counts per layout; overlap of two layouts = sum of element-wise min
+    counts = np.zeros((len(layouts), len(combinations)), dtype=np.int32)
+    for row, layout in enumerate(layouts):
+        for c in layout.get_combinations():
+            counts[row, index[c]] += 1
+    sizes = counts.sum(axis=1)
+    current = 0
+    if start is not None:
+        start_counts = np.zeros(len(combinations), dtype=np.int32)
+        for c in start.get_combinations():
+            if c in index:
+                start_counts[index[c]] += 1
+        current = int(np.argmax(np.minimum(counts, start_counts).sum(axis=1) - sizes))
+    visited = np.zeros(len(layouts), dtype=bool)
+    order, total = [current], 0
+    visited[current] = True
+    for _ in range(len(layouts) - 1):
+        distances = np.maximum(sizes, sizes[current]) - np.minimum(counts, counts[current]).sum(axis=1)
+        distances[visited] = np.iinfo(np.int32).max
+        current = int(np.argmin(distances))
+        total += int(distances[current])
+        visited[current] = True
+        order.append(current)
+    return [layouts[i] for i in order], total
+
+
 class ServiceLayout:
-    def __init__(self, services_on_all_hosts=[], service_counts={}, services_on_remaining_hosts=[]):
+    def __init__(self, services_on_all_hosts=[], service_counts={}, services_on_remaining_hosts=[],
+            node_services=None):
         """
         Service Layout describing layout of heterogeneous services in a
         Couchbase cluster.
@@ -9,6 +137,7 @@ class ServiceLayout:
         services_on_all_hosts should be subset list of ["data", "fts", "query", "index"]
         service_counts should be something like
         {"data": 3}. Don't include a service in both args.
+        Alternatively node_services lists the services of every node explicitly (one list per follower).
         """
         for s in services_on_all_hosts:
             if s in service_counts:
@@ -17,14 +146,47 @@ class ServiceLayout:
         self.services_on_all_hosts = services_on_all_hosts
         self.service_counts = service_counts
         self.services_on_remaining_hosts = services_on_remaining_hosts
+        self.node_services = node_services
+
+    def get_combinations(self):
+        """ Service combination (sorted tuple) of every node of an explicit layout """
+        return [tuple(sorted(services)) for services in self.node_services or []]
 
     def __str__(self) -> str:
+        if self.node_services is not None:
+            return f"ServiceLayout(node_services={self.node_services})"
         return (
             f"ServiceLayout(all_nodes={self.services_on_all_hosts}"
             f"n_nodes={self.service_counts},remaining_nodes={self.services_on_remaining_hosts})"
         )
 
+    def get_node_services(self, hosts=None):
+        """ Assign services to hosts (in order) following this layout; return {host: [services]} """
+        if self.node_services is not None:
+            return {host: list(services) for host, services in zip(hosts or [], self.node_services)}
+        services_on_n_nodes = self.service_counts.copy()
+        node_services = {}
+        for host in hosts or []:
+            host_services = self.services_on_all_hosts.copy()
+            current_is_one_of_the_N_hosts = False
+            # decrement counts as they are assigned to hosts
+            for service, count in services_on_n_nodes.items():
+                if count > 0:
+                    current_is_one_of_the_N_hosts = True
+                    host_services.append(service)
+                    services_on_n_nodes[service] = count - 1
+            if not current_is_one_of_the_N_hosts:
+                # If this host is not one of the N hosts running a specific service,
+                # then it needs to run the 'remaining' services
+                host_services.extend(self.services_on_remaining_hosts)
+            node_services[host] = host_services
+        return node_services
+
     def get_simple_name(self):
+        if self.node_services is not None:
+            # canonical (sorted) so symmetric layouts share a name, e.g. NODES-1xdata+index+query-3xdata
+            counts = Counter('+'.join(c) for c in self.get_combinations())
+            return 'NODES-' + '-'.join(f'{n}x{c}' for c, n in sorted(counts.items()))
         fname = (
             f'ALL{"-".join(self.services_on_all_hosts)}-'
         )
@@ -0,0 +1,90 @@
+import unittest
+from unittest import mock
+
+from lib.AdminClient import AdminClient, AdminClientError, poll_until
+
+NODES = [
+    {'hostname': '10.0.0.1:8091', 'otpNode': 'ns_1@10.0.0.1', 'services': ['kv']},
+    {'hostname': 'ec2-2.compute.amazonaws.com:8091', 'otpNode': 'ns_1@ec2-2.compute.amazonaws.com',
+     'services': ['index', 'kv', 'n1ql']},
+]
+
+def make_response(status_code=200, body=None, text=""):
+    response = mock.Mock(status_code=status_code, text=text)
+    if body is None:
+        response.json.side_effect = ValueError
+    else:
+        response.json.return_value = body
+    return response
+
+class TestAdminClient(unittest.TestCase):
+    def setUp(self):
+        self.admin_client = AdminClient(address='10.0.0.1', username='admin', password='123456')
+
+    def test_get_service_names(self):
+        self.assertEqual('kv,n1ql,index,fts', AdminClient.get_service_names(['data', 'query', 'index', 'fts']))
+        self.assertEqual('kv,n1ql', AdminClient.get_service_names('data,query'))
+
+    def test_error_carries_status_and_server_message(self):
+        response = make_response(400, {'errors': {'name': 'Bucket with given name already exists'}})
+        with mock.patch.object(self.admin_client.session, 'request', return_value=response):
+            with self.assertRaises(AdminClientError) as context:
+                self.admin_client.create_bucket(bucket_name='small-bucket')
+        self.assertEqual(400, context.exception.status_code)
+        self.assertTrue(context.exception.already_exists())
+
+    def test_rebalance_ejects_matching_nodes(self):
+        responses = [make_response(200, {'nodes': NODES}), make_response(200, text='')]
+        with mock.patch.object(self.admin_client.session, 'request', side_effect=responses) as request:
+            self.admin_client.rebalance(eject_addresses=['ec2-2.compute.amazonaws.com'], wait=False)
+        data = request.call_args.kwargs['data']
+        self.assertEqual('ns_1@10.0.0.1,ns_1@ec2-2.compute.amazonaws.com', data['knownNodes'])
+        self.assertEqual('ns_1@ec2-2.compute.amazonaws.com', data['ejectedNodes'])
+
+    def test_rebalance_unknown_node(self):
+        with mock.patch.object(self.admin_client.session, 'request', return_value=make_response(200, {'nodes': NODES})):
+            with self.assertRaises(AdminClientError):
+                self.admin_client.rebalance(eject_addresses=['10.0.0.9'], wait=False)
+
+    def test_get_node_services(self):
+        with mock.patch.object(self.admin_client.session, 'request', return_value=make_response(200, {'nodes': NODES})):
+            node_services = self.admin_client.get_node_services()
+        self.assertEqual(['data'], node_services['10.0.0.1'])
+        self.assertEqual(['data', 'index', 'query'], node_services['ec2-2.compute.amazonaws.com'])
+
+    def test_rename_node(self):
+        with mock.patch.object(self.admin_client.session, 'request', return_value=make_response(200, text='')) as request:
+            self.admin_client.rename_node(hostname='ec2-1.compute.amazonaws.com')
+        self.assertEqual('http://10.0.0.1:8091/node/controller/rename', request.call_args.args[1])
+        self.assertEqual({'hostname': 'ec2-1.compute.amazonaws.com'}, request.call_args.kwargs['data'])
+
+    def test_wait_for_rebalance_reports_progress(self):
+        responses = [
+            make_response(200, [{'type': 'rebalance', 'status': 'running', 'progress': 40.0}]),
+            make_response(200, [{'type': 'rebalance', 'status': 'notRunning'}]),
+        ]
+        samples = []
+        with mock.patch.object(self.admin_client.session, 'request', side_effect=responses), \
+                mock.patch('lib.AdminClient.time.sleep'):
+            self.admin_client.wait_for_rebalance(on_progress=samples.append)
+        self.assertEqual(['running', 'notRunning'], [s['status'] for s in samples])
+
+    def test_failed_rebalance(self):
+        task = {'type': 'rebalance', 'status': 'notRunning', 'errorMessage': 'Rebalance exited'}
+        with mock.patch.object(self.admin_client.session, 'request', return_value=make_response(200, [task])):
+            with self.assertRaises(AdminClientError):
+                self.admin_client.wait_for_rebalance()
+
+    def test_poll_until_backs_off(self):
+        results = iter([False, False, True])
+        with mock.patch('lib.AdminClient.time.sleep') as sleep:
+            _, attempts = poll_until(lambda: next(results), description='bucket', initial_interval=0.1, backoff=2)
+        self.assertEqual(3, attempts)
+        self.assertEqual([mock.call(0.1), mock.call(0.2)], sleep.call_args_list)
+
+    def test_poll_until_times_out(self):
+        with self.assertRaises(AdminClientError):
+            poll_until(lambda: False, description='index', timeout=0, initial_interval=0)
+
+if __name__ == "__main__":
+    unittest.main()
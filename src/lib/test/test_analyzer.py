@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import unittest
+
+from lib.Analyzer import Analyzer
+
+class TestAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.analyzer = Analyzer()
+        self.analyzer.data_dir = self.folder.name
+        os.makedirs(os.path.join(self.folder.name, 'metrics'))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_metric(self, metric="", records=None):
+        with open(os.path.join(self.folder.name, 'metrics', f'{metric}.jsonl'), 'w') as f:
+            f.writelines(f'{json.dumps(r)}\n' for r in records)
+
+    def test_get_rebalance_stats(self):
+        self.write_metric('rebalance', [
+            {'value': 12.0, 'rebalance_id': 'a', 'docs_moved': 500, 'sweep': 'rebalance', 'bucket': 'small-bucket',
+             'replicas': 1, 'cluster_size': 2},
+            # rebalances outside the sweep are ignored
+            {'value': 3.0, 'rebalance_id': 'b', 'docs_moved': 0, 'layout': 'colocated', 'cluster_size': 1},
+        ])
+        self.write_metric('rebalance_progress', [
+            {'value': 50.0, 'rebalance_id': 'a', 'elapsed': 6.0},
+            {'value': 100, 'rebalance_id': 'a', 'elapsed': 12.0},
+        ])
+        stats = self.analyzer.get_rebalance_stats()
+        cell = stats[1]['small-bucket'][2]
+        self.assertEqual([12.0], cell['durations'])
+        self.assertEqual([500], cell['docs_moved'])
+        self.assertEqual([(6.0, 50.0), (12.0, 100)], cell['progress'])
+
+    def test_get_operation_stats_of_partitioned_run(self):
+        folder = os.path.join(self.folder.name, 'durability-low', 'cluster-size-1', 'small-bucket', 'insert')
+        os.makedirs(os.path.join(folder, 'partitions-2'))
+        with open(os.path.join(folder, 'latencies.txt'), 'w') as f:
+            f.write('0.001\n')
+        with open(os.path.join(folder, 'partitions-2', 'latencies.txt'), 'w') as f:
+            f.write('0.002\n0.004\n')
+        self.assertEqual([0.001], self.analyzer.get_operation_stats(operation='insert')['records'])
+        self.analyzer.partitions = 2
+        self.assertEqual([0.002, 0.004], self.analyzer.get_operation_stats(operation='insert')['records'])
+        # cells that ran alone on the whole pool
+        self.analyzer.partitions = 3
+        self.assertEqual([0.001], self.analyzer.get_operation_stats(operation='insert')['records'])
+
+    def test_get_doc_size_load_throughput_stats(self):
+        self.write_metric('load_throughput', [
+            {'value': 9000.0, 'bucket': 'small-bucket', 'doc_size': 256},
+            {'value': 11000.0, 'bucket': 'small-bucket', 'doc_size': 256},
+            {'value': 500.0, 'bucket': 'small-bucket', 'doc_size': 65536},
+            # loaded at the natural document size
+            {'value': 8000.0, 'bucket': 'small-bucket', 'doc_size': None},
+        ])
+        self.assertEqual({'small-bucket': {256: [9000.0, 11000.0], 65536: [500.0]}},
+                         self.analyzer.get_doc_size_load_throughput_stats())
+
+    def test_get_failover_recovery(self):
+        p99s = [0.001, 0.001, 0.001, 0.050, 0.004, 0.001, 0.001, 0.001]
+        windows = [{'start': i, 'seconds': 1, 'operation': 'all', 'p99': p99, 'count': 10, 'errors': 2 if i == 3 else 0}
+                   for i, p99 in enumerate(p99s)]
+        events = [(0, 'load_started'), (3, 'hard_failover_start'), (3.5, 'hard_failover_end'), (8, 'load_stopped')]
+        [recovery] = self.analyzer.get_failover_recovery(windows, events)
+        self.assertEqual('hard_failover', recovery['event'])
+        self.assertEqual(0.5, recovery['duration'])
+        # degraded through the window starting at 4s
+        self.assertEqual(2, recovery['time_to_recover'])
+        self.assertEqual(0.050, recovery['worst_p99'])
+        self.assertEqual(0.001, recovery['baseline_p99'])
+        self.assertEqual(2, recovery['errors'])
+
+    def test_remove_network_baseline(self):
+        self.write_metric('health_probe', [
+            {'value': 0.0002, 'cluster_size': 2, 'service': 'data', 'rtts': [0.0001, 0.0002, 0.0003]},
+        ])
+        self.assertEqual([0.0008, 0.0], self.analyzer.remove_network_baseline(
+            [0.001, 0.0001], cluster_size='cluster-size-2', service='data'))
+        # no probe for this cell: unchanged
+        self.assertEqual([0.001], self.analyzer.remove_network_baseline([0.001], cluster_size='cluster-size-3'))
+
+if __name__ == "__main__":
+    unittest.main()
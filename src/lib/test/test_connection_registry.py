@@ -0,0 +1,40 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from lib.ConnectionRegistry import ConnectionRegistry
+from lib.MetricsRecorder import MetricsRecorder
+
+class TestConnectionRegistry(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.metrics = MetricsRecorder(metrics_folder=self.folder.name)
+        self.registry = ConnectionRegistry(username='admin', password='123456', metrics=self.metrics)
+        patcher = mock.patch('lib.ConnectionRegistry.Cluster', side_effect=lambda *args, **kwargs: mock.Mock())
+        self.cluster_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_bootstraps_each_endpoint_once(self):
+        cluster = self.registry.get_cluster('10.0.0.1')
+        self.assertIs(cluster, self.registry.get_cluster('couchbase://10.0.0.1'))
+        self.assertEqual(1, self.cluster_class.call_count)
+        cluster.wait_until_ready.assert_called_once()
+        [record] = self.metrics.read('bootstrap')
+        self.assertEqual('couchbase://10.0.0.1', record['endpoint'])
+
+    def test_owner_gets_own_connection(self):
+        self.assertIsNot(self.registry.get_cluster('10.0.0.1'), self.registry.get_cluster('10.0.0.1', owner=1))
+
+    def test_reconnect(self):
+        first = self.registry.get_cluster('10.0.0.1')
+        other = self.registry.get_cluster('10.0.0.2')
+        self.registry.reconnect('10.0.0.1')
+        first.close.assert_called_once()
+        self.assertIsNot(first, self.registry.get_cluster('10.0.0.1'))
+        self.assertIs(other, self.registry.get_cluster('10.0.0.2'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import logging
+import os
+import tempfile
+import unittest
+
+from lib.ExperimentMatrix import (
+    CELL_DONE, CELL_FAILED, COST_BUCKET, COST_CLUSTER, COST_OPERATION, ExperimentJournal, ExperimentMatrix, get_cell_id
+)
+
+class TestExperimentMatrix(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.journal_file = os.path.join(self.folder.name, 'journal', 'sweep.jsonl')
+        self.latency_file = os.path.join(self.folder.name, 'latencies.data')
+        self.matrix = ExperimentMatrix(name='sweep', experiment='homogeneous',
+            dimensions={'durability_level': ['low', 'high'], 'cluster_size': [0, 1, 2]})
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def append_latency(self, journal, cell_id, line):
+        offset = os.path.getsize(self.latency_file) if os.path.exists(self.latency_file) else 0
+        journal.record_append(cell_id, self.latency_file, offset)
+        with open(self.latency_file, 'a') as f:
+            f.write(line)
+
+    def test_get_cells(self):
+        cells = self.matrix.get_cells()
+        self.assertEqual(6, len(cells))
+        self.assertEqual({'durability_level': 'low', 'cluster_size': 0}, cells[0])
+        self.assertEqual({'durability_level': 'low', 'cluster_size': 1}, cells[1])
+        self.assertEqual({'durability_level': 'high', 'cluster_size': 2}, cells[-1])
+        self.assertEqual(get_cell_id('homogeneous', cells[0]), get_cell_id('homogeneous', dict(cells[0])))
+        self.assertNotEqual(get_cell_id('homogeneous', cells[0]), get_cell_id('ycsb', cells[0]))
+
+    def test_resume_skips_done_cells(self):
+        calls = []
+        def run_cell(durability_level, cluster_size):
+            calls.append((durability_level, cluster_size))
+            if len(calls) == 4:
+                raise RuntimeError('node went away')
+        with self.assertRaises(RuntimeError):
+            self.matrix.run(run_cell, ExperimentJournal(self.journal_file))
+        failed_cell = {'durability_level': 'high', 'cluster_size': 0}
+        journal = ExperimentJournal(self.journal_file, resume=True)
+        self.assertEqual(CELL_FAILED, journal.cells[get_cell_id('homogeneous', failed_cell)]['status'])
+
+        calls.clear()
+        self.assertEqual((3, 3), self.matrix.run(lambda **cell: calls.append(cell), journal))
+        self.assertEqual(failed_cell, calls[0])
+        # everything is done now
+        self.assertEqual((0, 6), self.matrix.run(run_cell, ExperimentJournal(self.journal_file, resume=True)))
+        # without resume the sweep starts over
+        self.assertEqual((6, 0), self.matrix.run(lambda **cell: None, ExperimentJournal(self.journal_file)))
+
+    def test_rollback_of_interrupted_cell(self):
+        journal = ExperimentJournal(self.journal_file)
+        cells = self.matrix.get_cells()
+        done_id, interrupted_id = (get_cell_id('homogeneous', c) for c in cells[:2])
+        journal.record('started', done_id)
+        self.append_latency(journal, done_id, '1.0\n')
+        journal.record(CELL_DONE, done_id)
+        journal.record('started', interrupted_id)
+        self.append_latency(journal, interrupted_id, '2.0\n')
+        self.append_latency(journal, interrupted_id, '3.0\n')
+        # crash: the last journal line is torn
+        with open(self.journal_file, 'a') as f:
+            f.write('{"event": "done", "cell_')
+
+        journal = ExperimentJournal(self.journal_file, resume=True)
+        self.assertTrue(journal.is_done(done_id))
+        self.assertFalse(journal.is_done(interrupted_id))
+        self.assertEqual([self.latency_file], journal.rollback(interrupted_id))
+        with open(self.latency_file) as f:
+            self.assertEqual('1.0\n', f.read())
+        self.assertEqual([], journal.rollback(done_id))
+
+    def test_scheduled_cells(self):
+        matrix = ExperimentMatrix(experiment='homogeneous', dimensions={
+            'durability_level': ['low', 'medium', 'high'],
+            'cluster_size': [0, 1, 2, 3, 4],
+            'bucket': ['small-bucket', 'medium-bucket', 'large-bucket'],
+        }, costs={'cluster_size': COST_CLUSTER, 'bucket': COST_BUCKET})
+        cells = matrix.get_scheduled_cells()
+        # same cells, different order
+        self.assertCountEqual(matrix.get_cells(), cells)
+        self.assertEqual({'cluster_size': 0, 'bucket': 'small-bucket', 'durability_level': 'low'}, cells[0])
+        self.assertEqual(['low', 'medium', 'high'], [c['durability_level'] for c in cells[:3]])
+        # snake: the next cluster size starts on the bucket the previous one ended with
+        self.assertEqual('large-bucket', cells[8]['bucket'])
+        self.assertEqual({'cluster_size': 1, 'bucket': 'large-bucket', 'durability_level': 'low'}, cells[9])
+        self.assertEqual({COST_CLUSTER: 15, COST_BUCKET: 45, COST_OPERATION: 3},
+                         matrix.count_transitions(matrix.get_cells()))
+        self.assertEqual({COST_CLUSTER: 5, COST_BUCKET: 11, COST_OPERATION: 45}, matrix.count_transitions(cells))
+        self.assertLess(matrix.estimate_setup_seconds(cells), matrix.estimate_setup_seconds(matrix.get_cells()))
+
+    def test_schedule_keeps_operation_order(self):
+        matrix = ExperimentMatrix(experiment='ycsb', dimensions={
+            'fieldlength': [10, 100], 'operation': ['update', 'read', 'insert']}, costs={'fieldlength': COST_BUCKET})
+        self.assertEqual(['update', 'read', 'insert'] * 2, [c['operation'] for c in matrix.get_scheduled_cells()])
+
+    def test_report_savings(self):
+        matrix = ExperimentMatrix(experiment='homogeneous',
+            dimensions={'durability_level': ['low', 'high'], 'cluster_size': [0, 1]},
+            costs={'cluster_size': COST_CLUSTER}, transition_seconds={COST_CLUSTER: 100})
+        def run_cell(durability_level, cluster_size):
+            matrix.record_setup(COST_CLUSTER, 10)
+        matrix.run(run_cell, ExperimentJournal(self.journal_file))
+        # 4 resizes in declaration order, 2 scheduled; at the measured 10s each
+        self.assertEqual(20, matrix.report_savings(matrix.get_cells(), matrix.get_scheduled_cells()))
+
+    def test_logger_handler_attached_once(self):
+        ExperimentMatrix(name='other', dimensions={'cluster_size': [0]})
+        self.assertEqual(1, len(logging.getLogger('ExperimentMatrix').handlers))
+
+    def test_from_config_file(self):
+        matrix = ExperimentMatrix.from_config_file(
+            os.path.join(os.path.dirname(__file__), '..', 'experiment_matrix_example.json'))
+        self.assertEqual('homogeneous', matrix.experiment)
+        self.assertEqual(['durability_level', 'cluster_size', 'bucket', 'doc_size'], list(matrix.dimensions))
+        self.assertEqual(COST_BUCKET, matrix.get_cost_level('doc_size'))
+        self.assertEqual(24, len(matrix.get_cells()))
+        self.assertIn('durability-by-cluster-size.jsonl', matrix.get_journal_file())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from couchbase.collection import GetOptions
+from couchbase.exceptions import DocumentExistsException, DocumentNotFoundException, TimeoutException
+
+from lib.AdminClient import AdminClientError
+from lib.ClusterManager import ClusterManager
+from lib.ConnectionRegistry import ConnectionRegistry
+from lib.DataManager import DataManager
+from lib.FakeCouchbase import FakeBackend, FakeCluster, FaultInjector, LatencyModel
+from lib.MetricsRecorder import MetricsRecorder
+from lib.Operations import (
+    DEFAULT_COLLECTION, DEFAULT_SCOPE, BinaryInsertOperation, GetFullDocByKeyOperation, InsertOperation,
+    N1QLQueryOperation
+)
+
+BUCKET_NAME = 'fake-bucket'
+
+class TestFakeCouchbase(unittest.TestCase):
+    def setUp(self):
+        # no sleeping: these tests check behavior, not latency
+        self.backend = FakeBackend(latency_model=LatencyModel(scale=0))
+        self.admin_client = self.backend.get_admin_client(address='10.0.0.1')
+        self.admin_client.init_cluster(services=['data', 'index', 'query'])
+        self.admin_client.create_bucket(bucket_name=BUCKET_NAME, wait=False)
+        self.admin_client.create_scope(bucket_name=BUCKET_NAME, scope_name=DEFAULT_SCOPE)
+        self.admin_client.create_collection(bucket_name=BUCKET_NAME, scope_name=DEFAULT_SCOPE,
+            collection_name=DEFAULT_COLLECTION)
+        self.cluster = self.backend.connect('couchbase://10.0.0.1')
+        self.collection = self.cluster.bucket(BUCKET_NAME).scope(DEFAULT_SCOPE).collection(DEFAULT_COLLECTION)
+
+    def test_kv_operations(self):
+        InsertOperation(cluster=self.cluster, bucket_name=BUCKET_NAME, insert_doc={'a': 1}, doc_key=1).execute()
+        result = GetFullDocByKeyOperation(cluster=self.cluster, bucket_name=BUCKET_NAME, doc_key=1).execute()
+        self.assertEqual({'a': 1}, result.content_as[dict])
+        with self.assertRaises(DocumentExistsException):
+            self.collection.insert('1', {'a': 2})
+        self.collection.replace('1', {'a': 3})
+        self.assertEqual({'a': 3}, self.collection.get('1').content_as[dict])
+        self.collection.remove('1')
+        with self.assertRaises(DocumentNotFoundException):
+            self.collection.get('1')
+
+    def test_query_needs_primary_index(self):
+        default_collection = self.cluster.bucket(BUCKET_NAME).default_collection()
+        default_collection.upsert_multi({'1': {'vandy_phrase': 'commodores'}, '2': {'vandy_phrase': 'anchor'}})
+        query = N1QLQueryOperation(cluster=self.cluster, bucket_name=BUCKET_NAME, vandy_phrase='commodores')
+        with self.assertRaises(Exception):
+            query.execute()
+        self.cluster.query(f'CREATE PRIMARY INDEX ON `default`:`{BUCKET_NAME}`')
+        self.assertEqual([{BUCKET_NAME: {'vandy_phrase': 'commodores'}}], query.execute())
+        self.assertEqual(2, self.admin_client.get_buckets()[BUCKET_NAME]['items'])
+
+    def test_queries_match_preencoded_documents(self):
+        default_collection = self.cluster.bucket(BUCKET_NAME).default_collection()
+        default_collection.upsert('1', b'{"vandy_phrase": "commodores"}')
+        default_collection.upsert('2', memoryview(b'{"vandy_phrase": "anchor down"}'))
+        # raw binary values are never matched
+        default_collection.upsert('3', b'\x00\xff')
+        self.cluster.query(f'CREATE PRIMARY INDEX ON `default`:`{BUCKET_NAME}`')
+        rows = self.cluster.query(f'SELECT * FROM `{BUCKET_NAME}` WHERE vandy_phrase = "commodores"')
+        self.assertEqual([{BUCKET_NAME: {'vandy_phrase': 'commodores'}}], list(rows))
+        search = self.cluster.search_query(f'default_primary_index_{BUCKET_NAME.replace("-", "_")}', 'anchor')
+        self.assertEqual(['2'], [row['id'] for row in search])
+
+    def test_topology_changes(self):
+        self.admin_client.add_node(hostname='10.0.0.2', services=['data'])
+        self.admin_client.add_node(hostname='10.0.0.3', services=['data', 'fts'])
+        with self.assertRaises(AdminClientError):
+            self.admin_client.add_node(hostname='10.0.0.2', services=['data'])
+        self.admin_client.rebalance(eject_addresses=['10.0.0.3'])
+        self.assertEqual({'10.0.0.1': ['data', 'index', 'query'], '10.0.0.2': ['data']},
+                         self.admin_client.get_node_services())
+        self.admin_client.failover(address='10.0.0.2', graceful=False)
+        self.admin_client.set_recovery_type(address='10.0.0.2', recovery_type='delta')
+        self.admin_client.rebalance()
+        self.assertEqual(['active', 'active'], [n['clusterMembership'] for n in self.admin_client.get_nodes()])
+
+    def test_injected_faults(self):
+        self.backend.fault_injector.add_fault(operation='get', error='timeout', count=1)
+        self.collection.upsert('1', {'a': 1})
+        with self.assertRaises(TimeoutException):
+            self.collection.get('1')
+        self.assertEqual({'a': 1}, self.collection.get('1').content_as[dict])
+        self.assertEqual(1, self.backend.fault_injector.injected[('get', 'timeout')])
+
+    def test_latency_grows_with_durability(self):
+        model = LatencyModel(latencies={'insert': {'median_ms': 1, 'sigma': 0}, 'get': {'median_ms': 1, 'sigma': 0},
+                                        'insert:medium': {'median_ms': 10, 'sigma': 0}})
+        self.assertAlmostEqual(0.001, model.sample('insert'))
+        self.assertLess(model.sample('insert', 'low'), model.sample('insert', 'high'))
+        self.assertAlmostEqual(0.010, model.sample('insert', 'medium'))
+        # reads do not wait for durability
+        self.assertAlmostEqual(model.sample('get'), model.sample('get', 'high'))
+
+    def test_slow_operation_times_out(self):
+        backend = FakeBackend(latency_model=LatencyModel(latencies={'get': {'median_ms': 50, 'sigma': 0}}),
+            fault_injector=FaultInjector())
+        backend.get_admin_client(address='10.0.0.1').create_bucket(bucket_name=BUCKET_NAME, wait=False)
+        collection = backend.connect('10.0.0.1').bucket(BUCKET_NAME).default_collection()
+        with self.assertRaises(TimeoutException):
+            collection.get('1', GetOptions(timeout=timedelta(milliseconds=1)))
+
+    def test_from_config_file(self):
+        backend = FakeBackend.from_config_file(os.path.join(os.path.dirname(__file__), '..', 'fake_backend_faults.json'))
+        self.assertEqual(6.0, backend.latency_model.latencies['insert:high']['median_ms'])
+        self.assertEqual(['get', '*'], [f['operation'] for f in backend.fault_injector.faults])
+
+    def test_data_manager_readiness(self):
+        with tempfile.TemporaryDirectory() as folder:
+            metrics = MetricsRecorder(metrics_folder=folder)
+            dataman = DataManager(username='admin', password='123456', leader_address='10.0.0.1',
+                connection_registry=ConnectionRegistry(metrics=metrics, backend=self.backend),
+                admin_client=self.admin_client)
+            dataman.metrics = metrics
+            dataman.create_bucket(bucket_name='other-bucket')
+            dataman.create_primary_index(bucket_name='other-bucket')
+            self.assertTrue(dataman.kv_probe('other-bucket'))
+            self.assertTrue(dataman.primary_index_online('other-bucket'))
+            self.assertEqual({'bucket', 'primary-index'}, {r['resource'] for r in dataman.metrics.read('readiness')})
+
+    def test_create_existing_bucket_keeps_requested_replicas(self):
+        dataman = DataManager(username='admin', password='123456', leader_address='10.0.0.1',
+            connection_registry=ConnectionRegistry(backend=self.backend), admin_client=self.admin_client)
+        dataman.create_bucket(bucket_name='other-bucket', bucket_replicas=0)
+        self.assertIsNone(dataman.create_bucket(bucket_name='other-bucket', bucket_replicas=0))
+        self.assertEqual(0, self.admin_client.get_buckets()['other-bucket']['replicas'])
+        dataman.create_bucket(bucket_name='other-bucket', bucket_replicas=1)
+        self.assertEqual(1, self.admin_client.get_buckets()['other-bucket']['replicas'])
+
+    def test_bulk_load_closes_its_worker_connections(self):
+        with tempfile.TemporaryDirectory() as folder:
+            metrics = MetricsRecorder(metrics_folder=folder)
+            dataman = DataManager(username='admin', password='123456', leader_address='10.0.0.1',
+                connection_registry=ConnectionRegistry(metrics=metrics, backend=self.backend),
+                admin_client=self.admin_client, document_seed=7, load_workers=4, load_batch_size=10)
+            dataman.metrics = metrics
+            with mock.patch.object(FakeCluster, 'close') as close:
+                self.assertEqual(100, dataman.bulk_load(bucket_name=BUCKET_NAME, num_docs=100))
+            self.assertEqual(4, close.call_count)
+            self.assertEqual(4, len([r for r in metrics.read('bootstrap') if not r['shared']]))
+
+    def test_binary_operations_clear_leftover_keys(self):
+        dataman = DataManager(username='admin', password='123456', leader_address='10.0.0.1',
+            connection_registry=ConnectionRegistry(backend=self.backend), admin_client=self.admin_client)
+        # left behind by an interrupted run
+        self.collection.upsert('1', {'a': 1})
+        with self.assertRaises(DocumentExistsException):
+            BinaryInsertOperation(cluster=self.cluster, bucket_name=BUCKET_NAME, payload=b'\x00', doc_key=1).execute()
+        with tempfile.TemporaryDirectory() as folder, mock.patch.object(dataman, 'init_data_file',
+                side_effect=lambda operation='', **kwargs: os.path.join(folder, f'{operation}.txt')):
+            dataman.run_binary_operations(bucket_name=BUCKET_NAME, value_size=64, operations_to_record=3)
+            with open(os.path.join(folder, 'binary-insert.txt')) as f:
+                self.assertEqual(3, len(f.readlines()))
+        with self.assertRaises(DocumentNotFoundException):
+            self.collection.get('1')
+
+    def test_failed_rebalance_raises_and_is_not_recorded(self):
+        hosts = [{'public': a, 'private': a, 'dns': a} for a in ['10.0.0.1', '10.0.0.2']]
+        with tempfile.TemporaryDirectory() as folder:
+            metrics = MetricsRecorder(metrics_folder=folder)
+            cluster_manager = ClusterManager('admin', '123456', False, hosts=hosts, admin_client=self.admin_client,
+                connection_registry=ConnectionRegistry(backend=self.backend))
+            cluster_manager.metrics = metrics
+            with mock.patch.object(self.admin_client, 'rebalance', side_effect=AdminClientError('rebalance failed')):
+                with self.assertRaises(AdminClientError):
+                    cluster_manager.change_topology(node_services={'10.0.0.2': ['data']})
+            self.assertEqual([], metrics.read('rebalance'))
+            self.assertEqual(['add_nodes'], [r['phase'] for r in metrics.read('cluster_setup')])
+
+    def test_service_layouts_account_for_leader_services(self):
+        hosts = [{'public': a, 'private': a, 'dns': a} for a in ['10.0.0.1', '10.0.0.2']]
+        cluster_manager = ClusterManager('admin', '123456', False, hosts=hosts, admin_client=self.admin_client,
+            connection_registry=ConnectionRegistry(backend=self.backend))
+        self.assertEqual(['data', 'index', 'query'], sorted(cluster_manager.get_leader_services()))
+        # the leader already runs index and query, so a follower may run any combination that needs them
+        self.assertEqual(15, len(cluster_manager.generate_service_layouts(edition='enterprise')))
+        self.assertEqual(10, len(cluster_manager.generate_service_layouts(edition='enterprise', max_layouts=10)))
+
+    def test_fix_leader_address_readds_leader_with_one_rebalance(self):
+        hosts = [{'public': a, 'private': a, 'dns': a} for a in ['10.0.0.1', '10.0.0.2']]
+        cluster_manager = ClusterManager('admin', '123456', False, hosts=hosts, admin_client=self.admin_client,
+            connection_registry=ConnectionRegistry(backend=self.backend))
+        self.admin_client.add_node(hostname='10.0.0.2', services=['data'])
+        self.admin_client.rebalance()
+        with mock.patch.object(self.admin_client, 'rebalance', wraps=self.admin_client.rebalance) as rebalance:
+            cluster_manager.fix_leader_address()
+        # ejecting the leader and bringing it back in
+        self.assertEqual(2, rebalance.call_count)
+        self.assertEqual({'10.0.0.1', '10.0.0.2'}, set(self.backend.nodes))
+        self.assertEqual('10.0.0.1', self.admin_client.address)
+        with mock.patch.object(self.admin_client, 'add_node', side_effect=AdminClientError('join failed')):
+            with self.assertRaises(AdminClientError):
+                cluster_manager.fix_leader_address()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from lib.HealthProbe import HealthProbe, HealthProbeError, PROBE_ABORT, PROBE_WARN
+from lib.MetricsRecorder import MetricsRecorder
+
+HOSTS = [{'public': '127.0.0.1', 'private': '10.0.0.1', 'dns': 'node1'},
+         {'public': '127.0.0.2', 'private': '10.0.0.2', 'dns': 'node2'}]
+
+class TestHealthProbe(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.metrics = MetricsRecorder(metrics_folder=self.folder.name)
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+        self.folder.cleanup()
+
+    def make_probe(self, mode=PROBE_WARN, node_status='healthy'):
+        cluster_manager = mock.Mock(hosts=HOSTS)
+        cluster_manager.get_public_address.side_effect = lambda h: h['public']
+        cluster_manager.get_private_address.side_effect = lambda h: h['private']
+        cluster_manager.get_dns_name.side_effect = lambda h: h['dns']
+        cluster_manager.normalize_service.side_effect = lambda s: {'kv': 'data'}.get(s, s)
+        admin_client = cluster_manager.get_admin_client.return_value
+        admin_client.get_nodes.return_value = [{'hostname': 'node1:8091', 'services': ['kv'], 'status': node_status}]
+        admin_client.node_matches.side_effect = lambda n, a: n['hostname'].split(':')[0] == a
+        return HealthProbe(cluster_manager=cluster_manager, attempts=3, timeout=0.5, mode=mode, metrics=self.metrics)
+
+    def test_probe_port(self):
+        rtts, failures = self.make_probe().probe_port('127.0.0.1', self.port)
+        self.assertEqual(3, len(rtts))
+        self.assertEqual(0, failures)
+
+    def test_run_records_rtts_for_member_services(self):
+        with mock.patch.dict('lib.HealthProbe.SERVICE_PORTS', {'management': self.port, 'data': self.port}):
+            with mock.patch.object(HealthProbe, 'tcp_connect_rtt', return_value=0.001):
+                report = self.make_probe().run(cluster_size=2)
+        self.assertEqual(['management', 'data'], list(report['nodes']['127.0.0.1']['ports']))
+        self.assertEqual(['management'], list(report['nodes']['127.0.0.2']['ports']))
+        self.assertEqual([0.001] * 3, self.metrics.read('health_probe', host='127.0.0.1', service='data')[0]['rtts'])
+        self.assertEqual([], report['degraded'])
+
+    def test_abort_on_unhealthy_node(self):
+        with mock.patch.object(HealthProbe, 'tcp_connect_rtt', return_value=0.001):
+            with self.assertRaises(HealthProbeError):
+                self.make_probe(mode=PROBE_ABORT, node_status='unhealthy').run()
+
+    def test_slow_node(self):
+        nodes = {address: {'ports': {'management': {'p50': p50}}}
+                 for address, p50 in [('a', 0.001), ('b', 0.001), ('c', 0.010)]}
+        self.assertEqual(1, len(self.make_probe().find_slow_nodes(nodes)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import threading
+import unittest
+
+from lib.HostPool import CellQueue, partition_hosts, plan_partitions
+
+class TestHostPool(unittest.TestCase):
+    def test_plan_partitions(self):
+        # homogeneous sweep of cluster sizes 1-5 (3 cells each) on 10 hosts: two clusters of 5
+        self.assertEqual((5, 2, 8), plan_partitions(10, [n for n in range(1, 6) for _ in range(3)]))
+        # only small clusters: many partitions
+        self.assertEqual((2, 5, 2), plan_partitions(10, [1, 2] * 4))
+        # cells wider than a partition are cheaper on the whole pool than splitting nothing
+        self.assertEqual((1, 5, 4), plan_partitions(5, [1] * 6 + [5, 5]))
+        self.assertEqual((5, 1, 2), plan_partitions(5, [5, 5]))
+        self.assertEqual((5, 1, 0), plan_partitions(5, []))
+
+    def test_partition_hosts(self):
+        hosts = [f'host{i}' for i in range(7)]
+        self.assertEqual([['host0', 'host1', 'host2'], ['host3', 'host4', 'host5']], partition_hosts(hosts, 3, 2))
+
+    def test_cell_queue_packs_by_cluster_size(self):
+        cells = [{'cluster_size': size, 'bucket': bucket} for size in [0, 1, 2] for bucket in 'abc']
+        cells.append({'cluster_size': 1, 'bucket': 'd'})
+        queue = CellQueue(cells, lambda cell: cell['cluster_size'] + 1)
+        # largest group first, then the same cluster size while any is left
+        self.assertEqual({'cluster_size': 1, 'bucket': 'a'}, queue.next_cell())
+        self.assertEqual({'cluster_size': 2, 'bucket': 'a'}, queue.next_cell(3))
+        self.assertEqual({'cluster_size': 1, 'bucket': 'b'}, queue.next_cell(2))
+        self.assertEqual(7, len(queue))
+        queue.close()
+        self.assertIsNone(queue.next_cell(2))
+
+    def test_cell_queue_hands_each_cell_out_once(self):
+        cells = [{'cluster_size': size % 4, 'index': size} for size in range(200)]
+        queue = CellQueue(cells, lambda cell: cell['cluster_size'] + 1)
+        taken = []
+        def work():
+            nodes = None
+            cell = queue.next_cell(nodes)
+            while cell is not None:
+                taken.append(cell['index'])
+                nodes = cell['cluster_size'] + 1
+                cell = queue.next_cell(nodes)
+        workers = [threading.Thread(target=work) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(list(range(200)), sorted(taken))
+
+if __name__ == "__main__":
+    unittest.main()
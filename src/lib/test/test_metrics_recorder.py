@@ -0,0 +1,24 @@
+import unittest
+import tempfile
+
+from lib.MetricsRecorder import MetricsRecorder
+
+class TestMetricsRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.metrics = MetricsRecorder(metrics_folder=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_record_and_read(self):
+        self.metrics.record('readiness', 1.5, resource='bucket', name='small-bucket')
+        self.metrics.record('readiness', 0.2, resource='collection', name='small-bucket.s.c')
+        self.assertEqual(2, len(self.metrics.read('readiness')))
+        records = self.metrics.read('readiness', resource='bucket')
+        self.assertEqual(1, len(records))
+        self.assertEqual(1.5, records[0]['value'])
+        self.assertEqual([], self.metrics.read('missing-metric'))
+
+if __name__ == "__main__":
+    unittest.main()
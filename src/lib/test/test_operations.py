@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from lib.Operations import (
+    Operation, OperationCommander, SAMPLING_EVERY_K, SAMPLING_FIRST, SAMPLING_RESERVOIR
+)
+
+class CountingOperation(Operation):
+    """ Operation that only remembers its position in the phase """
+    def __init__(self, data_file_name="", index=0):
+        super().__init__(data_file_name=data_file_name, operation_type='COUNTING')
+        self.index = index
+
+    def execute(self):
+        return self.index
+
+class TestOperationCommander(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.data_file_name = os.path.join(self.folder.name, 'latencies.txt')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def run_phase(self, sampling_mode=SAMPLING_RESERVOIR, operations=1000, sample_size=10):
+        commander = OperationCommander(sampling_mode=sampling_mode, seed=7)
+        commander.begin_phase(name='insert', sample_size=sample_size, expected_operations=operations)
+        for i in range(operations):
+            commander.execute_operation(CountingOperation(self.data_file_name, i))
+        return commander.end_phase(), commander
+
+    def recorded_indexes(self, phase):
+        return [index for index, _, _ in phase['samples']]
+
+    def test_counters_cover_every_operation(self):
+        summary, _ = self.run_phase(operations=1000, sample_size=10)
+        self.assertEqual(1000, summary['operations'])
+        self.assertEqual({'CountingOperation': 1000}, summary['counts'])
+        self.assertEqual(10, summary['recorded'])
+        with open(self.data_file_name) as f:
+            self.assertEqual(10, len(f.readlines()))
+
+    def test_first_sampling(self):
+        commander = OperationCommander(sampling_mode=SAMPLING_FIRST)
+        commander.begin_phase(sample_size=5)
+        for i in range(50):
+            commander.execute_operation(CountingOperation(self.data_file_name, i))
+        self.assertEqual([0, 1, 2, 3, 4], self.recorded_indexes(commander.phase))
+
+    def test_every_k_sampling(self):
+        commander = OperationCommander(sampling_mode=SAMPLING_EVERY_K)
+        commander.begin_phase(sample_size=5, expected_operations=50)
+        for i in range(50):
+            commander.execute_operation(CountingOperation(self.data_file_name, i))
+        self.assertEqual([0, 10, 20, 30, 40], self.recorded_indexes(commander.phase))
+
+    def test_reservoir_spans_the_phase(self):
+        commander = OperationCommander(sampling_mode=SAMPLING_RESERVOIR, seed=7)
+        commander.begin_phase(sample_size=100)
+        for i in range(10000):
+            commander.execute_operation(CountingOperation(self.data_file_name, i))
+        indexes = self.recorded_indexes(commander.phase)
+        self.assertEqual(100, len(set(indexes)))
+        # a uniform sample of 0..9999 has most of its entries past the first 100 operations
+        self.assertGreater(sum(1 for i in indexes if i >= 5000), 25)
+        self.assertEqual(100, commander.end_phase()['recorded'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import os
+import json
+import tempfile
+
+from lib.PackedCorpus import PackedCorpus, get_shard_path, merge_shards, open_corpus
+
+class TestPackedCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'corpus')
+        self.docs = [{'key': i, 'vandy_phrase': 'vanderbilt'} for i in range(10)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_write_and_read(self):
+        self.assertEqual(10, PackedCorpus.write(path=self.path, docs=self.docs))
+        self.assertTrue(PackedCorpus.exists(self.path))
+        with PackedCorpus(self.path) as corpus:
+            self.assertEqual(10, len(corpus))
+            self.assertEqual(self.docs[3], corpus.get_doc(3))
+            self.assertEqual(json.dumps(self.docs[7]).encode(), bytes(corpus.get_raw_doc(7)))
+            self.assertTrue(corpus.get_random_doc() in self.docs)
+
+    def test_pack_and_unpack_folder(self):
+        folder = os.path.join(self.tmp.name, 'random_docs')
+        os.makedirs(folder)
+        for i, doc in enumerate(self.docs):
+            with open(os.path.join(folder, f'{i}.json'), 'w') as f:
+                json.dump(doc, f)
+        self.assertEqual(10, PackedCorpus.pack_folder(folder=folder, path=self.path))
+        unpacked_folder = os.path.join(self.tmp.name, 'unpacked')
+        self.assertEqual(10, PackedCorpus.unpack_to_folder(path=self.path, folder=unpacked_folder))
+        self.assertEqual(10, len(os.listdir(unpacked_folder)))
+
+    def test_merge_shards(self):
+        shard_paths = [get_shard_path(self.path, i) for i in range(3)]
+        PackedCorpus.write(path=shard_paths[0], docs=self.docs[:4])
+        PackedCorpus.write(path=shard_paths[1], docs=[])
+        PackedCorpus.write(path=shard_paths[2], docs=self.docs[4:])
+        self.assertEqual(10, merge_shards(path=self.path, shard_paths=shard_paths))
+        with open_corpus(self.path) as corpus:
+            self.assertEqual(10, len(corpus))
+            self.assertEqual(self.docs, [corpus.get_doc(i) for i in range(10)])
+        unpacked_folder = os.path.join(self.tmp.name, 'unpacked')
+        self.assertEqual(10, PackedCorpus.unpack_to_folder(path=self.path, folder=unpacked_folder))
+        self.assertEqual(10, len(os.listdir(unpacked_folder)))
+
+    def test_empty_corpus(self):
+        PackedCorpus.write(path=self.path, docs=[])
+        with PackedCorpus(self.path) as corpus:
+            self.assertEqual(0, len(corpus))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from collections import Counter
+
+from lib.PhraseVocabulary import PhraseVocabulary
+
+class TestPhraseVocabulary(unittest.TestCase):
+    def setUp(self):
+        self.vocabulary = PhraseVocabulary(
+            phrases=['common', 'less', 'least'],
+            distribution='zipfian',
+            zipf_exponent=1.0,
+            rare_terms={'rareterm1': 1, 'rareterm10': 10})
+
+    def test_rare_terms_have_guaranteed_counts(self):
+        counts = Counter(self.vocabulary.phrase_for_document(key=k, num_docs=1000) for k in range(1000))
+        self.assertEqual(1, counts['rareterm1'])
+        self.assertEqual(10, counts['rareterm10'])
+        self.assertEqual(1, self.vocabulary.expected_matches('rareterm1', num_docs=1000))
+        self.assertEqual(10, self.vocabulary.expected_matches('rareterm10', num_docs=1000))
+
+    def test_zipfian_frequencies(self):
+        counts = Counter(self.vocabulary.phrase_for_document(key=k, num_docs=5000) for k in range(5000))
+        self.assertTrue(counts['common'] > counts['less'] > counts['least'])
+        # p(common) = 1 / (1 + 1/2 + 1/3)
+        self.assertEqual(round(4989 * 6 / 11), self.vocabulary.expected_matches('common', num_docs=5000))
+
+    def test_phrase_for_document_is_deterministic(self):
+        self.assertEqual(
+            [self.vocabulary.phrase_for_document(key=k, num_docs=100) for k in range(100)],
+            [self.vocabulary.phrase_for_document(key=k, num_docs=100) for k in range(100)])
+
+    def test_default_vocabulary_is_uniform(self):
+        vocabulary = PhraseVocabulary()
+        self.assertEqual(round(3300 / len(vocabulary.phrases)), vocabulary.expected_matches('vanderbilt', num_docs=3300))
+
+    def test_get_config_round_trip(self):
+        vocabulary = PhraseVocabulary(**self.vocabulary.get_config())
+        self.assertEqual(
+            [self.vocabulary.phrase_for_document(key=k, num_docs=100) for k in range(100)],
+            [vocabulary.phrase_for_document(key=k, num_docs=100) for k in range(100)])
+
+if __name__ == "__main__":
+    unittest.main()
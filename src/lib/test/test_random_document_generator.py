@@ -1,5 +1,8 @@
 import unittest
 import os
+import json
+import tempfile
+import zlib
 
 from lib.RandomDocumentGenerator import RandomDocumentGenerator
 
@@ -69,6 +72,70 @@ class TestRandomDocumentGenerator(unittest.TestCase):
             self.assertTrue(val in self.vandy_phrases or len(val) == 25)
 
 
+    def test_generate_random_strings_batch(self):
+        rand_strings = self.rdg.generate_random_strings_batch(count=100, size=10)
+        self.assertEqual(100, len(rand_strings))
+        self.assertTrue(all(len(s) == 10 and s.isalnum() for s in rand_strings))
+
+    def test_generate_random_json_documents_batch(self):
+        random_docs = self.rdg.generate_random_json_documents_batch(num_docs=5, doc_size=25, key_size=25, value_size=25)
+        self.assertEqual(5, len(random_docs))
+        for random_doc in random_docs:
+            self.assertEqual(25 + 1, len(random_doc.keys()))
+            for key,val in random_doc.items():
+                self.assertTrue(key == "vandy_phrase" or len(key) == 25)
+                self.assertTrue(val in self.vandy_phrases or len(val) == 25)
+
+    def test_generate_seeded_json_document(self):
+        doc = self.rdg.generate_seeded_json_document(seed=42, key=7, doc_size=10, key_size=5, value_size=5)
+        self.assertEqual(doc, self.rdg.generate_seeded_json_document(seed=42, key='7', doc_size=10, key_size=5, value_size=5))
+        self.assertNotEqual(doc, self.rdg.generate_seeded_json_document(seed=42, key=8, doc_size=10, key_size=5, value_size=5))
+        self.assertNotEqual(doc, self.rdg.generate_seeded_json_document(seed=43, key=7, doc_size=10, key_size=5, value_size=5))
+
+    def test_stream_seeded_json_documents(self):
+        stream = self.rdg.stream_seeded_json_documents(seed=42, keys=range(3), doc_size=10, key_size=5, value_size=5)
+        for key, doc in stream:
+            self.assertEqual(doc, self.rdg.generate_seeded_json_document(seed=42, key=key, doc_size=10, key_size=5, value_size=5))
+
+    def test_generate_schema_json_document(self):
+        schema = self.rdg.build_nested_schema(depth=3, fields_per_level=2)
+        doc = self.rdg.generate_schema_json_document(schema=schema, target_size_bytes=2048)
+        self.assertEqual(2048, len(json.dumps(doc).encode()))
+        self.assertTrue(isinstance(doc['child'], dict))
+        self.assertTrue(doc['vandy_phrase'] in self.vandy_phrases)
+
+    def test_generate_seeded_schema_json_document(self):
+        doc = self.rdg.generate_seeded_schema_json_document(seed=42, key=7, target_size_bytes=1024)
+        self.assertEqual(doc, self.rdg.generate_seeded_schema_json_document(seed=42, key=7, target_size_bytes=1024))
+        self.assertEqual(1024, len(json.dumps(doc).encode()))
+
+    def test_generate_schema_json_document_below_schema_size(self):
+        # smaller than the schema allows: a flat document, still exactly the target size
+        for _ in range(20):
+            doc = self.rdg.generate_schema_json_document(target_size_bytes=256)
+            self.assertEqual(256, len(json.dumps(doc).encode()))
+        with self.assertRaises(ValueError):
+            self.rdg.generate_schema_json_document(target_size_bytes=16)
+
+    def test_generate_random_docs_replaces_packed_corpus(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.rdg.packed_corpus_path = os.path.join(tmp, 'random_docs_corpus')
+            self.rdg.random_docs_folder = tmp
+            with self.assertRaises(ValueError):
+                self.rdg.generate_random_docs(num_docs=10, processes=2)
+            self.rdg.generate_random_docs(num_docs=10, packed=True)
+            self.assertIsNotNone(self.rdg.get_packed_corpus())
+            # a new folder corpus must not be shadowed by the old packed one
+            self.rdg.generate_random_docs(num_docs=10)
+            self.assertIsNone(self.rdg.get_packed_corpus())
+
+    def test_generate_binary_payload(self):
+        payload = self.rdg.generate_binary_payload(size=100000, compressibility=0.5)
+        self.assertEqual(100000, len(payload))
+        self.assertTrue(len(zlib.compress(payload)) < 0.6 * len(payload))
+        incompressible = self.rdg.generate_binary_payload(size=100000, compressibility=0.0)
+        self.assertTrue(len(zlib.compress(incompressible)) > 0.99 * len(incompressible))
+
     def test_get_random_json_doc(self):
         self.assertTrue(isinstance(self.rdg.get_random_json_doc(),dict))
 
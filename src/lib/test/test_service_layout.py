@@ -0,0 +1,91 @@
+import unittest
+
+from lib.ServiceLayout import (
+    ServiceLayout, generate_service_layouts, get_reconfiguration_count, order_service_layouts, plan_topology_change,
+    sample_service_layouts
+)
+
+QUERY_LAYOUT_1 = ServiceLayout(service_counts={'query': 1, 'index': 1, 'data': 1}, services_on_remaining_hosts=['data'])
+QUERY_LAYOUT_2 = ServiceLayout(service_counts={'query': 2, 'index': 2, 'data': 2}, services_on_remaining_hosts=['data'])
+HOSTS = ['node1', 'node2', 'node3', 'node4']
+
+class TestServiceLayout(unittest.TestCase):
+    def test_get_node_services(self):
+        node_services = QUERY_LAYOUT_2.get_node_services(HOSTS)
+        self.assertEqual(['query', 'index', 'data'], node_services['node2'])
+        self.assertEqual(['data'], node_services['node3'])
+
+    def test_plan_unchanged_layout(self):
+        current = QUERY_LAYOUT_1.get_node_services(HOSTS)
+        plan = plan_topology_change(current, current, spare_hosts=HOSTS)
+        self.assertEqual(sorted(HOSTS), sorted(plan['keep']))
+        self.assertEqual(([], {}, {}), (plan['remove'], plan['add'], plan['readd']))
+
+    def test_plan_changes_only_one_node(self):
+        current = QUERY_LAYOUT_1.get_node_services(HOSTS[:3])
+        target = QUERY_LAYOUT_2.get_node_services(HOSTS[:3])
+        plan = plan_topology_change(current, target, spare_hosts=HOSTS)
+        # one data-only node is swapped for a spare host running query, index and data
+        self.assertEqual(1, len(plan['remove']))
+        self.assertEqual({'node4': ['data', 'index', 'query']}, plan['add'])
+        self.assertEqual({}, plan['readd'])
+
+    def test_plan_readds_when_no_spare_host(self):
+        current = QUERY_LAYOUT_1.get_node_services(HOSTS)
+        target = QUERY_LAYOUT_2.get_node_services(HOSTS)
+        plan = plan_topology_change(current, target, spare_hosts=HOSTS)
+        self.assertEqual(3, len(plan['keep']))
+        self.assertEqual({plan['remove'][0]: ['data', 'index', 'query']}, plan['readd'])
+
+    def test_plan_grows_and_shrinks(self):
+        current = {'node1': ['data']}
+        plan = plan_topology_change(current, {'node1': ['data'], 'node2': ['data']}, spare_hosts=HOSTS)
+        self.assertEqual({'node2': ['data']}, plan['add'])
+        plan = plan_topology_change({'node1': ['data'], 'node2': ['data']}, current, spare_hosts=HOSTS)
+        self.assertEqual(['node2'], plan['remove'])
+        self.assertEqual({}, plan['add'])
+
+    def test_generate_community_layouts(self):
+        layouts = generate_service_layouts(num_hosts=4, edition='community', leader_services=['data'])
+        # multisets of 4 out of 3 node combinations; every one is valid since all run data
+        self.assertEqual(15, len(layouts))
+        self.assertEqual(15, len({layout.get_simple_name() for layout in layouts}))
+
+    def test_generate_removes_symmetric_layouts(self):
+        layouts = generate_service_layouts(num_hosts=2, allowed_combinations=[['data'], ['data', 'index', 'query']])
+        self.assertEqual([[['data'], ['data']], [['data'], ['data', 'index', 'query']],
+                          [['data', 'index', 'query'], ['data', 'index', 'query']]],
+                         [layout.node_services for layout in layouts])
+
+    def test_generate_skips_invalid_layouts(self):
+        layouts = generate_service_layouts(num_hosts=1, allowed_combinations=[['query'], ['index'], ['data']],
+                                           leader_services=['data'])
+        # query alone lacks the index service it depends on
+        self.assertEqual([['data'], ['index']], [layout.node_services[0] for layout in layouts])
+
+    def test_sample_caps_enterprise_layouts(self):
+        layouts = generate_service_layouts(num_hosts=4, edition='enterprise',
+                                           leader_services=['data', 'index', 'query', 'fts'])
+        self.assertEqual(3060, len(layouts))
+        sampled = sample_service_layouts(layouts, max_layouts=50)
+        self.assertEqual(50, len(sampled))
+        # seeded: a resumed sweep samples the same layouts
+        self.assertEqual(sampled, sample_service_layouts(layouts, max_layouts=50))
+        self.assertEqual(3060, len(sample_service_layouts(layouts, max_layouts=0)))
+
+    def test_explicit_layout_node_services(self):
+        layout = ServiceLayout(node_services=[['data'], ['data', 'index', 'query']])
+        self.assertEqual({'node1': ['data'], 'node2': ['data', 'index', 'query']}, layout.get_node_services(HOSTS))
+        self.assertEqual('NODES-1xdata-1xdata+index+query', layout.get_simple_name())
+
+    def test_order_minimizes_reconfigurations(self):
+        layouts = generate_service_layouts(num_hosts=4, edition='community')
+        ordered, total = order_service_layouts(layouts, start=layouts[0])
+        self.assertEqual(sorted(l.get_simple_name() for l in layouts), sorted(l.get_simple_name() for l in ordered))
+        self.assertEqual(total, sum(get_reconfiguration_count(a, b) for a, b in zip(ordered, ordered[1:])))
+        # the generation order changes several nodes at a time; the greedy order does better
+        generated = sum(get_reconfiguration_count(a, b) for a, b in zip(layouts, layouts[1:]))
+        self.assertLess(total, generated)
+
+if __name__ == "__main__":
+    unittest.main()